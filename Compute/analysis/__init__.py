@@ -0,0 +1,9 @@
+"""
+Reusable analysis kernels for the bioinformatics notebooks.
+
+Modules are imported from the Compute/ directory (where the notebooks run),
+next to the data helpers they read from:
+
+    from analysis import gwas
+    res = gwas.scan("data/nb08/arabidopsis_snps", y, covariates=X)
+"""
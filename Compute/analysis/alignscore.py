@@ -0,0 +1,155 @@
+"""
+Batched, score-only pairwise alignment and extreme-value calibration.
+
+``aligner.align(a, b)[0].score`` builds the traceback and an alignment
+object for every pair; ``PairwiseAligner.score`` runs only the dynamic
+programme. ``score_pairs`` feeds arrays of pairs through that call in
+chunks on a process pool (each worker receives the aligner once), and the
+null sets are drawn as (pairs x length) code arrays in one NumPy call:
+
+    random_pairs    independent random sequences (optionally with base
+                    frequencies), the unrelated-pair null
+    mutate          copies of one sequence with a random number of point
+                    substitutions each, the related-pair set
+    fit_gumbel      maximum-likelihood Gumbel (extreme-value) fit of null
+                    scores, for p-values of observed scores; the Gumbel
+                    (Karlin-Altschul) model holds for local alignment
+                    scores only, so calibrate() requires mode="local"
+
+    from Bio import Align
+    from analysis import alignscore
+    aligner = Align.PairwiseAligner(mode="local", match_score=2, mismatch_score=-1,
+                                    open_gap_score=-2, extend_gap_score=-0.5)
+    null = alignscore.calibrate(aligner, length=50, n=100_000, seed=0)
+    scores = alignscore.score_pairs(aligner, queries, targets)
+    p = alignscore.gumbel_pvalue(scores, null["fit"])
+"""
+
+import numpy as np
+from scipy import stats
+
+from data.pool import run_chunks
+
+DNA = "ACGT"
+PROTEIN = "ACDEFGHIKLMNPQRSTVWY"
+# Pairs per worker task
+CHUNK_PAIRS = 4096
+
+_WORKER = {}
+
+
+def _init_worker(aligner):
+    _WORKER["aligner"] = aligner
+
+
+def _score_chunk(pairs):
+    score = _WORKER["aligner"].score
+    return np.array([score(a, b) for a, b in zip(*pairs)], dtype=np.float64)
+
+
+def encode(seq, alphabet=DNA):
+    """Indices into alphabet of a sequence string (uint8)."""
+    lut = np.full(256, 255, dtype=np.uint8)
+    lut[np.frombuffer(alphabet.encode(), np.uint8)] = np.arange(len(alphabet))
+    codes = lut[np.frombuffer(str(seq).upper().encode(), np.uint8)]
+    if (codes == 255).any():
+        raise ValueError(f"sequence has symbols outside {alphabet!r}")
+    return codes
+
+
+def as_strings(seqs, alphabet=DNA):
+    """A list of str from a (pairs x length) code array, or from any
+    sequence of str / Seq objects."""
+    if isinstance(seqs, np.ndarray) and seqs.dtype != object:
+        rows = np.frombuffer(alphabet.encode(), np.uint8)[np.atleast_2d(seqs)]
+        return [r.decode() for r in rows.view(f"S{rows.shape[1]}").ravel()]
+    if isinstance(seqs, str):
+        return [seqs]
+    return [str(s) for s in seqs]
+
+
+def random_sequences(n, length, alphabet=DNA, p=None, seed=None):
+    """(n, length) uint8 codes of independent random sequences; p gives
+    symbol frequencies (uniform by default)."""
+    rng = np.random.default_rng(seed)
+    return rng.choice(len(alphabet), size=(n, length), p=p).astype(np.uint8)
+
+
+def random_pairs(n, length, alphabet=DNA, p=None, seed=None):
+    """Two (n, length) code arrays of unrelated random sequences."""
+    codes = random_sequences(2 * n, length, alphabet, p, seed)
+    return codes[:n], codes[n:]
+
+
+def mutate(original, n, n_mutations=(3, 15), alphabet=DNA, seed=None):
+    """(n, length) codes of copies of original, each with a uniform
+    number of random substitutions in [lo, hi] (positions drawn with
+    replacement, new symbol may equal the old one)."""
+    rng = np.random.default_rng(seed)
+    if not isinstance(original, np.ndarray):
+        original = encode(original, alphabet)
+    lo, hi = n_mutations
+    out = np.tile(original.astype(np.uint8), (n, 1))
+    counts = rng.integers(lo, hi + 1, n)
+    pos = rng.integers(0, len(original), (n, hi))
+    new = rng.integers(0, len(alphabet), (n, hi), dtype=np.uint8)
+    mask = np.arange(hi) < counts[:, None]
+    rows = np.broadcast_to(np.arange(n)[:, None], (n, hi))
+    out[rows[mask], pos[mask]] = new[mask]
+    return out
+
+
+def score_pairs(aligner, seqs_a, seqs_b, alphabet=DNA, jobs=None, chunk=CHUNK_PAIRS):
+    """Alignment scores (no traceback) of seqs_a[i] vs seqs_b[i].
+
+    Either side may be code arrays (see random_pairs), strings or Seq
+    objects; a single sequence is compared with every sequence on the
+    other side. The aligner is copied once into each worker.
+    """
+    a, b = as_strings(seqs_a, alphabet), as_strings(seqs_b, alphabet)
+    if len(a) == 1:
+        a = a * len(b)
+    elif len(b) == 1:
+        b = b * len(a)
+    if len(a) != len(b):
+        raise ValueError(f"{len(a)} vs {len(b)} sequences")
+    tasks = [(a[i:i + chunk], b[i:i + chunk]) for i in range(0, len(a), chunk)]
+    parts = list(run_chunks(_score_chunk, tasks, jobs, initializer=_init_worker,
+                            initargs=(aligner,)))
+    return np.concatenate(parts) if parts else np.zeros(0)
+
+
+def fit_gumbel(scores):
+    """Maximum-likelihood Gumbel fit: ``mu`` (location), ``beta`` (scale),
+    ``lambda`` (1 / beta) and the Kolmogorov-Smirnov distance of the fit.
+
+    Only meaningful for local alignment scores; global scores of random
+    pairs are sums over the whole length and need a normal or empirical null.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    mu, beta = stats.gumbel_r.fit(scores)
+    ks = stats.kstest(scores, "gumbel_r", args=(mu, beta)).statistic
+    return {"mu": float(mu), "beta": float(beta), "lambda": 1 / beta, "n": len(scores),
+            "ks": float(ks)}
+
+
+def gumbel_pvalue(scores, fit):
+    """P(null score >= scores) under a fit_gumbel() model."""
+    return stats.gumbel_r.sf(scores, fit["mu"], fit["beta"])
+
+
+def calibrate(aligner, length, n=100_000, alphabet=DNA, p=None, seed=None, jobs=None):
+    """Score n random pairs of the given length and fit a Gumbel null.
+
+    The aligner must be in local mode (see fit_gumbel). Returns
+    ``scores``, their ``mean`` and ``std``, and ``fit``; use
+    gumbel_pvalue(observed, fit) for pairs of about the same length under
+    the same aligner.
+    """
+    if aligner.mode != "local":
+        raise ValueError(f"a Gumbel null needs a local aligner, not mode={aligner.mode!r}; "
+                         "use an empirical null (score_pairs on random_pairs) instead")
+    a, b = random_pairs(n, length, alphabet, p, seed)
+    scores = score_pairs(aligner, a, b, alphabet, jobs)
+    return {"scores": scores, "mean": float(scores.mean()), "std": float(scores.std()),
+            "fit": fit_gumbel(scores)}
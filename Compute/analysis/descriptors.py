@@ -0,0 +1,311 @@
+"""
+Cached, parallel RDKit descriptor and fingerprint panel for compound lists.
+
+Each SMILES is parsed exactly once, in a worker process, and everything
+the NB04 sections need (Lipinski descriptors, extra descriptors, the
+Morgan fingerprint used for similarity and chemical-space PCA) is computed
+from that one molecule. Results are stored in a columnar cache keyed by a
+64-bit hash of the canonical SMILES:
+
+    <cache>/<panel digest>/panel.json        panel and committed row counts
+                          /keys.u64          canonical SMILES hashes
+                          /canonical.txt     canonical SMILES, one per row
+                          /<descriptor>.f64  one float64 column each
+                          /morgan<r>_<b>.u64 packed uint64 fingerprints
+                          /raw_keys.u64      input-string hash -> row
+                          /raw_rows.i64
+
+so a rerun parses nothing, an extended library only computes molecules
+the cache has not seen (a new spelling of a known molecule is parsed but
+not recomputed), and a different panel gets its own directory. Entries
+are classified explicitly instead of being skipped by ``if mol:``:
+
+    ok           parsed; all columns filled
+    no_smiles    empty field (e.g. antibodies and peptides given by name)
+    parse_error  RDKit could not parse the SMILES
+
+    from analysis import descriptors
+    res = descriptors.from_csv("data/nb04/approved_drugs.csv")
+    res["name"], res["status"], res["mw"], res["fingerprint"]
+    ok = res["status"] == "ok"; passes = descriptors.lipinski(res) == 0
+"""
+
+import os
+import json
+import hashlib
+import itertools
+
+import numpy as np
+
+from analysis.fingerprints import morgan_generator, pack_bits
+from data.pool import run_chunks
+
+# Short names -> RDKit module.function; any other name is looked up in
+# rdkit.Chem.Descriptors (e.g. "NumValenceElectrons").
+PANEL = {
+    "mw": "Descriptors.MolWt",
+    "exact_mw": "Descriptors.ExactMolWt",
+    "logp": "Crippen.MolLogP",
+    "mr": "Crippen.MolMR",
+    "hbd": "Lipinski.NumHDonors",
+    "hba": "Lipinski.NumHAcceptors",
+    "tpsa": "rdMolDescriptors.CalcTPSA",
+    "rotatable_bonds": "Lipinski.NumRotatableBonds",
+    "heavy_atoms": "Lipinski.HeavyAtomCount",
+    "rings": "rdMolDescriptors.CalcNumRings",
+    "aromatic_rings": "rdMolDescriptors.CalcNumAromaticRings",
+    "fraction_csp3": "rdMolDescriptors.CalcFractionCSP3",
+    "qed": "QED.qed",
+}
+DEFAULT_DESCRIPTORS = ("mw", "logp", "hbd", "hba", "tpsa", "rotatable_bonds",
+                       "heavy_atoms", "aromatic_rings", "fraction_csp3")
+DEFAULT_FINGERPRINT = (2, 2048)  # Morgan radius, bits; None for no fingerprint
+
+STATUS = np.array(["ok", "no_smiles", "parse_error"])
+_NO_SMILES, _PARSE_ERROR = -1, -2  # raw_rows codes for entries with no row
+
+
+def smiles_key(smiles):
+    """64-bit hash of a SMILES string (used for canonical and raw keys)."""
+    return int.from_bytes(hashlib.blake2b(smiles.encode(), digest_size=8).digest(), "little")
+
+
+def _resolve(name):
+    import importlib
+    module, _, func = PANEL.get(name, "Descriptors." + name).rpartition(".")
+    return getattr(importlib.import_module("rdkit.Chem." + module), func)
+
+
+# Per-worker state, set once by _init_worker
+_WORKER = {}
+
+
+def _init_worker(descriptors, fingerprint, known):
+    from rdkit import RDLogger
+    RDLogger.DisableLog("rdApp.*")
+    _WORKER.update(
+        funcs=[_resolve(d) for d in descriptors],
+        bits_of=morgan_generator(*fingerprint) if fingerprint else None,
+        n_words=fingerprint[1] // 64 if fingerprint else 0,
+        known=known)
+
+
+def _compute_chunk(smiles):
+    """Parse, canonicalize and describe one chunk (runs in a worker).
+
+    Returns (canonical, keys, status, values, words); molecules whose
+    canonical key is already cached come back with NaN values.
+    """
+    from rdkit import Chem
+    funcs, bits_of, known = _WORKER["funcs"], _WORKER["bits_of"], _WORKER["known"]
+    n = len(smiles)
+    canonical = [""] * n
+    keys = np.zeros(n, dtype=np.uint64)
+    status = np.zeros(n, dtype=np.int8)
+    values = np.full((n, len(funcs)), np.nan)
+    bits = np.zeros((n, 64 * _WORKER["n_words"]), dtype=np.uint8)
+    for i, s in enumerate(smiles):
+        mol = Chem.MolFromSmiles(s)
+        if mol is None:
+            status[i] = 2
+            continue
+        canonical[i] = Chem.MolToSmiles(mol)
+        keys[i] = smiles_key(canonical[i])
+        if int(keys[i]) in known:
+            continue
+        for j, fn in enumerate(funcs):
+            try:
+                values[i, j] = fn(mol)
+            except Exception:  # one failing descriptor leaves a NaN, not a lost row
+                pass
+        if bits_of is not None:
+            bits[i] = bits_of(mol)
+    words = pack_bits(bits) if bits.shape[1] else np.zeros((n, 0), dtype=np.uint64)
+    return canonical, keys, status, values, words
+
+
+class DescriptorCache:
+    """Columnar on-disk cache for one (descriptor panel, fingerprint) pair.
+
+    Column files only ever grow: save() appends the rows added since the
+    last save and then commits the row counts to panel.json, so an
+    interrupted save leaves a tail past the committed counts that the next
+    load ignores and the next save cuts off.
+    """
+
+    def __init__(self, root, descriptors, fingerprint):
+        self.descriptors = list(descriptors)
+        self.fingerprint = tuple(fingerprint) if fingerprint else None
+        panel = json.dumps([self.descriptors, self.fingerprint])
+        self.path = os.path.join(root or "", hashlib.sha1(panel.encode()).hexdigest()[:12])
+        self.fp_name = "morgan{}_{}".format(*self.fingerprint) if self.fingerprint else None
+        n_words = self.fingerprint[1] // 64 if self.fingerprint else 0
+        self.saved = {"rows": 0, "raw": 0, "canonical_bytes": 0}
+        manifest = os.path.join(self.path, "panel.json")
+        if root and os.path.exists(manifest):
+            with open(manifest) as f:
+                self.saved.update(json.load(f).get("saved", {}))
+        n, n_raw = self.saved["rows"], self.saved["raw"]
+        if n or n_raw:
+            self.keys = self._load("keys.u64", np.uint64, n)
+            with open(os.path.join(self.path, "canonical.txt"), "rb") as f:
+                self.canonical = f.read(self.saved["canonical_bytes"]).decode().splitlines()
+            self.values = np.column_stack([self._load(d + ".f64", np.float64, n)
+                                           for d in self.descriptors]) \
+                if self.descriptors else np.zeros((n, 0))
+            self.words = self._load(self.fp_name + ".u64", np.uint64, n, n_words) \
+                if self.fp_name else np.zeros((n, 0), dtype=np.uint64)
+            self.raw_keys = self._load("raw_keys.u64", np.uint64, n_raw)
+            self.raw_rows = self._load("raw_rows.i64", np.int64, n_raw)
+        else:
+            self.keys = np.zeros(0, dtype=np.uint64)
+            self.canonical = []
+            self.values = np.zeros((0, len(self.descriptors)))
+            self.words = np.zeros((0, n_words), dtype=np.uint64)
+            self.raw_keys = np.zeros(0, dtype=np.uint64)
+            self.raw_rows = np.zeros(0, dtype=np.int64)
+        self._row_of = {int(k): i for i, k in enumerate(self.keys)}
+        self._raw_of = dict(zip(self.raw_keys.tolist(), self.raw_rows.tolist()))
+        self.dirty = False
+
+    def _load(self, name, dtype, n, width=None):
+        count = n * (width or 1)
+        arr = np.fromfile(os.path.join(self.path, name), dtype=dtype, count=count)
+        if len(arr) < count:
+            raise ValueError(f"{name} in {self.path} is shorter than panel.json says")
+        return arr.reshape(n, width) if width is not None else arr
+
+    def _append(self, name, data, offset):
+        """Cut a column file back to offset bytes and append data to it."""
+        with open(os.path.join(self.path, name), "ab") as f:
+            f.truncate(offset)
+            f.write(data)
+        return offset + len(data)
+
+    def lookup(self, raw_key):
+        """Row (>= 0), _NO_SMILES / _PARSE_ERROR code, or None if unseen."""
+        return self._raw_of.get(raw_key)
+
+    def add(self, raw_keys, canonical, keys, status, values, words):
+        """Record a computed chunk; returns the row (or code) of each entry."""
+        out = np.empty(len(raw_keys), dtype=np.int64)
+        new = []
+        for i, key in enumerate(keys.tolist()):
+            if status[i]:
+                out[i] = _PARSE_ERROR
+            elif key in self._row_of:
+                out[i] = self._row_of[key]
+            else:
+                out[i] = self._row_of[key] = len(self.canonical) + len(new)
+                new.append(i)
+        if new:
+            self.keys = np.concatenate([self.keys, keys[new]])
+            self.canonical.extend(canonical[i] for i in new)
+            self.values = np.concatenate([self.values, values[new]])
+            self.words = np.concatenate([self.words, words[new]])
+        self.record(raw_keys, out)
+        return out
+
+    def record(self, raw_keys, rows):
+        self._raw_of.update(zip(raw_keys, np.asarray(rows).tolist()))
+        self.dirty = True
+
+    def save(self):
+        """Append the new rows to the column files, then commit the counts
+        (panel.json via .part + rename)."""
+        if not self.dirty:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        n, n_raw = self.saved["rows"], self.saved["raw"]
+        # Raw keys are only ever added, so the dict's tail is what is new
+        raw = list(itertools.islice(self._raw_of.items(), n_raw, None))
+        new = {"keys.u64": self.keys[n:],
+               "raw_keys.u64": np.array([k for k, _ in raw], dtype=np.uint64),
+               "raw_rows.i64": np.array([r for _, r in raw], dtype=np.int64)}
+        new.update((d + ".f64", self.values[n:, j]) for j, d in enumerate(self.descriptors))
+        if self.fp_name:
+            new[self.fp_name + ".u64"] = self.words[n:]
+        for name, tail in new.items():
+            row_bytes = tail.dtype.itemsize * int(np.prod(tail.shape[1:]))
+            start = n_raw if name.startswith("raw_") else n
+            self._append(name, np.ascontiguousarray(tail).tobytes(), start * row_bytes)
+        text = "".join(s + "\n" for s in self.canonical[n:]).encode()
+        text_bytes = self._append("canonical.txt", text, self.saved["canonical_bytes"])
+        saved = {"rows": len(self.keys), "raw": n_raw + len(raw), "canonical_bytes": text_bytes}
+        part = os.path.join(self.path, "panel.json.part")
+        with open(part, "w") as f:
+            json.dump({"descriptors": self.descriptors, "fingerprint": self.fingerprint,
+                       "saved": saved}, f)
+        os.replace(part, os.path.join(self.path, "panel.json"))
+        self.saved = saved
+        self.dirty = False
+
+
+def compute(smiles, descriptors=DEFAULT_DESCRIPTORS, fingerprint=DEFAULT_FINGERPRINT,
+            cache_dir=None, jobs=None, chunk=256):
+    """Descriptor panel and fingerprints for a list of SMILES.
+
+    Only input strings the cache has not seen are sent to the process pool
+    (``jobs`` workers, ``chunk`` SMILES per task). Returns a dict of
+    columns in input order: ``smiles``, ``canonical``, ``status`` (see the
+    module docstring), one float array per descriptor (NaN unless ok) and,
+    with a fingerprint, ``fingerprint`` as packed uint64 rows (zero unless
+    ok). Without ``cache_dir`` an in-memory cache is used.
+    """
+    smiles = [(s or "").strip() for s in smiles]
+    cache = DescriptorCache(cache_dir, descriptors, fingerprint)
+    raw_keys = [smiles_key(s) for s in smiles]
+
+    todo = {}
+    for s, key in zip(smiles, raw_keys):
+        if not s:
+            if cache.lookup(key) is None:
+                cache.record([key], [_NO_SMILES])
+        elif cache.lookup(key) is None:
+            todo.setdefault(key, s)
+    if todo:
+        keys, strings = list(todo), list(todo.values())
+        tasks = [strings[i:i + chunk] for i in range(0, len(strings), chunk)]
+        # Workers skip the descriptor work for canonical molecules already cached
+        init = (cache.descriptors, cache.fingerprint, frozenset(cache._row_of))
+        results = run_chunks(_compute_chunk, tasks, jobs or os.cpu_count(),
+                             initializer=_init_worker, initargs=init)
+        for i, result in enumerate(results):
+            cache.add(keys[i * chunk:(i + 1) * chunk], *result)
+    if cache_dir:
+        cache.save()
+
+    rows = np.array([cache.lookup(k) for k in raw_keys], dtype=np.int64)
+    ok = rows >= 0
+    status = np.where(ok, 0, np.where(rows == _NO_SMILES, 1, 2))
+    res = {"smiles": np.array(smiles, dtype=object), "status": STATUS[status],
+           "canonical": np.array([cache.canonical[r] if r >= 0 else "" for r in rows],
+                                 dtype=object)}
+    for j, name in enumerate(cache.descriptors):
+        col = np.full(len(rows), np.nan)
+        col[ok] = cache.values[rows[ok], j]
+        res[name] = col
+    if cache.fingerprint:
+        words = np.zeros((len(rows), cache.words.shape[1]), dtype=np.uint64)
+        words[ok] = cache.words[rows[ok]]
+        res["fingerprint"] = words
+    return res
+
+
+def from_csv(csv_path, smiles_column="smiles", name_column="name", cache_dir=None, **kwargs):
+    """compute() over a molecule CSV, cached in ``<stem>.descriptors/`` beside it."""
+    import csv
+    with open(csv_path, newline="") as f:
+        records = list(csv.DictReader(f))
+    if cache_dir is None:
+        cache_dir = os.path.splitext(csv_path)[0] + ".descriptors"
+    res = compute([r.get(smiles_column) for r in records], cache_dir=cache_dir, **kwargs)
+    res["name"] = np.array([r.get(name_column, "") for r in records], dtype=object)
+    return res
+
+
+def lipinski(res):
+    """Rule-of-five violations per molecule (-1 where status is not ok)."""
+    violations = ((res["mw"] > 500).astype(int) + (res["logp"] > 5) +
+                  (res["hbd"] > 5) + (res["hba"] > 10))
+    return np.where(res["status"] == "ok", violations, -1)
@@ -0,0 +1,325 @@
+"""
+Bit-packed Morgan fingerprint store with popcount Tanimoto search.
+
+Fingerprints are packed 64 bits to a uint64 word, one contiguous row per
+molecule, so the Tanimoto similarity of a query batch against a block of
+the store is a handful of array operations:
+
+    common = sum over words w of popcount(Q[:, w, None] & D[None, :, w])
+    T      = common / (|q| + |d| - common)
+
+The store keeps its rows sorted by bit count. Since T(q, d) <=
+min(|q|, |d|) / max(|q|, |d|), a threshold search only reads the rows whose
+count lies in [t |q|, |q| / t], and a top-k search skips row blocks whose
+bound is below every query's current k-th best. Query batches run on a
+thread pool (the AND/popcount kernels release the GIL).
+
+The fingerprints of a CSV are built once with RDKit and saved beside it as
+``<stem>.morgan<radius>_<bits>.npy`` (opened memory-mapped) plus a ``.json``
+with the row order and the CSV's size/mtime; rows without a parseable
+SMILES (antibodies, peptides given by name only) are listed as skipped.
+
+    from analysis import fingerprints as fp
+    store = fp.FingerprintStore.from_csv("data/nb04/approved_drugs.csv")
+    sim = store.all_pairs()                       # dense n x n Tanimoto
+    q, ok = fp.morgan_fingerprints(library_smiles)
+    idx, scores = store.top_k(q, k=5)             # CSV rows of the 5 nearest
+"""
+
+import os
+import csv
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Popcount per byte, for NumPy builds without np.bitwise_count
+_POPCOUNT8 = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
+def popcount(words):
+    """Set bits per row of a uint64 (..., words) array, as int32."""
+    words = np.asarray(words)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int32)
+    return _POPCOUNT8[words.view(np.uint8)].sum(axis=-1, dtype=np.int32)
+
+
+def pack_bits(bits):
+    """Pack a (n, n_bits) 0/1 array (n_bits a multiple of 64) into uint64 words."""
+    bits = np.asarray(bits, dtype=bool)
+    if bits.shape[1] % 64:
+        raise ValueError("fingerprint length must be a multiple of 64 bits")
+    packed = np.packbits(bits, axis=1, bitorder="little")
+    return np.ascontiguousarray(packed).view("<u8")
+
+
+def unpack_bits(words, n_bits=None):
+    """Inverse of pack_bits: (n, n_bits) uint8 0/1 array."""
+    bits = np.unpackbits(np.ascontiguousarray(words).view(np.uint8), axis=1,
+                         bitorder="little")
+    return bits if n_bits is None else bits[:, :n_bits]
+
+
+def morgan_generator(radius=2, n_bits=2048):
+    """A function mol -> uint8 (n_bits,) Morgan bit vector (needs RDKit)."""
+    try:
+        from rdkit.Chem import rdFingerprintGenerator
+        gen = rdFingerprintGenerator.GetMorganGenerator(radius=radius, fpSize=n_bits)
+
+        def bits_of(mol):
+            return gen.GetFingerprintAsNumPy(mol)
+    except (ImportError, AttributeError):  # RDKit < 2023.09
+        from rdkit import DataStructs
+        from rdkit.Chem import AllChem
+
+        def bits_of(mol):
+            out = np.zeros(n_bits, dtype=np.uint8)
+            DataStructs.ConvertToNumpyArray(
+                AllChem.GetMorganFingerprintAsBitVect(mol, radius, nBits=n_bits), out)
+            return out
+    return bits_of
+
+
+def morgan_fingerprints(smiles, radius=2, n_bits=2048, chunk=10000):
+    """Packed Morgan bit vectors for an iterable of SMILES (needs RDKit).
+
+    Returns ``(words, ok)``: uint64 (n, n_bits / 64) rows and a bool mask of
+    the SMILES that parsed (failed or empty entries get all-zero rows).
+    Molecules are packed in chunks, so the unpacked bits of at most
+    ``chunk`` molecules are held at once.
+    """
+    from rdkit import Chem, RDLogger
+    RDLogger.DisableLog("rdApp.*")
+    bits_of = morgan_generator(radius, n_bits)
+    words, ok = [], []
+    buf = np.zeros((chunk, n_bits), dtype=np.uint8)
+    n = 0
+    for s in smiles:
+        mol = Chem.MolFromSmiles(s) if s else None
+        ok.append(mol is not None)
+        buf[n] = bits_of(mol) if mol is not None else 0
+        n += 1
+        if n == chunk:
+            words.append(pack_bits(buf))
+            n = 0
+    if n or not words:
+        words.append(pack_bits(buf[:n]))
+    return np.concatenate(words), np.array(ok, dtype=bool)
+
+
+def common_bits(a, b):
+    """Shared set bits of every (a row, b row) pair, as an int32 matrix.
+
+    Accumulates one word column at a time, so the temporaries are
+    (len(a), len(b)) rather than (len(a), len(b), words) and stay in cache.
+    """
+    a_t, b_t = np.ascontiguousarray(a.T), np.ascontiguousarray(b.T)
+    common = np.zeros((len(a), len(b)), dtype=np.int32)
+    both = np.empty((len(a), len(b)), dtype=np.uint64)
+    bits = np.empty((len(a), len(b)), dtype=np.uint8)
+    for w in range(a_t.shape[0]):
+        np.bitwise_and(a_t[w][:, None], b_t[w][None, :], out=both)
+        if hasattr(np, "bitwise_count"):
+            np.bitwise_count(both, out=bits)
+            common += bits
+        else:
+            common += popcount(both[..., None])
+    return common
+
+
+def tanimoto(a, b, a_counts=None, b_counts=None):
+    """Dense Tanimoto matrix between two packed fingerprint sets."""
+    a_counts = popcount(a) if a_counts is None else a_counts
+    b_counts = popcount(b) if b_counts is None else b_counts
+    common = common_bits(a, b)
+    union = a_counts[:, None] + b_counts[None, :] - common
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(union > 0, common / union, 0.0)
+
+
+def _blocks(lo, hi, size):
+    return [(s, min(s + size, hi)) for s in range(lo, hi, size)]
+
+
+class FingerprintStore:
+    """Packed fingerprints sorted by bit count, with search methods.
+
+    ``rows[i]`` is the original (CSV) row of store entry i, and search
+    results are reported in those original row numbers.
+    """
+
+    def __init__(self, words, rows=None, names=None, n_bits=None, radius=None):
+        words = np.asarray(words)
+        counts = popcount(words)
+        if rows is None:
+            # Sort once by bit count so the count bounds select row ranges
+            order = np.argsort(counts, kind="stable")
+            words, counts = np.ascontiguousarray(words[order]), counts[order]
+            rows = order
+        self.words = words
+        self.counts = counts
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.names = names
+        self.n_bits = n_bits or words.shape[1] * 64
+        self.radius = radius
+
+    def __len__(self):
+        return len(self.words)
+
+    # -- persistence -------------------------------------------------------
+
+    @staticmethod
+    def paths(csv_path, radius=2, n_bits=2048):
+        stem = os.path.splitext(csv_path)[0] + f".morgan{radius}_{n_bits}"
+        return stem + ".npy", stem + ".json"
+
+    def save(self, npy_path, json_path, meta=None):
+        """Write the words (.npy) and row order / metadata (.json)."""
+        np.save(npy_path + ".part.npy", self.words)
+        os.replace(npy_path + ".part.npy", npy_path)
+        doc = dict(meta or {}, n_bits=self.n_bits, radius=self.radius,
+                   rows=self.rows.tolist(), names=self.names)
+        with open(json_path + ".part", "w") as f:
+            json.dump(doc, f)
+        os.replace(json_path + ".part", json_path)
+
+    @classmethod
+    def load(cls, npy_path, json_path):
+        """Open a saved store; the fingerprint words are memory-mapped."""
+        with open(json_path) as f:
+            doc = json.load(f)
+        words = np.load(npy_path, mmap_mode="r")
+        return cls(words, doc["rows"], doc.get("names"), doc["n_bits"], doc["radius"])
+
+    @classmethod
+    def from_csv(cls, csv_path, smiles_column="smiles", name_column="name",
+                 radius=2, n_bits=2048, rebuild=False):
+        """Fingerprints of a molecule CSV, built with RDKit on first use and
+        reloaded (memory-mapped) while the CSV is unchanged."""
+        npy_path, json_path = cls.paths(csv_path, radius, n_bits)
+        st = os.stat(csv_path)
+        source = {"size": st.st_size, "mtime": int(st.st_mtime)}
+        if not rebuild and os.path.exists(npy_path) and os.path.exists(json_path):
+            with open(json_path) as f:
+                if json.load(f).get("source") == source:
+                    return cls.load(npy_path, json_path)
+        with open(csv_path, newline="") as f:
+            records = list(csv.DictReader(f))
+        words, ok = morgan_fingerprints((r[smiles_column].strip() for r in records),
+                                        radius, n_bits)
+        keep = np.flatnonzero(ok)
+        names = [r.get(name_column, str(i)) for i, r in enumerate(records)]
+        skipped = [names[i] for i in np.flatnonzero(~ok)]
+        sub = cls(words[keep], n_bits=n_bits, radius=radius)
+        store = cls(sub.words, keep[sub.rows], names, n_bits, radius)
+        store.save(npy_path, json_path, {"source": source, "skipped": skipped})
+        return cls.load(npy_path, json_path)
+
+    # -- search ------------------------------------------------------------
+
+    def _query_batches(self, queries, batch):
+        """Query indices sorted by bit count, cut into batches, with counts.
+
+        The default batch grows as the store shrinks, so screening many
+        queries against a small set (e.g. ~50 drugs) is not dominated by
+        per-call overhead.
+        """
+        if batch is None:
+            batch = max(256, min(1 << 16, (1 << 19) // max(len(self), 1)))
+        queries = np.asarray(queries)
+        qc = popcount(queries)
+        order = np.argsort(qc, kind="stable")
+        return queries, qc, [order[s:s + batch] for s in range(0, len(order), batch)]
+
+    def _block_size(self, n_queries):
+        # Keep the (queries, rows) temporaries of common_bits() near 8 MB
+        return max(64, int(2 ** 23 // (24 * max(n_queries, 1))))
+
+    def threshold(self, queries, threshold, batch=None, jobs=None):
+        """All (query, row, similarity) with Tanimoto >= threshold.
+
+        Returns three flat arrays; ``row`` is the original CSV row.
+        """
+        if not 0 < threshold <= 1:
+            raise ValueError("threshold must be in (0, 1]")
+        queries, qc, batches = self._query_batches(queries, batch)
+
+        def work(idx):
+            q, c = queries[idx], qc[idx]
+            lo = np.searchsorted(self.counts, np.ceil(threshold * c.min() - 1e-9))
+            hi = np.searchsorted(self.counts, np.floor(c.max() / threshold + 1e-9),
+                                 side="right")
+            out = []
+            for s, e in _blocks(lo, hi, self._block_size(len(idx))):
+                sim = tanimoto(q, self.words[s:e], c, self.counts[s:e])
+                a, b = np.nonzero(sim >= threshold)
+                out.append((idx[a], self.rows[s + b], sim[a, b]))
+            return out
+
+        with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+            parts = [p for out in pool.map(work, batches) for p in out]
+        if not parts:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0)
+        return tuple(np.concatenate(col) for col in zip(*parts))
+
+    def top_k(self, queries, k=5, batch=None, jobs=None):
+        """The k most similar store entries for each query.
+
+        Returns ``(rows, scores)``, both (n_queries, k) and best first; rows
+        are original CSV rows (-1 with score NaN when the store is smaller
+        than k). Row blocks are visited nearest bit count first and skipped
+        once their count bound cannot beat any query's k-th best.
+        """
+        queries, qc, batches = self._query_batches(queries, batch)
+        k_eff = min(k, len(self))
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), np.nan)
+
+        def work(idx):
+            q, c = queries[idx], qc[idx].astype(float)
+            best = np.full((len(idx), k_eff), -1.0)
+            best_i = np.full((len(idx), k_eff), -1, dtype=np.int64)
+            blocks = _blocks(0, len(self), self._block_size(len(idx)))
+            mid = np.median(c)
+            blocks.sort(key=lambda b: abs(float(self.counts[(b[0] + b[1] - 1) // 2]) - mid))
+            for s, e in blocks:
+                c_lo, c_hi = float(self.counts[s]), float(self.counts[e - 1])
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    bound = np.where(c < c_lo, c / c_lo, np.where(c > c_hi, c_hi / c, 1.0))
+                if not (bound >= best[:, -1]).any():
+                    continue
+                sim = tanimoto(q, self.words[s:e], qc[idx], self.counts[s:e])
+                cand = np.concatenate([best, sim], axis=1)
+                cand_i = np.concatenate([best_i, np.broadcast_to(
+                    np.arange(s, e), sim.shape)], axis=1)
+                top = np.argpartition(-cand, k_eff - 1, axis=1)[:, :k_eff]
+                best = np.take_along_axis(cand, top, axis=1)
+                best_i = np.take_along_axis(cand_i, top, axis=1)
+                order = np.argsort(-best, axis=1, kind="stable")
+                best = np.take_along_axis(best, order, axis=1)
+                best_i = np.take_along_axis(best_i, order, axis=1)
+            rows[idx, :k_eff] = self.rows[best_i]
+            scores[idx, :k_eff] = best
+
+        with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+            list(pool.map(work, batches))
+        return rows, scores
+
+    def all_pairs(self, batch=256, jobs=None):
+        """Dense Tanimoto matrix over the store, in original row order of
+        the fingerprinted entries (``np.sort(store.rows)``)."""
+        order = np.argsort(self.rows)
+        words, counts = self.words[order], self.counts[order]
+        out = np.empty((len(self), len(self)))
+
+        def work(s):
+            e = min(s + batch, len(self))
+            for b0, b1 in _blocks(s, len(self), self._block_size(e - s)):
+                out[s:e, b0:b1] = tanimoto(words[s:e], words[b0:b1],
+                                           counts[s:e], counts[b0:b1])
+                out[b0:b1, s:e] = out[s:e, b0:b1].T
+
+        with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+            list(pool.map(work, range(0, len(self), batch)))
+        return out
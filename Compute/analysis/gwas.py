@@ -0,0 +1,133 @@
+"""
+Batched single-marker association scans in closed matrix form.
+
+For a phenotype y, covariates C (intercept added automatically) and a block
+of SNPs G, both y and G are residualized on C once via its QR basis Q:
+
+    y* = y - Q Q'y        G* = G - Q Q'G
+    beta_j = G*_j'y* / ||G*_j||^2
+    se_j   = sqrt((||y*||^2 - beta_j^2 ||G*_j||^2) / (n - k - 1) / ||G*_j||^2)
+
+which is exactly the per-SNP OLS fit of y ~ C + g_j, done as one matrix
+product per block instead of a regression per SNP. Blocks are read
+from the PLINK .bed stores written by the downloader and processed on a
+thread pool (NumPy releases the GIL in the decode and BLAS steps). Missing
+calls are mean-imputed per SNP.
+
+    from analysis import gwas
+    from data.genotype_store import BedReader
+    bed = BedReader("data/nb08/arabidopsis_snps")
+    pheno = gwas.read_table("data/nb08/arabidopsis_phenotypes.csv",
+                            "accession_id", bed.sample_ids)
+    res = gwas.scan(bed, gwas.to_float(pheno["flowering_time_days"]),
+                    covariates=[gwas.top_pcs(bed, 4),
+                                gwas.one_hot(pheno["geographic_group"])])
+"""
+
+import os
+import csv
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from analysis import popstruct
+# Sample-table helpers live in analysis.tables; gwas.read_table etc. still work
+from analysis.tables import as_reader, covariate_matrix, one_hot, read_table, to_float
+
+
+def _block_stats(g, m, yy, df):
+    """beta, se, t, allele frequency and call count for one SNP-major block.
+
+    ``m`` is [Q | y*]: one product g @ m gives Q'g and g'y*
+    (= g*'y*, as y* is orthogonal to Q), and ||g*||^2 = ||g||^2 - ||Q'g||^2,
+    so the residualized genotypes are never formed. Sums of g and g^2 are
+    exact integer counts unless calls are missing.
+    """
+    x = g.astype(m.dtype)
+    missing = g < 0
+    n_called = g.shape[1] - missing.sum(axis=1)
+    if missing.any():
+        x[missing] = 0.0
+        means = x.sum(axis=1) / np.maximum(n_called, 1)
+        x = np.where(missing, means[:, None], x)
+        s1 = x.sum(axis=1, dtype=np.float64)
+        s2 = np.einsum("ij,ij->i", x, x, dtype=np.float64)
+    else:
+        s1 = g.sum(axis=1, dtype=np.int64)
+        s2 = (g * g).sum(axis=1, dtype=np.int64)
+    af = s1 / (2.0 * g.shape[1])
+    a = (x @ m).astype(np.float64)
+    gy = a[:, -1]
+    qg = a[:, :-1]
+    gg = s2 - np.einsum("ij,ij->i", qg, qg)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Nothing left after the covariates (e.g. monomorphic): untestable
+        gg[gg <= 1e-5 * s2] = np.nan
+        beta = gy / gg
+        rss = np.maximum(yy - beta * gy, 0.0)
+        se = np.sqrt(rss / df / gg)
+        t = beta / se
+    return beta, se, t, af, n_called
+
+
+def scan(genotypes, phenotype, covariates=None, block_snps=8192, jobs=None,
+         dtype=np.float32):
+    """Test every SNP for association with a quantitative phenotype.
+
+    ``genotypes`` is a .bed prefix, array or reader; ``phenotype`` and each
+    covariate (a vector or a samples x k matrix) are in .fam order. Samples
+    with a missing (NaN) phenotype or covariate are dropped. The block
+    products run in ``dtype``: float32 is about three times faster and
+    agrees with a float64 OLS fit to ~1e-3 in t; pass np.float64 for exact
+    agreement.
+    Returns a dict of per-SNP arrays: chrom, pos, snp, beta, se, t, p, af, n.
+    """
+    from scipy import special
+
+    reader = as_reader(genotypes)
+    y = np.asarray(phenotype, dtype=float)
+    c = covariate_matrix(covariates, reader.n_samples)
+    keep = np.isfinite(y) & np.isfinite(c).all(axis=1)
+    samples = np.flatnonzero(keep) if not keep.all() else None
+    y, c = y[keep], c[keep]
+    q, r = np.linalg.qr(c)
+    # Drop aliased covariate columns (e.g. a group dummy that is constant)
+    q = q[:, np.abs(np.diag(r)) > 1e-10 * np.abs(r).max()]
+    yr = y - q @ (q.T @ y)
+    yy = yr @ yr
+    df = len(y) - q.shape[1] - 1
+    m = np.column_stack([q, yr]).astype(dtype)
+
+    starts = range(0, reader.n_snps, block_snps)
+
+    def work(start):
+        g = reader.read_rows(slice(start, start + block_snps), samples)
+        return _block_stats(g, m, yy, df)
+
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        parts = list(pool.map(work, starts))
+    beta, se, t, af, n = (np.concatenate(col) for col in zip(*parts))
+    # Two-sided Student t p-values
+    p = 2.0 * special.stdtr(df, -np.abs(t))
+    return {"chrom": reader.chroms, "pos": reader.positions, "snp": reader.snp_ids,
+            "beta": beta, "se": se, "t": t, "p": p, "af": af, "n": n}
+
+
+def top_pcs(genotypes, k=10, block_snps=8192, jobs=None):
+    """Top k principal components of standardized genotypes (samples x k).
+
+    For use as scan() covariates; this is popstruct.pcs() (randomized SVD
+    over streamed blocks, memory O(n_samples x k)).
+    """
+    return popstruct.pcs(genotypes, k, block_snps=block_snps, jobs=jobs)["pcs"]
+
+
+def write_results(path, res):
+    """Write a scan() result as CSV, streaming in row blocks."""
+    cols = ["chrom", "pos", "snp", "beta", "se", "t", "p", "af", "n"]
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(cols)
+        for start in range(0, len(res["p"]), 100000):
+            block = [res[c][start:start + 100000] for c in cols]
+            writer.writerows(zip(*(b.tolist() for b in block)))
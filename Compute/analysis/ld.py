@@ -0,0 +1,236 @@
+"""
+Windowed linkage disequilibrium (r^2) from blocked matrix products.
+
+Genotypes are standardized per SNP (missing calls mean-imputed, centered,
+scaled to unit norm), so the correlation of SNPs i and j is the dot product
+z_i . z_j. The SNPs are walked in blocks along each chromosome; each block
+is multiplied only against itself and the SNPs that follow it within the
+window (``max_snps`` SNPs and/or ``max_bp`` base pairs, from the chrom/pos
+of the .bim or the ``chr<chrom>_<pos>`` column headers):
+
+    R = Z[block] @ Z[block_start : window_end].T
+
+so time and memory scale with n_snps x window instead of n_snps^2, and each
+SNP is read and standardized once. Pairs come out as sparse (i, j, r2)
+triples (global SNP indices, i < j) for pruning and clumping, and LD-decay
+curves are binned on the fly without keeping the pairs.
+
+    from analysis import ld
+    from data.genotype_store import GenotypeArray
+    geno = GenotypeArray.from_csv("data/nb02/1kg_chr22_subset.csv")
+    decay = ld.ld_decay(geno, bin_width=5000, max_bp=100_000)
+    i, j, r2 = ld.sparse_ld(geno, max_snps=50, min_r2=0.2)
+    keep = ld.prune(geno, r2_threshold=0.5, max_snps=50)
+
+Monomorphic SNPs have no defined r^2 and never appear in the output.
+"""
+
+import numpy as np
+
+from analysis.tables import as_reader
+
+
+def _standardize(g):
+    """Unit-norm centered rows of a SNP-major int8 block, and allele freqs.
+
+    Missing calls are set to the SNP mean (contributing zero after
+    centering); monomorphic SNPs become zero rows.
+    """
+    x = g.astype(np.float32)
+    missing = g < 0
+    x[missing] = 0.0
+    n_called = np.maximum(g.shape[1] - missing.sum(axis=1), 1)
+    mean = x.sum(axis=1) / n_called
+    x -= mean[:, None]
+    if missing.any():
+        x[missing] = 0.0
+    norm = np.sqrt(np.einsum("ij,ij->i", x, x))
+    valid = norm > 1e-6 * np.sqrt(g.shape[1])
+    x[valid] /= norm[valid, None]
+    x[~valid] = 0.0
+    return x, mean / 2, valid
+
+
+def _chrom_runs(chroms):
+    chroms = np.asarray(chroms)
+    bounds = np.flatnonzero(chroms[1:] != chroms[:-1]) + 1
+    return list(zip(np.r_[0, bounds], np.r_[bounds, len(chroms)]))
+
+
+def _band(reader, max_snps, max_bp, min_r2, block_snps, samples, af=None):
+    """Yield (i, j, r2) arrays block by block; fills af (per SNP) if given."""
+    if max_snps is None and max_bp is None:
+        raise ValueError("set max_snps and/or max_bp to bound the LD window")
+    pos = np.asarray(reader.positions)
+    for c0, c1 in _chrom_runs(reader.chroms):
+        # Standardized rows [lo, hi) of this chromosome, extended on demand
+        # and trimmed as the block start moves past them
+        lo = hi = c0
+        z = np.zeros((0, 0), dtype=np.float32)
+        valid = np.zeros(0, dtype=bool)
+        for s in range(c0, c1, block_snps):
+            e = min(s + block_snps, c1)
+            end = c1
+            if max_snps is not None:
+                end = min(end, e - 1 + max_snps + 1)
+            if max_bp is not None:
+                end = min(end, c0 + int(np.searchsorted(
+                    pos[c0:c1], pos[e - 1] + max_bp, side="right")))
+            z, valid = z[s - lo:], valid[s - lo:]
+            lo = s
+            while hi < end:
+                step = min(max(block_snps, end - hi), c1 - hi)
+                zb, fb, vb = _standardize(reader.read_rows(slice(hi, hi + step), samples))
+                if af is not None:
+                    af[hi:hi + step] = fb
+                z = np.concatenate([z, zb]) if len(z) else zb
+                valid = np.concatenate([valid, vb])
+                hi += step
+            r = z[:e - s] @ z[:end - s].T
+            r2 = r * r
+            ii = np.arange(s, e)[:, None]
+            jj = np.arange(s, end)[None, :]
+            mask = (jj > ii) & valid[:e - s, None] & valid[None, :end - s]
+            if max_snps is not None:
+                mask &= jj - ii <= max_snps
+            if max_bp is not None:
+                mask &= pos[jj] - pos[ii] <= max_bp
+            if min_r2 > 0:
+                mask &= r2 >= min_r2
+            a, b = np.nonzero(mask)
+            yield a + s, b + s, np.minimum(r2[a, b], 1.0)
+
+
+def iter_ld(genotypes, max_snps=None, max_bp=None, min_r2=0.0, block_snps=1024,
+            samples=None):
+    """Yield ``(i, j, r2)`` arrays of within-window SNP pairs, one SNP block
+    at a time.
+
+    ``i < j`` are global SNP indices on the same chromosome, at most
+    ``max_snps`` SNPs and/or ``max_bp`` bp apart; pairs with r2 below
+    ``min_r2`` are skipped. ``samples`` restricts the calculation to a
+    subset (e.g. one population).
+    """
+    reader = as_reader(genotypes)
+    yield from _band(reader, max_snps, max_bp, min_r2, block_snps, samples)
+
+
+def sparse_ld(genotypes, max_snps=None, max_bp=None, min_r2=0.0, block_snps=1024,
+              samples=None):
+    """All within-window pairs as three flat arrays ``(i, j, r2)``."""
+    parts = list(iter_ld(genotypes, max_snps, max_bp, min_r2, block_snps, samples))
+    if not parts:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.float32)
+    return tuple(np.concatenate(col) for col in zip(*parts))
+
+
+def ld_decay(genotypes, bin_width, max_bp=None, max_snps=None, block_snps=1024,
+             samples=None):
+    """Mean r^2 against distance, binned as the pairs stream past.
+
+    Distance is in bp when ``max_bp`` is set, otherwise in SNPs (``max_snps``
+    apart at most). Bins cover [0, span] in steps of bin_width, the last one
+    closed on the right so pairs exactly span apart do not get a bin of
+    their own. Returns a dict with ``bin_start``, ``bin_center``,
+    ``mean_r2`` (NaN for empty bins) and ``n_pairs`` per bin.
+    """
+    reader = as_reader(genotypes)
+    pos = np.asarray(reader.positions)
+    span = max_bp if max_bp is not None else max_snps
+    if span is None:
+        raise ValueError("set max_bp or max_snps to bound the LD window")
+    n_bins = max(int(-(-span // bin_width)), 1)
+    sums = np.zeros(n_bins)
+    counts = np.zeros(n_bins, dtype=np.int64)
+    for i, j, r2 in _band(reader, max_snps, max_bp, 0.0, block_snps, samples):
+        dist = pos[j] - pos[i] if max_bp is not None else j - i
+        bins = np.minimum(dist // bin_width, n_bins - 1)
+        sums += np.bincount(bins, weights=r2, minlength=n_bins)
+        counts += np.bincount(bins, minlength=n_bins)
+    start = np.arange(n_bins) * bin_width
+    with np.errstate(invalid="ignore"):
+        mean = sums / counts
+    return {"bin_start": start, "bin_center": start + bin_width / 2,
+            "mean_r2": mean, "n_pairs": counts}
+
+
+def local_r2(genotypes, snps, samples=None):
+    """Dense r^2 matrix for a small SNP slice or index array (heatmaps)."""
+    reader = as_reader(genotypes)
+    z, _, valid = _standardize(reader.read_rows(snps, samples))
+    r2 = np.minimum((z @ z.T) ** 2, 1.0)
+    r2[~valid] = np.nan
+    r2[:, ~valid] = np.nan
+    return r2
+
+
+def _drop_pairs(i, j, maf_i, maf_j, keep):
+    """Visit the pairs (i, j) in (i, j) order and, while both SNPs are kept,
+    drop the one with the lower MAF.
+
+    Decided per SNP i rather than per pair: of i's partners still kept, each
+    one before the first with a MAF at least i's is dropped, and i goes too
+    if there is such a partner.
+    """
+    if not len(i):
+        return
+    starts = np.flatnonzero(np.r_[True, i[1:] != i[:-1], True])
+    for lo, hi in zip(starts[:-1], starts[1:]):
+        if not keep[i[lo]]:
+            continue
+        live = keep[j[lo:hi]]
+        js = j[lo:hi][live]
+        stronger = np.flatnonzero(maf_j[lo:hi][live] >= maf_i[lo])
+        cut = stronger[0] if len(stronger) else len(js)
+        keep[js[:cut]] = False
+        keep[i[lo]] = cut == len(js)
+
+
+def prune(genotypes, r2_threshold=0.5, max_snps=None, max_bp=None, block_snps=1024,
+          samples=None):
+    """Greedy LD pruning: boolean mask of SNPs to keep.
+
+    Pairs within the window with r2 above the threshold are visited in SNP
+    order and, while both are still kept, the one with the lower minor
+    allele frequency is dropped (as PLINK's --indep-pairwise does).
+    """
+    reader = as_reader(genotypes)
+    af = np.zeros(reader.n_snps)
+    keep = np.ones(reader.n_snps, dtype=bool)
+    for i, j, _ in _band(reader, max_snps, max_bp, np.nextafter(r2_threshold, 2),
+                         block_snps, samples, af=af):
+        # af is filled for every SNP read so far, which covers both ends
+        maf_i, maf_j = np.minimum(af[i], 1 - af[i]), np.minimum(af[j], 1 - af[j])
+        _drop_pairs(i, j, maf_i, maf_j, keep)
+    return keep
+
+
+def clump(genotypes, pvalues, p_index=5e-8, p_clump=1e-2, r2_threshold=0.1,
+          max_bp=250_000, block_snps=1024, samples=None):
+    """Group associated SNPs into LD clumps around their strongest signal.
+
+    SNPs with p <= p_index become index SNPs in order of increasing p; each
+    claims the not-yet-clumped SNPs with p <= p_clump within ``max_bp`` and
+    r2 >= ``r2_threshold``. Returns an int array with the index SNP of each
+    SNP's clump, or -1 for SNPs in no clump.
+    """
+    reader = as_reader(genotypes)
+    p = np.asarray(pvalues, dtype=float)
+    i, j, _ = sparse_ld(reader, max_bp=max_bp, min_r2=r2_threshold,
+                        block_snps=block_snps, samples=samples)
+    # Neighbour lists in both directions, CSR-style
+    src, dst = np.r_[i, j].astype(np.int64), np.r_[j, i].astype(np.int64)
+    order = np.argsort(src, kind="stable")
+    src, dst = src[order], dst[order]
+    bounds = np.searchsorted(src, np.arange(reader.n_snps + 1))
+    clump_of = np.full(reader.n_snps, -1, dtype=np.int64)
+    for idx in np.argsort(p, kind="stable"):
+        if not p[idx] <= p_index:
+            break
+        if clump_of[idx] >= 0:
+            continue
+        clump_of[idx] = idx
+        nbr = dst[bounds[idx]:bounds[idx + 1]]
+        nbr = nbr[(clump_of[nbr] < 0) & (p[nbr] <= p_clump)]
+        clump_of[nbr] = idx
+    return clump_of
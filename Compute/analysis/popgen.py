@@ -0,0 +1,289 @@
+"""
+Vectorized population-genetics statistics for int8 genotype matrices.
+
+Everything is derived from per-population genotype counts, taken with
+whole-block row sums per population:
+
+    counts[pop, snp] = (n_hom_ref, n_het, n_hom_alt)    # missing excluded
+
+From counts: alternate allele frequencies, observed/expected
+heterozygosity, HWE chi-square and exact p-values, and Hudson and
+Weir-Cockerham Fst (per SNP and genome-wide ratio of sums). ``qc()``
+streams SNP blocks from a .bed store, so memory is bounded by the block
+size plus a few floats per SNP.
+
+    from analysis import popgen
+    from data.genotype_store import BedReader
+    bed = BedReader("data/nb02/1kg_chr22_subset")
+    pops, codes = popgen.load_populations("data/nb02/1kg_populations.csv",
+                                          bed.sample_ids)
+    res = popgen.qc(bed, codes, pops)
+    res["hwe_p"], res["fst_hudson"]     # per-SNP array, pops x pops matrix
+"""
+
+import os
+import csv
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from data.genotype_store import BedReader
+
+
+def load_populations(csv_path, sample_ids, column="population", id_column="sample_id"):
+    """Population labels for sample_ids from a CSV like 1kg_populations.csv.
+
+    Returns ``(names, codes)``: sorted population names and one int code per
+    sample (-1 for samples missing from the file).
+    """
+    with open(csv_path, newline="") as f:
+        labels = {row[id_column]: row[column] for row in csv.DictReader(f)}
+    names = sorted(set(labels[s] for s in sample_ids if s in labels))
+    index = {name: i for i, name in enumerate(names)}
+    codes = np.array([index.get(labels.get(s), -1) for s in sample_ids])
+    return names, codes
+
+
+def _pop_runs(codes):
+    """(pop, start, stop) for each run of consecutive samples in one population."""
+    codes = np.asarray(codes)
+    bounds = np.flatnonzero(np.diff(codes)) + 1
+    starts, stops = np.r_[0, bounds], np.r_[bounds, len(codes)]
+    return [(int(codes[lo]), lo, hi) for lo, hi in zip(starts, stops) if codes[lo] >= 0]
+
+
+def genotype_counts(g, codes, n_pops=None):
+    """Per-population (hom_ref, het, hom_alt) counts for a SNP-major block.
+
+    ``g`` is int8 (snps, samples) with -1 for missing; ``codes`` gives each
+    sample's population (-1 to ignore it). Returns int64 (pops, snps, 3).
+    Samples grouped by population (as in the generated panels) are counted
+    with row sums over column slices; interleaved labels fall back to one
+    matrix product against a membership matrix.
+    """
+    codes = np.asarray(codes)
+    if n_pops is None:
+        n_pops = int(codes.max()) + 1
+    b = len(g)
+    runs = _pop_runs(codes)
+    if len(runs) <= 4 * n_pops:
+        totals = np.zeros((3, n_pops, b), dtype=np.int64)
+        for pop, lo, hi in runs:
+            sub = g[:, lo:hi]
+            totals[0, pop] += (sub >= 0).sum(axis=1)
+            totals[1, pop] += (sub == 1).sum(axis=1)
+            totals[2, pop] += np.maximum(sub, 0).sum(axis=1, dtype=np.int64)
+    else:
+        member = np.zeros((len(codes), n_pops), dtype=np.float32)
+        labelled = np.flatnonzero(codes >= 0)
+        member[labelled, codes[labelled]] = 1.0
+        stacked = np.concatenate([g >= 0, g == 1, np.maximum(g, 0)]).astype(np.float32)
+        totals = np.rint(stacked @ member).astype(np.int64).reshape(3, b, n_pops)
+        totals = totals.transpose(0, 2, 1)
+    called, het, alt = totals
+    hom_alt = (alt - het) // 2
+    return np.stack([called - het - hom_alt, het, hom_alt], axis=-1)
+
+
+def allele_freqs(counts):
+    """Alternate allele frequency and number of called samples."""
+    n = counts.sum(axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p = (counts[..., 1] + 2 * counts[..., 2]) / (2.0 * n)
+    return p, n
+
+
+def heterozygosity(counts):
+    """Observed heterozygote fraction and HWE expectation 2p(1-p)."""
+    p, n = allele_freqs(counts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return counts[..., 1] / n, 2 * p * (1 - p)
+
+
+def hwe_chi2(counts):
+    """Pearson chi-square HWE test (1 df); returns (chi2, p)."""
+    from scipy import special
+    p, n = allele_freqs(counts)
+    q = 1 - p
+    expected = np.stack([n * q * q, 2 * n * p * q, n * p * p], axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        chi2 = np.where(expected > 0, (counts - expected) ** 2 / expected, 0).sum(axis=-1)
+    chi2[~(p * q > 0)] = np.nan
+    return chi2, special.chdtrc(1, chi2)
+
+
+class ExactHWE:
+    """Exact HWE p-values (Wigginton et al. 2005), vectorized over SNPs.
+
+    The null distribution of the heterozygote count depends only on the
+    number of called samples n and rare-allele copies n_a; it is computed
+    in closed form with log-gamma once per distinct (n, n_a) and cached, so
+    a panel costs one small computation per distinct pair rather than one
+    per SNP.
+    """
+
+    def __init__(self):
+        self._cache = {}
+
+    def _table(self, n, n_a):
+        """(P(h) for h = n_a % 2, n_a % 2 + 2, ..., n_a; cumulative sorted P)."""
+        from scipy.special import gammaln
+        key = (n, n_a)
+        if key not in self._cache:
+            h = np.arange(n_a % 2, n_a + 1, 2)
+            hom_r = (n_a - h) // 2
+            hom_c = n - h - hom_r
+            ok = hom_c >= 0
+            h, hom_r, hom_c = h[ok], hom_r[ok], hom_c[ok]
+            logp = (gammaln(n + 1) - gammaln(hom_r + 1) - gammaln(h + 1)
+                    - gammaln(hom_c + 1) + h * np.log(2.0) + gammaln(n_a + 1)
+                    + gammaln(2 * n - n_a + 1) - gammaln(2 * n + 1))
+            probs = np.exp(logp - logp.max())
+            probs /= probs.sum()
+            sorted_p = np.sort(probs)
+            self._cache[key] = (h, probs, sorted_p, np.cumsum(sorted_p))
+        return self._cache[key]
+
+    def pvalues(self, counts):
+        """Exact two-sided p-value per SNP for (…, 3) genotype counts."""
+        counts = np.asarray(counts).reshape(-1, 3)
+        n = counts.sum(axis=1)
+        het = counts[:, 1]
+        hom_rare = np.minimum(counts[:, 0], counts[:, 2])
+        n_a = 2 * hom_rare + het
+        pvals = np.full(len(counts), np.nan)
+        keys = n * (2 * int(n.max(initial=0)) + 1) + n_a
+        order = np.argsort(keys, kind="stable")
+        _, starts = np.unique(keys[order], return_index=True)
+        for rows in np.split(order, starts[1:]):
+            n_i, na_i = int(n[rows[0]]), int(n_a[rows[0]])
+            if n_i == 0:
+                continue
+            h, probs, sorted_p, cum = self._table(n_i, na_i)
+            p_obs = probs[np.searchsorted(h, het[rows])]
+            # Sum of all outcomes no more likely than the observed one
+            idx = np.searchsorted(sorted_p, p_obs * (1 + 1e-7), side="right") - 1
+            pvals[rows] = np.minimum(1.0, cum[idx])
+        return pvals
+
+
+def hudson_components(p1, n1, p2, n2):
+    """Hudson Fst numerator and denominator (Bhatia et al. 2013).
+
+    p are alternate allele frequencies, n called samples (2n alleles).
+    Per-SNP Fst is num / den; the genome-wide estimate is sum(num) / sum(den).
+    """
+    a1, a2 = 2.0 * n1, 2.0 * n2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        num = ((p1 - p2) ** 2 - p1 * (1 - p1) / (a1 - 1) - p2 * (1 - p2) / (a2 - 1))
+        den = p1 * (1 - p2) + p2 * (1 - p1)
+    return num, den
+
+
+def wc_components(counts):
+    """Weir-Cockerham (1984) variance components a, b, c per SNP.
+
+    ``counts`` is (pops, snps, 3). Per-SNP Fst is a / (a + b + c); the
+    genome-wide estimate is sum(a) / sum(a + b + c).
+    """
+    p, n = allele_freqs(counts)
+    n = n.astype(float)
+    h = counts[..., 1] / np.where(n > 0, n, 1)
+    p = np.nan_to_num(p)
+    r = (n > 0).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        n_tot = n.sum(axis=0)
+        n_bar = n_tot / r
+        n_c = (n_tot - (n ** 2).sum(axis=0) / n_tot) / (r - 1)
+        p_bar = (n * p).sum(axis=0) / n_tot
+        s2 = (n * (p - p_bar) ** 2).sum(axis=0) / ((r - 1) * n_bar)
+        h_bar = (n * h).sum(axis=0) / n_tot
+        pq = p_bar * (1 - p_bar)
+        a = n_bar / n_c * (s2 - (pq - (r - 1) / r * s2 - h_bar / 4) / (n_bar - 1))
+        b = n_bar / (n_bar - 1) * (pq - (r - 1) / r * s2 - (2 * n_bar - 1) / (4 * n_bar) * h_bar)
+        c = h_bar / 2
+    return a, b, c
+
+
+def _ratio(num, den):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return num / den
+
+
+def qc(genotypes, codes=None, pop_names=None, block_snps=16384, exact=True,
+       per_snp_fst=False, jobs=None):
+    """Stream SNP blocks and compute QC and differentiation statistics.
+
+    ``codes`` gives each sample's population index (see load_populations);
+    without it all samples form one population. Allele frequency,
+    heterozygosity and HWE use all labelled samples pooled. Returns a dict
+    of per-SNP arrays (af, n, missing_rate, het_obs, het_exp, hwe_chi2,
+    hwe_chi2_p, hwe_p) plus pops x pops genome-wide fst_hudson and fst_wc
+    matrices and the all-population fst_wc_all. With ``per_snp_fst``,
+    ``fst_pairs`` maps (pop_i, pop_j) to per-SNP Hudson Fst.
+    """
+    reader = BedReader(genotypes) if isinstance(genotypes, (str, os.PathLike)) else genotypes
+    if codes is None:
+        codes = np.zeros(reader.n_samples, dtype=int)
+    codes = np.asarray(codes)
+    n_pops = int(codes.max()) + 1
+    pop_names = list(pop_names) if pop_names is not None else [str(i) for i in range(n_pops)]
+    pairs = [(i, j) for i in range(n_pops) for j in range(i + 1, n_pops)]
+    exact_hwe = ExactHWE() if exact else None
+
+    def work(start):
+        g = reader.read_rows(slice(start, start + block_snps))
+        counts = genotype_counts(g, codes, n_pops)
+        pooled = counts.sum(axis=0)
+        af, n = allele_freqs(pooled)
+        het_obs, het_exp = heterozygosity(pooled)
+        chi2, chi2_p = hwe_chi2(pooled)
+        p, n_pop = allele_freqs(counts)
+        hud = [hudson_components(p[i], n_pop[i], p[j], n_pop[j]) for i, j in pairs]
+        wc_pair = [wc_components(counts[[i, j]]) for i, j in pairs]
+        wc_all = wc_components(counts) if n_pops > 1 else None
+        return {"af": af, "n": n, "het_obs": het_obs, "het_exp": het_exp,
+                "hwe_chi2": chi2, "hwe_chi2_p": chi2_p, "counts": pooled,
+                "hud": hud, "wc_pair": wc_pair, "wc_all": wc_all}
+
+    n_labelled = int((codes >= 0).sum())
+    out = {k: [] for k in ("af", "n", "het_obs", "het_exp", "hwe_chi2", "hwe_chi2_p", "hwe_p")}
+    hud_sums = np.zeros((len(pairs), 2))
+    wc_sums = np.zeros((len(pairs), 2))
+    wc_all_sums = np.zeros(2)
+    fst_pairs = {pair: [] for pair in pairs} if per_snp_fst else None
+
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        # Tasks return per-SNP summaries; each genotype block is freed as
+        # soon as its task finishes
+        for part in pool.map(work, range(0, reader.n_snps, block_snps)):
+            for k in ("af", "n", "het_obs", "het_exp", "hwe_chi2", "hwe_chi2_p"):
+                out[k].append(part[k])
+            if exact_hwe is not None:
+                out["hwe_p"].append(exact_hwe.pvalues(part["counts"]))
+            for k, (num, den) in enumerate(part["hud"]):
+                ok = np.isfinite(num) & np.isfinite(den)
+                hud_sums[k] += num[ok].sum(), den[ok].sum()
+                if fst_pairs is not None:
+                    fst_pairs[pairs[k]].append(_ratio(num, den))
+            for k, (a, b, c) in enumerate(part["wc_pair"]):
+                ok = np.isfinite(a + b + c)
+                wc_sums[k] += a[ok].sum(), (a + b + c)[ok].sum()
+            if part["wc_all"] is not None:
+                a, b, c = part["wc_all"]
+                ok = np.isfinite(a + b + c)
+                wc_all_sums += a[ok].sum(), (a + b + c)[ok].sum()
+
+    res = {k: np.concatenate(v) if v else None for k, v in out.items()}
+    res["missing_rate"] = 1.0 - res["n"] / max(n_labelled, 1)
+    fst_hudson = np.zeros((n_pops, n_pops))
+    fst_wc = np.zeros((n_pops, n_pops))
+    for k, (i, j) in enumerate(pairs):
+        fst_hudson[i, j] = fst_hudson[j, i] = _ratio(*hud_sums[k])
+        fst_wc[i, j] = fst_wc[j, i] = _ratio(*wc_sums[k])
+    res.update(pops=pop_names, fst_hudson=fst_hudson, fst_wc=fst_wc,
+               fst_wc_all=_ratio(*wc_all_sums) if n_pops > 1 else np.nan)
+    if fst_pairs is not None:
+        res["fst_pairs"] = {(pop_names[i], pop_names[j]): np.concatenate(v)
+                            for (i, j), v in fst_pairs.items()}
+    return res
@@ -0,0 +1,210 @@
+"""
+Population structure and genomic prediction from streamed genotype blocks.
+
+Genotypes are read SNP block by SNP block from the .bed stores (or a
+GenotypeArray) and standardized per SNP, z = (g - 2p) / sqrt(2p(1 - p)) with
+missing calls at the mean, so no dense float64 samples x SNPs matrix ever
+exists:
+
+    grm    standardized genomic relationship matrix K = Z Z' / m, accumulated
+           one block product at a time (GCTA / VanRaden II)
+    pcs    top-k principal components by randomized SVD: a few streaming
+           passes of Z Z' Q over an n x (k + oversamples) basis, memory
+           O(n k) without forming K
+    gblup  GBLUP solved in the n x n kernel space, y = Xb + g + e with
+           g ~ N(0, h2 K): one eigendecomposition, then REML for h2 and
+           BLUPs of g for every sample in K (training or not) are cheap
+    cross_validate
+           k-fold GBLUP accuracy with the folds fitted on a thread pool
+
+GBLUP with K = Z Z' / m and variance ratio delta equals ridge regression on
+the standardized markers with alpha = delta * m.
+
+    from analysis import popstruct
+    from data.genotype_store import BedReader
+    bed = BedReader("data/nb08/arabidopsis_snps")
+    pc = popstruct.pcs(bed, k=10)
+    K = popstruct.grm(bed)
+    cv = popstruct.cross_validate(K, y, n_folds=5)
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import optimize
+
+from analysis.tables import as_reader, covariate_matrix
+
+
+def standardize(g, dtype=np.float32):
+    """(snps, samples) standardized block of a SNP-major int8 block.
+
+    Missing calls become 0 (the mean); monomorphic SNPs are zero rows.
+    Returns the block and the number of informative SNPs in it.
+    """
+    x = g.astype(dtype)
+    missing = g < 0
+    x[missing] = 0.0
+    n_called = np.maximum(g.shape[1] - missing.sum(axis=1), 1)
+    mean = x.sum(axis=1) / n_called
+    p = mean / 2
+    sd = np.sqrt(2 * p * (1 - p))
+    valid = sd > 1e-6
+    x -= mean[:, None]
+    x[missing] = 0.0
+    x[valid] /= sd[valid, None]
+    x[~valid] = 0.0
+    return x, int(valid.sum())
+
+
+def _stream(reader, work, block_snps, samples, jobs):
+    """Sum of work(z, m) over standardized blocks, fitted on a thread pool
+    with at most 2 * jobs blocks in flight; returns (sum, total m)."""
+    jobs = jobs or os.cpu_count()
+
+    def task(start):
+        z, m = standardize(reader.read_rows(slice(start, start + block_snps), samples))
+        return work(z), m
+
+    total, n_snps, pending = None, 0, deque()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for start in range(0, reader.n_snps, block_snps):
+            pending.append(pool.submit(task, start))
+            while len(pending) > 2 * jobs or (pending and start + block_snps >= reader.n_snps):
+                part, m = pending.popleft().result()
+                total = part if total is None else total + part
+                n_snps += m
+    return total, n_snps
+
+
+def grm(genotypes, block_snps=4096, samples=None, jobs=None):
+    """Standardized genomic relationship matrix (samples x samples, float64).
+
+    K = Z Z' / m over the m polymorphic SNPs; memory is O(n_samples^2) plus
+    a few blocks, whatever the number of SNPs.
+    """
+    reader = as_reader(genotypes)
+    k, m = _stream(reader, lambda z: (z.T @ z).astype(np.float64), block_snps, samples, jobs)
+    return k / max(m, 1)
+
+
+def pcs(genotypes, k=10, n_oversamples=10, n_iter=4, block_snps=8192, samples=None,
+        seed=0, jobs=None):
+    """Top k principal components of the standardized genotypes.
+
+    Randomized SVD (Halko et al.) of Z with n_iter power iterations, each
+    one streaming pass computing Z Z' Q for an n x (k + n_oversamples)
+    basis Q. Returns ``pcs`` (samples x k, scaled like sklearn's
+    fit_transform), ``eigenvalues`` of K = Z Z' / m, ``variance_ratio``
+    (share of the total variance, trace K) and ``n_snps`` (m, the
+    polymorphic SNPs used).
+    """
+    reader = as_reader(genotypes)
+    n = reader.n_samples if samples is None else len(np.arange(reader.n_samples)[samples])
+    size = min(k + n_oversamples, n)
+    rng = np.random.default_rng(seed)
+    q = np.linalg.qr(rng.standard_normal((n, size)))[0]
+    trace = 0.0
+    for it in range(n_iter + 1):
+        basis = q.astype(np.float32)
+
+        def work(z):
+            zq = z @ basis
+            return np.column_stack([(z.T @ zq).astype(np.float64),
+                                    np.einsum("ij,ij->j", z, z, dtype=np.float64)])
+
+        out, m = _stream(reader, work, block_snps, samples, jobs)
+        w, trace = out[:, :-1], out[:, -1].sum()
+        if it < n_iter:
+            q = np.linalg.qr(w)[0]
+    vals, vecs = np.linalg.eigh(q.T @ w)
+    order = np.argsort(vals)[::-1][:k]
+    vals, u = vals[order], q @ vecs[:, order]
+    # Deterministic signs: largest-magnitude entry of each PC positive
+    u *= np.sign(u[np.abs(u).argmax(axis=0), np.arange(u.shape[1])])
+    return {"pcs": u * np.sqrt(np.maximum(vals, 0)),
+            "eigenvalues": vals / max(m, 1), "variance_ratio": vals / trace, "n_snps": m}
+
+
+def _reml(log_delta, s, yr, xr):
+    """Negative REML log-likelihood for delta = exp(log_delta) on
+    eigen-rotated data (FaST-LMM / EMMA)."""
+    w = 1.0 / (s + np.exp(log_delta))
+    xwx = xr.T @ (w[:, None] * xr)
+    beta = np.linalg.solve(xwx, xr.T @ (w * yr))
+    r = yr - xr @ beta
+    dof = len(yr) - xr.shape[1]
+    sigma2 = (w * r * r).sum() / dof
+    return 0.5 * (dof * np.log(2 * np.pi * sigma2) - np.log(w).sum() +
+                  np.linalg.slogdet(xwx)[1] + dof)
+
+
+def gblup(kernel, y, covariates=None, h2=None, train=None):
+    """GBLUP on a relationship matrix K (e.g. grm()).
+
+    Samples with a finite y (and in ``train``, a mask or index array, if
+    given) are fitted; genomic values are predicted for all samples of K.
+    h2 is estimated by REML unless given (0 < h2 < 1). Returns ``h2``, ``delta``
+    (sigma_e^2 / sigma_g^2), ``beta``, ``var_g``, ``var_e``, ``g`` (BLUP of
+    the genomic value) and ``yhat`` (X beta + g), per sample of K.
+    """
+    if h2 is not None and not 0 < h2 < 1:
+        raise ValueError(f"h2 must be strictly between 0 and 1, got {h2}")
+    kernel = np.asarray(kernel, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    x = covariate_matrix(covariates, len(y))
+    fit = np.isfinite(y) & np.isfinite(x).all(axis=1)
+    if train is not None:
+        mask = np.zeros(len(y), dtype=bool)
+        mask[train] = True
+        fit &= mask
+    idx = np.flatnonzero(fit)
+    s, u = np.linalg.eigh(kernel[np.ix_(idx, idx)])
+    s = np.maximum(s, 0.0)
+    yr, xr = u.T @ y[idx], u.T @ x[idx]
+    if h2 is None:
+        grid = np.linspace(-10, 10, 41)
+        best = grid[np.argmin([_reml(d, s, yr, xr) for d in grid])]
+        log_delta = optimize.minimize_scalar(_reml, bounds=(best - 0.5, best + 0.5),
+                                             args=(s, yr, xr), method="bounded").x
+        delta = np.exp(log_delta)
+    else:
+        delta = (1 - h2) / h2
+    w = 1.0 / (s + delta)
+    beta = np.linalg.solve(xr.T @ (w[:, None] * xr), xr.T @ (w * yr))
+    r = yr - xr @ beta
+    var_g = (w * r * r).sum() / (len(idx) - x.shape[1])
+    # alpha = V^-1 (y - X b) with V = K + delta I, then g = K alpha
+    alpha = u @ (w * r)
+    g = kernel[:, idx] @ alpha
+    return {"h2": 1 / (1 + delta), "delta": delta, "beta": beta, "var_g": var_g,
+            "var_e": var_g * delta, "g": g, "yhat": x @ beta + g}
+
+
+def cross_validate(kernel, y, covariates=None, n_folds=5, h2=None, seed=0, jobs=None):
+    """k-fold cross-validated GBLUP, one thread per fold.
+
+    Each fold refits h2 (unless given) on the training samples and predicts
+    the held-out ones from K. Returns per-fold ``r2`` and ``r`` (Pearson
+    correlation of observed and predicted), the ``h2`` of each fold and the
+    out-of-fold ``predictions`` (NaN where y is missing).
+    """
+    y = np.asarray(y, dtype=np.float64)
+    labelled = np.flatnonzero(np.isfinite(y))
+    folds = np.array_split(np.random.default_rng(seed).permutation(labelled), n_folds)
+
+    def fold(test):
+        res = gblup(kernel, y, covariates, h2, train=np.setdiff1d(labelled, test))
+        pred, obs = res["yhat"][test], y[test]
+        r2 = 1 - ((obs - pred) ** 2).sum() / ((obs - obs.mean()) ** 2).sum()
+        return pred, r2, np.corrcoef(obs, pred)[0, 1], res["h2"]
+
+    predictions = np.full(len(y), np.nan)
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        results = list(pool.map(fold, folds))
+    for test, (pred, _, _, _) in zip(folds, results):
+        predictions[test] = pred
+    _, r2, r, fold_h2 = (np.array(col) for col in zip(*results))
+    return {"r2": r2, "r": r, "h2": fold_h2, "predictions": predictions}
@@ -0,0 +1,443 @@
+"""
+Out-of-core (backed) single-cell preprocessing for atlas-scale AnnData.
+
+Runs NB03's pipeline (QC -> filter_cells / filter_genes -> normalize_total
+-> log1p -> seurat_v3 HVGs -> scale -> PCA) on an on-disk ``.h5ad`` or
+``.zarr`` whose X is CSR, without loading X. Cells are streamed in row
+blocks of about ``block_nnz`` non-zeros by worker processes that each open
+the file once, and every block stays scipy.sparse:
+
+    pass 1   QC metrics per cell and gene; cells failing the QC thresholds
+             are dropped on the fly and the per-gene detection counts and
+             count moments of the kept cells summed
+    pass 2   library sizes over the kept genes, seurat_v3 clipped variances
+             and log-normalized moments of every kept gene
+    pass 3+  PCA of the scaled HVG matrix with implicit centering: either
+             the exact HVG covariance accumulated block by block, or a
+             randomized range finder (Halko et al.) with power iterations
+             for wide matrices; scores take one more pass
+
+Scaling is never materialized, so memory is O(cells x components +
+HVGs^2). scanpy (>= 1.10) clips scaled values to [-max_value, max_value];
+the upper bound only ever hits non-zeros, and where the lower bound lifts
+the zeros of a gene, every entry of that column is shifted down by the
+bound, which keeps the zeros sparse and is undone by the PCA's centering.
+Neighbors, UMAP and Leiden then run on the small embedding (the atlas is
+opt-in: ``python data/download_all_data.py --only sc-atlas``):
+
+    from analysis import scatlas
+    res = scatlas.preprocess("data/nb03/sc_atlas.h5ad")
+    adata = scatlas.to_anndata(res)
+    sc.pp.neighbors(adata, n_neighbors=15, n_pcs=30, use_rep="X_pca")
+"""
+
+import os
+
+import numpy as np
+from scipy import sparse
+
+from data.pool import default_jobs, run_chunks
+
+# Non-zeros per streamed block (data + indices: ~64 MB)
+BLOCK_NNZ = 1 << 23
+
+
+def _strings(node):
+    if hasattr(node, "asstr"):  # h5py
+        return np.asarray(node.asstr()[()], dtype=object)
+    return np.asarray(node[:], dtype=object)
+
+
+class BackedCSR:
+    """Row blocks of the CSR ``X`` of an on-disk AnnData (.h5ad or .zarr).
+
+    Only ``indptr`` (8 bytes per cell) is held in memory; ``block`` reads
+    the data / indices slice of a row range.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.isdir(path) or path.rstrip("/").endswith(".zarr"):
+            import zarr
+            self._file = zarr.open_group(path, mode="r")
+        else:
+            import h5py
+            self._file = h5py.File(path, "r")
+        x = self._file["X"]
+        encoding = x.attrs.get("encoding-type") if hasattr(x, "attrs") else None
+        if encoding != "csr_matrix":
+            raise ValueError(f"{path}: X is {encoding or 'dense'}, not csr_matrix; "
+                             "rewrite it with X as a CSR matrix for backed processing")
+        self.shape = tuple(int(s) for s in x.attrs["shape"])
+        self.indptr = np.asarray(x["indptr"][:], dtype=np.int64)
+        self.nnz = int(self.indptr[-1])
+        self._data, self._indices = x["data"], x["indices"]
+
+    def close(self):
+        if hasattr(self._file, "close"):
+            self._file.close()
+
+    def names(self, axis):
+        """obs (``"obs"``) or var (``"var"``) names."""
+        df = self._file[axis]
+        return _strings(df[df.attrs.get("_index", "_index")])
+
+    def spans(self, block_nnz=BLOCK_NNZ):
+        """(start, stop) row ranges of about block_nnz non-zeros each."""
+        cuts = np.searchsorted(self.indptr, np.arange(block_nnz, self.nnz, block_nnz))
+        bounds = np.unique(np.r_[0, cuts, self.shape[0]])
+        return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+    def block(self, start, stop):
+        """Rows [start, stop) as a float64 CSR matrix, explicit zeros dropped."""
+        lo, hi = self.indptr[start], self.indptr[stop]
+        x = sparse.csr_matrix((np.asarray(self._data[lo:hi], dtype=np.float64),
+                               np.asarray(self._indices[lo:hi]),
+                               self.indptr[start:stop + 1] - lo),
+                              shape=(stop - start, self.shape[1]))
+        x.eliminate_zeros()
+        return x
+
+
+def _row_ids(x):
+    return np.repeat(np.arange(x.shape[0]), np.diff(x.indptr))
+
+
+def _take(x, rows, col_map, n_cols):
+    """x[rows][:, cols] for a row mask and an old -> new column map (-1 = drop)."""
+    x = x[rows]
+    cols = col_map[x.indices]
+    ok = cols >= 0
+    indptr = np.zeros(x.shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(_row_ids(x)[ok], minlength=x.shape[0]), out=indptr[1:])
+    return sparse.csr_matrix((x.data[ok], cols[ok], indptr), shape=(x.shape[0], n_cols))
+
+
+def _lognorm(x, target_sum):
+    """normalize_total(target_sum) + log1p of a CSR block; also the totals."""
+    rows = _row_ids(x)
+    totals = np.bincount(rows, x.data, x.shape[0])
+    scale = np.divide(target_sum, totals, out=np.zeros_like(totals), where=totals > 0)
+    x = sparse.csr_matrix((np.log1p(x.data * scale[rows]), x.indices, x.indptr),
+                          shape=x.shape)
+    return x, totals
+
+
+def _moments(x, n_cols):
+    return (np.bincount(x.indices, x.data, n_cols),
+            np.bincount(x.indices, x.data * x.data, n_cols))
+
+
+# Per-worker reader and per-pass constants, set by _init_worker
+_WORKER = {}
+
+
+def _init_worker(path, consts):
+    if _WORKER.get("path") != path:
+        if "reader" in _WORKER:
+            _WORKER["reader"].close()
+        _WORKER.update(path=path, reader=BackedCSR(path))
+    _WORKER["consts"] = consts
+
+
+def _close_worker():
+    if "reader" in _WORKER:
+        _WORKER["reader"].close()
+    _WORKER.clear()
+
+
+def _qc_block(task):
+    """Pass 1: QC metrics of a row block and gene moments of its kept cells."""
+    start, stop = task
+    c = _WORKER["consts"]
+    x = _WORKER["reader"].block(start, stop)
+    n_genes = x.shape[1]
+    rows = _row_ids(x)
+    total = np.bincount(rows, x.data, x.shape[0])
+    detected = np.diff(x.indptr)
+    is_mt = c["mt"][x.indices]
+    mt = np.bincount(rows[is_mt], x.data[is_mt], x.shape[0])
+    pct_mt = np.divide(100 * mt, total, out=np.zeros_like(total), where=total > 0)
+    keep = ((detected >= c["min_genes"]) & (total >= c["min_counts"]) &
+            (pct_mt <= c["max_pct_mt"]))
+    kept = x[keep]
+    return (total, detected, pct_mt, keep,
+            np.bincount(x.indices, minlength=n_genes), np.bincount(x.indices, x.data, n_genes),
+            np.bincount(kept.indices, minlength=n_genes)) + _moments(kept, n_genes)
+
+
+def _norm_block(task):
+    """Pass 2: seurat_v3 clipped count moments and log-normalized moments."""
+    start, stop = task
+    c = _WORKER["consts"]
+    x = _take(_WORKER["reader"].block(start, stop), c["keep"][start:stop],
+              c["gene_map"], len(c["clip"]))
+    clipped = sparse.csr_matrix((np.minimum(x.data, c["clip"][x.indices]), x.indices,
+                                 x.indptr), shape=x.shape)
+    lognorm, totals = _lognorm(x, c["target_sum"])
+    return (totals,) + _moments(clipped, x.shape[1]) + _moments(lognorm, x.shape[1])
+
+
+def _hvg_block(start, stop):
+    """Kept cells x HVGs of a row block: log-normalized, clipped to
+    mean +/- max_value sd and shifted down by the positive lower bounds."""
+    c = _WORKER["consts"]
+    x = _take(_WORKER["reader"].block(start, stop), c["keep"][start:stop],
+              c["gene_map"], len(c["hvg_map"]))
+    x, _ = _lognorm(x, c["target_sum"])
+    x = _take(x, slice(None), c["hvg_map"], len(c["clip"]))
+    floor = c["floor"][x.indices]
+    np.clip(x.data, floor, c["clip"][x.indices], out=x.data)
+    x.data -= floor
+    return x
+
+
+def _pca_block(task):
+    """Pass 3+: one product of a block of the clipped HVG matrix Xc.
+
+    ``gram``   Xc^T Xc and column sums
+    ``right``  Xc @ M and column sums / sums of squares
+    ``left``   Xc^T @ Y for this block's rows of Y
+    """
+    start, stop, y = task
+    c = _WORKER["consts"]
+    x = _hvg_block(start, stop)
+    if c["op"] == "gram":
+        return (x.T @ x).toarray(), np.bincount(x.indices, x.data, x.shape[1])
+    if c["op"] == "right":
+        return (x @ c["m"],) + _moments(x, x.shape[1])
+    return x.T @ y
+
+
+def _loess(x, y, span=0.3):
+    """Local quadratic regression (tricube weights) fitted at every x."""
+    try:
+        from skmisc.loess import loess
+        model = loess(x, y, span=span, degree=2)
+        model.fit()
+        return model.outputs.fitted_values
+    except ImportError:
+        pass
+    q = max(3, int(np.floor(span * len(x))))
+    fitted = np.empty(len(x))
+    for s in range(0, len(x), 256):
+        u = x[None, :] - x[s:s + 256, None]
+        h = np.partition(np.abs(u), q - 1, axis=1)[:, q - 1:q]
+        w = np.clip(1 - (np.abs(u) / np.maximum(h, 1e-12)) ** 3, 0, None) ** 3
+        powers = [np.ones_like(u), u, u * u]
+        a = np.stack([np.stack([(w * p * r).sum(1) for r in powers], -1) for p in powers], -2)
+        b = np.stack([(w * p * y).sum(1) for p in powers], -1)
+        fitted[s:s + 256] = np.linalg.solve(a + 1e-12 * np.eye(3), b[..., None])[:, 0, 0]
+    return fitted
+
+
+def seurat_v3_fit(s1, s2, n, span=0.3):
+    """Per-gene mean, variance and loess-regularized std of raw counts.
+
+    ``s1`` / ``s2`` are per-gene sums and sums of squares over n cells.
+    Returns (mean, variance, reg_std, clip) with scanpy's seurat_v3 clip
+    value mean + reg_std * sqrt(n).
+    """
+    mean = s1 / n
+    var = np.maximum(s2 - n * mean * mean, 0) / (n - 1)
+    not_const = var > 0
+    estimate = np.zeros(len(mean))
+    estimate[not_const] = _loess(np.log10(mean[not_const]), np.log10(var[not_const]), span)
+    reg_std = np.sqrt(10 ** estimate)
+    return mean, var, reg_std, mean + reg_std * np.sqrt(n)
+
+
+def seurat_v3_variance(n, mean, reg_std, clipped_s1, clipped_s2):
+    """Normalized variance of the clipped standardized counts (seurat_v3)."""
+    return (n * mean * mean + clipped_s2 - 2 * clipped_s1 * mean) / ((n - 1) * reg_std ** 2)
+
+
+def _flip(components, scores):
+    """Make the largest-magnitude loading of each component positive."""
+    top = np.abs(components).argmax(axis=0)
+    signs = np.sign(components[top, np.arange(components.shape[1])])
+    signs[signs == 0] = 1
+    return components * signs, scores * signs
+
+
+def _pca(run, n, sd, n_comps, method, n_oversamples, n_iter, seed):
+    """PCA of Z = (Xc - mean) / sd with Xc streamed by ``run``."""
+    h = len(sd)
+    if method == "covariance":
+        gram, s = np.zeros((h, h)), np.zeros(h)
+        for g, colsum in run("gram"):
+            gram += g
+            s += colsum
+        mu = s / n
+        cov = (gram - n * np.outer(mu, mu)) / (n - 1) / np.outer(sd, sd)
+        evals, evecs = np.linalg.eigh(cov)
+        order = np.argsort(evals)[::-1][:n_comps]
+        variance, components = evals[order], evecs[:, order]
+        total = np.trace(cov)
+        m = components / sd[:, None]
+        scores = np.concatenate([xm for xm, _, _ in run("right", m=m)]) - (mu / sd) @ components
+        components, scores = _flip(components, scores)
+        return scores, components, variance, variance / total
+
+    rng = np.random.default_rng(seed)
+
+    def right(m):
+        parts, s, s2 = [], np.zeros(h), np.zeros(h)
+        for xm, colsum, colsq in run("right", m=m / sd[:, None]):
+            parts.append(xm)
+            s += colsum
+            s2 += colsq
+        return np.concatenate(parts), s, s2
+
+    def left(y):
+        w = sum(run("left", y=y))
+        return (w - np.outer(mu, y.sum(axis=0))) / sd[:, None]
+
+    omega = rng.standard_normal((h, min(n_comps + n_oversamples, h)))
+    y, s, s2 = right(omega)
+    mu = s / n
+    y -= (mu / sd) @ omega
+    total = np.sum(np.maximum(s2 - n * mu * mu, 0) / (n - 1) / sd ** 2)
+    for _ in range(n_iter):
+        q, _ = np.linalg.qr(y)
+        w, _ = np.linalg.qr(left(q))
+        y = right(w)[0] - (mu / sd) @ w
+    q, _ = np.linalg.qr(y)
+    u, sv, vt = np.linalg.svd(left(q).T, full_matrices=False)
+    components = vt[:n_comps].T
+    scores = q @ (u[:, :n_comps] * sv[:n_comps])
+    variance = sv[:n_comps] ** 2 / (n - 1)
+    components, scores = _flip(components, scores)
+    return scores, components, variance, variance / total
+
+
+def preprocess(path, min_genes=100, min_cells=10, min_counts=0, max_pct_mt=100.0,
+               mt_prefix="MT-", target_sum=1e4, n_top_genes=1000, span=0.3, max_value=10,
+               n_comps=50, method="auto", n_oversamples=10, n_iter=4, seed=0,
+               block_nnz=BLOCK_NNZ, jobs=None):
+    """NB03's preprocessing on a backed AnnData, streaming cells in blocks.
+
+    ``method`` is ``"covariance"`` (exact; one pass for the HVG x HVG
+    covariance), ``"randomized"`` (2 * n_iter + 2 passes, memory
+    O(cells x (n_comps + n_oversamples))) or ``"auto"`` (covariance up to
+    4096 HVGs). Returns a dict with
+
+        obs_names, obs          kept cells and their QC metrics
+        qc                      QC metrics of every cell plus the ``keep`` mask
+        var_names, var          kept genes, with seurat_v3 mean / variances /
+                                variances_norm, highly_variable and
+                                log-normalized mean / std
+        hvg                     indices of the HVGs into var_names
+        X_pca, PCs              cell scores and HVG loadings
+        variance, variance_ratio
+        shape, nnz, pca_method  input cells x genes, its non-zeros and the
+                                PCA method used
+    """
+    reader = BackedCSR(path)
+    n_obs, n_vars = reader.shape
+    spans = reader.spans(block_nnz)
+    obs_names, var_names = reader.names("obs"), reader.names("var")
+    nnz = reader.nnz
+    reader.close()
+    jobs = jobs or default_jobs()
+
+    def run(fn, consts, tasks=spans):
+        return run_chunks(fn, tasks, jobs, initializer=_init_worker, initargs=(path, consts))
+
+    # Pass 1: QC, cell filter, gene detection and count moments
+    mt = np.array([str(g).startswith(mt_prefix) for g in var_names]) if mt_prefix else \
+        np.zeros(n_vars, dtype=bool)
+    qc_consts = {"mt": mt, "min_genes": min_genes, "min_counts": min_counts,
+                 "max_pct_mt": max_pct_mt}
+    cell_parts = [], [], [], []
+    gene_sums = [np.zeros(n_vars) for _ in range(5)]
+    for res in run(_qc_block, qc_consts):
+        for part, r in zip(cell_parts, res[:4]):
+            part.append(r)
+        for acc, r in zip(gene_sums, res[4:]):
+            acc += r
+    total, detected, pct_mt, keep = (np.concatenate(p) for p in cell_parts)
+    cells_all, counts_all, n_cells, s1, s2 = gene_sums
+    n = int(keep.sum())
+    genes = np.flatnonzero(n_cells >= min_cells)
+    gene_map = np.full(n_vars, -1, dtype=np.int64)
+    gene_map[genes] = np.arange(len(genes))
+
+    # Pass 2: seurat_v3 HVGs on counts, log-normalized moments for scaling
+    mean, var, reg_std, clip = seurat_v3_fit(s1[genes], s2[genes], n, span)
+    norm_consts = {"keep": keep, "gene_map": gene_map, "clip": clip, "target_sum": target_sum}
+    sizes, c1, c2, l1, l2 = [], 0, 0, 0, 0
+    for totals, a1, a2, b1, b2 in run(_norm_block, norm_consts):
+        sizes.append(totals)
+        c1, c2, l1, l2 = c1 + a1, c2 + a2, l1 + b1, l2 + b2
+    var_norm = seurat_v3_variance(n, mean, reg_std, c1, c2)
+    n_top = min(n_top_genes, len(genes))
+    hvg = np.sort(np.argsort(-var_norm, kind="stable")[:n_top])
+    ln_mean = l1 / n
+    ln_std = np.sqrt(np.maximum(l2 - n * ln_mean * ln_mean, 0) / (n - 1))
+    sd = np.where(ln_std[hvg] > 0, ln_std[hvg], 1.0)
+    hvg_map = np.full(len(genes), -1, dtype=np.int64)
+    hvg_map[hvg] = np.arange(n_top)
+
+    # Pass 3+: PCA of the scaled HVG matrix
+    if method == "auto":
+        method = "covariance" if n_top <= 4096 else "randomized"
+    bound = (max_value if max_value is not None else np.inf) * sd
+    pca_consts = {"keep": keep, "gene_map": gene_map, "hvg_map": hvg_map,
+                  "clip": ln_mean[hvg] + bound,
+                  "floor": np.maximum(ln_mean[hvg] - bound, 0), "target_sum": target_sum}
+    offsets = np.r_[0, np.cumsum([keep[a:b].sum() for a, b in spans])]
+
+    def run_pca(op, m=None, y=None):
+        consts = dict(pca_consts, op=op, m=m)
+        if y is None:
+            tasks = [(a, b, None) for a, b in spans]
+        else:
+            tasks = [(a, b, y[o0:o1]) for (a, b), o0, o1 in zip(spans, offsets, offsets[1:])]
+        return run(_pca_block, consts, tasks)
+
+    n_comps = min(n_comps, n_top, n - 1)
+    scores, components, variance, ratio = _pca(run_pca, n, sd, n_comps, method,
+                                               n_oversamples, n_iter, seed)
+    _close_worker()
+
+    highly_variable = np.zeros(len(genes), dtype=bool)
+    highly_variable[hvg] = True
+    return {
+        "obs_names": obs_names[keep],
+        "obs": {"n_genes_by_counts": detected[keep], "total_counts": total[keep],
+                "pct_counts_mt": pct_mt[keep], "size": np.concatenate(sizes)},
+        "qc": {"n_genes_by_counts": detected, "total_counts": total,
+               "pct_counts_mt": pct_mt, "keep": keep,
+               "n_cells_by_counts": cells_all, "gene_total_counts": counts_all},
+        "var_names": var_names[genes],
+        "var": {"n_cells": n_cells[genes], "means": mean, "variances": var,
+                "variances_norm": var_norm, "highly_variable": highly_variable,
+                "lognorm_mean": ln_mean, "lognorm_std": ln_std},
+        "hvg": hvg,
+        "X_pca": scores.astype(np.float32),
+        "PCs": components,
+        "variance": variance,
+        "variance_ratio": ratio,
+        "shape": (n_obs, n_vars),
+        "nnz": nnz,
+        "pca_method": method,
+    }
+
+
+def to_anndata(result):
+    """An X-less AnnData of the kept cells x HVGs with obsm["X_pca"],
+    ready for sc.pp.neighbors / sc.tl.umap / sc.tl.leiden."""
+    import anndata as ad
+    import pandas as pd
+    hvg = result["hvg"]
+    var = pd.DataFrame({k: np.asarray(v)[hvg] for k, v in result["var"].items()},
+                       index=result["var_names"][hvg].astype(str))
+    adata = ad.AnnData(obs=pd.DataFrame(result["obs"],
+                                        index=result["obs_names"].astype(str)),
+                       var=var)
+    adata.obsm["X_pca"] = result["X_pca"]
+    adata.varm["PCs"] = result["PCs"]
+    adata.uns["pca"] = {"variance": result["variance"],
+                        "variance_ratio": result["variance_ratio"]}
+    return adata
@@ -0,0 +1,270 @@
+"""
+Whole-genome sequence statistics on a NumPy base encoding.
+
+Records from FASTA or GenBank files are read as raw bytes and mapped
+through a 256-entry lookup table to uint8 codes (A=0, C=1, G=2, T=3, any
+other symbol 4), one byte per base; ``pack_2bit`` stores them at four bases
+per byte. Every statistic is then array arithmetic over the codes, done in
+blocks of ``chunk`` bases so memory stays flat on multi-megabase genomes:
+
+    gc_windows     sliding-window GC fraction and GC skew, from prefix sums
+                   of G/C indicators sampled only at window boundaries, plus
+                   the cumulative skew (origin / terminus of replication)
+    kmer_counts    k-mer (or canonical k-mer) counts from 2-bit rolling
+                   hashes built with k shifted array ORs, not per position
+    kmer_spectrum  histogram of k-mer multiplicities
+    codon_usage    codon counts in all six reading frames from a single
+                   pass of forward and reverse-complement 3-mer hashes
+
+K-mers and codons touching a non-ACGT base are skipped.
+
+    from analysis import seqstats
+    rec = seqstats.read_records("data/nb01/e_coli_k12_segment.gb")[0]
+    gc = seqstats.gc_windows(rec["codes"], window=5000, step=1000)
+    usage = seqstats.codon_usage(rec["codes"])          # (6, 64)
+"""
+
+import numpy as np
+
+BASES = "ACGT"
+N_CODE = 4
+# Codon labels in hash order (A=0 ... T=3, first base most significant)
+CODONS = [a + b + c for a in BASES for b in BASES for c in BASES]
+# Bases per block for the chunked passes
+CHUNK = 1 << 24
+
+_LUT = np.full(256, N_CODE, dtype=np.uint8)
+for _i, _b in enumerate(BASES):
+    _LUT[ord(_b)] = _LUT[ord(_b.lower())] = _i
+_LUT[ord("U")] = _LUT[ord("u")] = 3
+_COMPLEMENT = np.array([3, 2, 1, 0, N_CODE], dtype=np.uint8)
+
+
+def encode(seq):
+    """uint8 codes of a str / bytes / Bio.Seq sequence."""
+    if not isinstance(seq, (bytes, bytearray)):
+        seq = str(seq).encode("ascii")
+    return _LUT[np.frombuffer(seq, dtype=np.uint8)]
+
+
+def decode(codes):
+    return np.frombuffer(b"ACGTN", dtype=np.uint8)[codes].tobytes().decode()
+
+
+def reverse_complement(codes):
+    return _COMPLEMENT[codes[::-1]]
+
+
+def pack_2bit(codes):
+    """(packed uint8 array, positions of non-ACGT bases): 4 bases per byte."""
+    n_pos = np.flatnonzero(codes == N_CODE)
+    c = np.where(codes == N_CODE, 0, codes)
+    c = np.concatenate([c, np.zeros(-len(c) % 4, dtype=np.uint8)]).reshape(-1, 4)
+    packed = (c[:, 0] << 6) | (c[:, 1] << 4) | (c[:, 2] << 2) | c[:, 3]
+    return packed.astype(np.uint8), n_pos
+
+
+def unpack_2bit(packed, length, n_positions=()):
+    codes = np.empty((len(packed), 4), dtype=np.uint8)
+    for j in range(4):
+        codes[:, j] = (packed >> (6 - 2 * j)) & 3
+    codes = codes.ravel()[:length]
+    codes[np.asarray(n_positions, dtype=np.int64)] = N_CODE
+    return codes
+
+
+def _genbank_records(data):
+    for entry in data.split(b"\n//"):
+        head, sep, origin = entry.partition(b"\nORIGIN")
+        if not sep:
+            continue
+        fields = {}
+        for line in head.splitlines():
+            key = line[:12].strip().decode()
+            if key in ("LOCUS", "VERSION", "DEFINITION") and key not in fields:
+                fields[key] = line[12:].decode().strip()
+        name = fields.get("VERSION", fields.get("LOCUS", "")).split(" ")[0]
+        seq = origin.partition(b"\n")[2].translate(None, b"0123456789 \t\r\n")
+        yield {"id": name, "description": fields.get("DEFINITION", ""), "codes": _LUT[
+            np.frombuffer(seq, dtype=np.uint8)]}
+
+
+def _fasta_records(data):
+    for entry in data.split(b"\n>"):
+        header, _, seq = entry.lstrip(b">").partition(b"\n")
+        if not header and not seq:
+            continue
+        name, _, description = header.decode().strip().partition(" ")
+        seq = seq.translate(None, b" \t\r\n")
+        yield {"id": name, "description": description,
+               "codes": _LUT[np.frombuffer(seq, dtype=np.uint8)]}
+
+
+def read_records(path):
+    """Records of a FASTA or GenBank file as dicts of id, description, codes."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data.lstrip().startswith(b"LOCUS"):
+        return list(_genbank_records(data))
+    return list(_fasta_records(data))
+
+
+def base_counts(codes):
+    """Counts of A, C, G, T and other symbols."""
+    return np.bincount(codes, minlength=5)[:5]
+
+
+def _prefix_at(values, points, chunk=CHUNK):
+    """sum(values[:p]) for each sorted point p, in one chunked pass (points
+    past the end get the total)."""
+    out = np.zeros(len(points), dtype=np.int64)
+    carry, done = 0, 0
+    for start in range(0, len(values), chunk):
+        cs = np.cumsum(values[start:start + chunk], dtype=np.int64)
+        hi = np.searchsorted(points, start + len(cs), side="right")
+        p = points[done:hi] - start
+        out[done:hi] = carry + np.where(p > 0, cs[np.maximum(p - 1, 0)], 0)
+        done = hi
+        carry += int(cs[-1])
+    out[done:] = carry
+    return out
+
+
+def gc_windows(codes, window=1000, step=None, chunk=CHUNK):
+    """GC fraction and GC skew of sliding windows.
+
+    Windows start every ``step`` bases (default: window, i.e. tiling) and
+    lie wholly inside the sequence, so a record shorter than one window
+    has none. Returns ``position`` (window centers), ``gc`` (G+C over ACGT bases),
+    ``skew`` ((G-C)/(G+C)) and ``cumulative_skew`` (running sum of G-C up
+    to each window end, whose minimum / maximum mark the replication origin
+    and terminus of a bacterial chromosome).
+    """
+    step = step or window
+    starts = np.arange(0, len(codes) - window + 1, step)
+    points = np.concatenate([starts, starts + window])
+    order = np.argsort(points, kind="stable")
+    sums = {}
+    for name, value in (("g", codes == 2), ("c", codes == 1), ("acgt", codes < N_CODE)):
+        at = np.empty(len(points), dtype=np.int64)
+        at[order] = _prefix_at(value.view(np.uint8), points[order], chunk)
+        sums[name] = at[len(starts):] - at[:len(starts)], at[len(starts):]
+    g, c, acgt = sums["g"][0], sums["c"][0], sums["acgt"][0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gc = np.where(acgt > 0, (g + c) / acgt, np.nan)
+        skew = np.where(g + c > 0, (g - c) / (g + c), 0.0)
+    return {"position": starts + window // 2, "gc": gc, "skew": skew,
+            "cumulative_skew": sums["g"][1] - sums["c"][1]}
+
+
+def _hashes(codes, k, chunk=CHUNK):
+    """Yield (start, forward, reverse-complement, valid) k-mer hash blocks.
+
+    Hashes are 2 bits per base, first base most significant, in the
+    smallest unsigned dtype that holds 4**k; position i of a block is the
+    k-mer at codes[start + i]. ``valid`` is None when the block has only
+    ACGT, otherwise False where the k-mer touches another symbol.
+    """
+    if k > 31:
+        raise ValueError("k must be at most 31 for 64-bit hashes")
+    dtype = np.dtype(f"uint{max(8, 1 << int(np.ceil(np.log2(2 * k))))}")
+    two, three = dtype.type(2), dtype.type(3)
+    n = len(codes) - k + 1
+    for start in range(0, max(n, 0), chunk):
+        block = codes[start:min(start + chunk, n) + k - 1]
+        m = len(block) - k + 1
+        valid = None
+        if (block == N_CODE).any():
+            bad = np.r_[0, np.cumsum(block == N_CODE)]
+            valid = bad[k:] == bad[:m]
+            block = np.where(block == N_CODE, 0, block)
+        c = block.astype(dtype)
+        fwd = c[:m].copy()
+        rc = three - c[:m]
+        for j in range(1, k):
+            fwd <<= two
+            fwd |= c[j:j + m]
+            rc |= (three - c[j:j + m]) << dtype.type(2 * j)
+        yield start, fwd, rc, valid
+
+
+def _count(hashes, valid, size):
+    if valid is not None:
+        hashes = hashes[valid]
+    return np.bincount(hashes, minlength=size)
+
+
+def kmer_counts(codes, k, canonical=False, chunk=CHUNK):
+    """Dense k-mer counts (length 4**k, k <= 12), indexed by 2-bit hash.
+
+    With ``canonical`` each k-mer is counted under the smaller of its own
+    and its reverse complement's hash (strand-independent counts).
+    """
+    if k > 12:
+        raise ValueError("dense counts need k <= 12; use kmer_spectrum for larger k")
+    counts = np.zeros(4 ** k, dtype=np.int64)
+    for _, fwd, rc, valid in _hashes(codes, k, chunk):
+        counts += _count(np.minimum(fwd, rc) if canonical else fwd, valid, 4 ** k)
+    return counts
+
+
+def kmer_labels(k):
+    """k-mer strings in hash order."""
+    idx = np.arange(4 ** k)
+    digits = (idx[:, None] >> (2 * np.arange(k - 1, -1, -1))) & 3
+    return ["".join(BASES[d] for d in row) for row in digits]
+
+
+def kmer_spectrum(codes, k=21, canonical=True, chunk=CHUNK):
+    """Histogram of k-mer multiplicities: spectrum[m] = distinct k-mers seen m times.
+
+    Uses dense counts for k <= 12, otherwise sorts the hashes (8 bytes per
+    base of memory).
+    """
+    if k <= 12:
+        counts = kmer_counts(codes, k, canonical, chunk)
+        counts = counts[counts > 0]
+    else:
+        parts = []
+        for _, fwd, rc, valid in _hashes(codes, k, chunk):
+            h = np.minimum(fwd, rc) if canonical else fwd
+            parts.append(h if valid is None else h[valid])
+        hashes = np.concatenate(parts) if parts else np.zeros(0, dtype=np.uint64)
+        hashes.sort()
+        edges = np.flatnonzero(np.r_[True, hashes[1:] != hashes[:-1], True])
+        counts = np.diff(edges) if len(hashes) else np.zeros(0, dtype=np.int64)
+    return np.bincount(counts)
+
+
+def codon_usage(codes, chunk=CHUNK):
+    """(6, 64) codon counts of reading frames +1, +2, +3, -1, -2, -3.
+
+    Frame +f reads codons from base f-1; frame -f from base f-1 of the
+    reverse complement. Columns follow CODONS. One pass of forward and
+    reverse-complement 3-mer hashes covers all six frames.
+    """
+    chunk -= chunk % 3
+    n = len(codes)
+    usage = np.zeros((6, 64), dtype=np.int64)
+    for _, fwd, rc, valid in _hashes(codes, 3, chunk):
+        for f in range(3):
+            # Blocks start at multiples of 3, so frame f is every 3rd hash from f;
+            # reverse-complement offset r + 3m starts at forward n - r - 3(m + 1)
+            r = (n - f) % 3
+            usage[f] += _count(fwd[f::3], None if valid is None else valid[f::3], 64)
+            usage[3 + f] += _count(rc[r::3], None if valid is None else valid[r::3], 64)
+    return usage
+
+
+def summarize(path, window=1000, step=None, k=4):
+    """Per-record base composition, GC windows, k-mer counts and six-frame
+    codon usage of a FASTA / GenBank file."""
+    out = []
+    for rec in read_records(path):
+        codes = rec["codes"]
+        counts = base_counts(codes)
+        gc = counts[1:3].sum() / max(counts[:4].sum(), 1)
+        out.append(dict(rec, base_counts=counts, gc=gc,
+                        windows=gc_windows(codes, window, step),
+                        kmers=kmer_counts(codes, k), codon_usage=codon_usage(codes)))
+    return out
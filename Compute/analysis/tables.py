@@ -0,0 +1,67 @@
+"""
+Per-sample tables, covariates and genotype inputs shared by the analysis
+modules.
+
+Sample sheets (phenotypes, RNA-seq metadata) are small CSVs keyed by a
+sample id column; they are read as columns of strings in the order of the
+samples of a count matrix or genotype store, and turned into numeric or
+indicator covariates from there:
+
+    from analysis import tables
+    meta = tables.read_table("data/nb05/airway_metadata.csv", "sample_id", samples)
+    blocks = tables.one_hot(meta["cell_line"])
+    c = tables.covariate_matrix([blocks], len(samples))   # intercept first
+
+Genotype arguments (a .bed prefix, a samples x SNPs array or a reader) go
+through as_reader().
+"""
+
+import os
+import csv
+
+import numpy as np
+
+from data.genotype_store import BedReader, GenotypeArray
+
+
+def one_hot(labels, drop_first=True):
+    """Indicator columns for a categorical covariate (first level dropped)."""
+    levels, codes = np.unique(np.asarray(labels), return_inverse=True)
+    onehot = np.eye(len(levels))[codes]
+    return onehot[:, 1:] if drop_first else onehot
+
+
+def read_table(csv_path, id_column, sample_ids):
+    """Columns of a per-sample CSV ordered like sample_ids.
+
+    Returns {column: array of str}; samples absent from the file get "".
+    """
+    with open(csv_path, newline="") as f:
+        reader = csv.DictReader(f)
+        rows = {row[id_column]: row for row in reader}
+        columns = reader.fieldnames or []
+    return {name: np.array([rows.get(s, {}).get(name, "") for s in sample_ids])
+            for name in columns}
+
+
+def to_float(values):
+    """Numeric array from strings, with blanks (missing) as NaN."""
+    return np.array([float(v) if str(v).strip() else np.nan for v in values])
+
+
+def covariate_matrix(covariates, n):
+    """n x (1 + ...) design: an intercept, then each covariate's columns."""
+    cols = [np.ones(n)]
+    for cov in covariates or ():
+        cols.append(np.asarray(cov, dtype=float).reshape(n, -1))
+    return np.column_stack(cols)
+
+
+def as_reader(genotypes):
+    """BedReader for a .bed prefix; a bare (samples, snps) array is treated
+    as one chromosome with the SNP index as position. Readers pass through."""
+    if isinstance(genotypes, (str, os.PathLike)):
+        return BedReader(genotypes)
+    if isinstance(genotypes, np.ndarray):
+        return GenotypeArray(genotypes, [f"chr0_{k}" for k in range(genotypes.shape[1])])
+    return genotypes
@@ -0,0 +1,247 @@
+"""
+Persistent per-tile feature store for whole-slide images.
+
+A SQLite file (default ``data/nb07/tile_features.sqlite``) records
+
+    slides     content digest (SHA-256) of each slide, cached per
+               (path, size, mtime), so an unchanged slide is never rehashed
+    tiles      the tissue tiles selected for (slide, level, tile size,
+               min tissue): coordinates and tissue fraction
+    extractors feature-extractor version + parameters and column names
+    features   one float64 vector per (tile, extractor), as a blob
+
+Features are therefore keyed by (slide digest, level, tile coordinates,
+extractor). ``analyze_slide`` reuses a stored tile selection, computes
+features only for tiles that lack them under the current extractor (so a
+new extractor version recomputes pixels but not the tissue mask, and an
+interrupted run resumes), and commits each batch as it arrives. Slide-level
+mean / max / top-k pooling then reads straight from the store.
+
+    from analysis import tilestore
+    store = tilestore.TileStore()
+    agg = tilestore.analyze_slide("data/nb07/CMU-1-Small-Region.svs", store)
+    agg["mean"], agg["max"], agg["top_x"], agg["top_y"]
+"""
+
+import os
+import json
+import sqlite3
+
+import numpy as np
+
+from analysis import wsi
+from data.datacache import sha256_file
+from data.pool import run_chunks
+
+DEFAULT_STORE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             "data", "nb07", "tile_features.sqlite")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS slides (
+    path     TEXT PRIMARY KEY,
+    size     INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest   TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tilesets (
+    slide      TEXT NOT NULL,
+    level      INTEGER NOT NULL,
+    tile_size  INTEGER NOT NULL,
+    min_tissue REAL NOT NULL,
+    PRIMARY KEY (slide, level, tile_size, min_tissue)
+);
+CREATE TABLE IF NOT EXISTS tiles (
+    id        INTEGER PRIMARY KEY,
+    slide     TEXT NOT NULL,
+    level     INTEGER NOT NULL,
+    tile_size INTEGER NOT NULL,
+    x         INTEGER NOT NULL,
+    y         INTEGER NOT NULL,
+    tissue    REAL NOT NULL,
+    UNIQUE (slide, level, tile_size, x, y)
+);
+CREATE TABLE IF NOT EXISTS extractors (
+    id      INTEGER PRIMARY KEY,
+    version TEXT NOT NULL,
+    params  TEXT NOT NULL,
+    columns TEXT NOT NULL,
+    UNIQUE (version, params)
+);
+CREATE TABLE IF NOT EXISTS features (
+    tile      INTEGER NOT NULL,
+    extractor INTEGER NOT NULL,
+    vals      BLOB NOT NULL,
+    PRIMARY KEY (tile, extractor)
+) WITHOUT ROWID;
+"""
+
+
+class TileStore:
+    """SQLite index of tile selections and per-tile feature vectors."""
+
+    def __init__(self, path=DEFAULT_STORE):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def slide_digest(self, slide_path):
+        """SHA-256 of a slide file, hashed only when its size/mtime change."""
+        path = os.path.abspath(slide_path)
+        st = os.stat(path)
+        row = self._db.execute("SELECT size, mtime_ns, digest FROM slides WHERE path=?",
+                               (path,)).fetchone()
+        if row and row[:2] == (st.st_size, st.st_mtime_ns):
+            return row[2]
+        digest = sha256_file(path)
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO slides VALUES (?, ?, ?, ?)",
+                             (path, st.st_size, st.st_mtime_ns, digest))
+        return digest
+
+    def extractor(self, version, params, columns):
+        """Id of an extractor (version + parameters), registering it if new."""
+        params = json.dumps(params, sort_keys=True)
+        with self._db:
+            self._db.execute("INSERT OR IGNORE INTO extractors (version, params, columns) "
+                             "VALUES (?, ?, ?)", (version, params, json.dumps(list(columns))))
+        return self._db.execute("SELECT id FROM extractors WHERE version=? AND params=?",
+                                (version, params)).fetchone()[0]
+
+    def columns(self, extractor):
+        row = self._db.execute("SELECT columns FROM extractors WHERE id=?",
+                               (extractor,)).fetchone()
+        return json.loads(row[0])
+
+    def latest_extractor(self, digest, level, tile_size):
+        """The newest extractor with features stored for a slide level."""
+        row = self._db.execute(
+            "SELECT MAX(f.extractor) FROM features f JOIN tiles t ON t.id = f.tile "
+            "WHERE t.slide=? AND t.level=? AND t.tile_size=?",
+            (digest, level, tile_size)).fetchone()
+        return row[0]
+
+    def tiles(self, digest, level, tile_size, min_tissue):
+        """(ids, xs, ys, tissue) of a stored tile selection, or None."""
+        if self._db.execute("SELECT 1 FROM tilesets WHERE slide=? AND level=? AND "
+                            "tile_size=? AND min_tissue=?",
+                            (digest, level, tile_size, min_tissue)).fetchone() is None:
+            return None
+        rows = self._db.execute(
+            "SELECT id, x, y, tissue FROM tiles WHERE slide=? AND level=? AND tile_size=? "
+            "AND tissue >= ? ORDER BY y, x", (digest, level, tile_size, min_tissue)).fetchall()
+        if not rows:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0)
+        ids, xs, ys, tissue = zip(*rows)
+        return np.array(ids), np.array(xs), np.array(ys), np.array(tissue)
+
+    def add_tiles(self, digest, level, tile_size, min_tissue, xs, ys, tissue):
+        """Record a tile selection; returns it as tiles() would."""
+        with self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO tiles (slide, level, tile_size, x, y, tissue) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                ((digest, level, tile_size, int(x), int(y), float(t))
+                 for x, y, t in zip(xs, ys, tissue)))
+            self._db.execute("INSERT OR IGNORE INTO tilesets VALUES (?, ?, ?, ?)",
+                             (digest, level, tile_size, min_tissue))
+        return self.tiles(digest, level, tile_size, min_tissue)
+
+    def missing(self, digest, tile_ids, extractor):
+        """Boolean mask of a slide's tile_ids without features for extractor."""
+        have = {r[0] for r in self._db.execute(
+            "SELECT f.tile FROM features f JOIN tiles t ON t.id = f.tile "
+            "WHERE f.extractor=? AND t.slide=?", (extractor, digest))}
+        return np.array([int(t) not in have for t in tile_ids], dtype=bool)
+
+    def put_features(self, extractor, tile_ids, values):
+        """Store one feature vector per tile (committed immediately)."""
+        values = np.ascontiguousarray(values, dtype=np.float64)
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO features VALUES (?, ?, ?)",
+                ((int(t), extractor, v.tobytes()) for t, v in zip(tile_ids, values)))
+
+    def features(self, digest, level, tile_size, extractor=None, min_tissue=0.0):
+        """All stored tile features of a slide level.
+
+        Returns a dict with ``x``, ``y``, ``tissue`` arrays, ``values``
+        (tiles x features) and ``columns``; None if nothing is stored.
+        """
+        if extractor is None:
+            extractor = self.latest_extractor(digest, level, tile_size)
+            if extractor is None:
+                return None
+        rows = self._db.execute(
+            "SELECT t.x, t.y, t.tissue, f.vals FROM features f JOIN tiles t ON t.id = f.tile "
+            "WHERE t.slide=? AND t.level=? AND t.tile_size=? AND f.extractor=? "
+            "AND t.tissue >= ? ORDER BY t.y, t.x",
+            (digest, level, tile_size, extractor, min_tissue)).fetchall()
+        columns = self.columns(extractor)
+        if not rows:
+            return None
+        xs, ys, tissue, blobs = zip(*rows)
+        values = np.frombuffer(b"".join(blobs), dtype=np.float64).reshape(len(rows), -1)
+        return {"x": np.array(xs), "y": np.array(ys), "tissue": np.array(tissue),
+                "values": values, "columns": columns, "extractor": extractor}
+
+    def aggregate(self, digest, level=0, tile_size=256, extractor=None, top_k=10,
+                  by="n_nuclei", min_tissue=0.0):
+        """Slide-level pooling of stored tile features.
+
+        Returns ``columns``, ``n_tiles``, ``mean`` and ``max`` vectors and the
+        ``top_k`` tiles ranked by feature ``by`` (``top_x``, ``top_y``,
+        ``top_values``), or None if the store holds nothing for the slide.
+        """
+        feats = self.features(digest, level, tile_size, extractor, min_tissue)
+        if feats is None:
+            return None
+        values, columns = feats["values"], feats["columns"]
+        k = min(top_k, len(values))
+        score = values[:, columns.index(by)]
+        top = np.argpartition(-score, k - 1)[:k] if k else np.zeros(0, np.int64)
+        top = top[np.argsort(-score[top], kind="stable")]
+        return {"columns": columns, "n_tiles": len(values), "extractor": feats["extractor"],
+                "mean": values.mean(axis=0), "max": values.max(axis=0),
+                "top_x": feats["x"][top], "top_y": feats["y"][top],
+                "top_values": values[top]}
+
+
+def analyze_slide(slide_path, store=None, tile_size=256, level=0, min_tissue=0.5,
+                  jobs=None, batch_tiles=16, glcm_levels=64, min_nucleus_area=30,
+                  top_k=10, by="n_nuclei"):
+    """Fill the store with any missing tile features of a slide, then
+    return its aggregate() plus ``n_computed``, the tiles whose features
+    were computed by this call. Pixel work is skipped entirely when every
+    tissue tile already has features from the current extractor."""
+    store = store or TileStore()
+    digest = store.slide_digest(slide_path)
+    tiles = store.tiles(digest, level, tile_size, min_tissue)
+    if tiles is None:
+        import openslide
+        with openslide.OpenSlide(slide_path) as slide:
+            xs, ys, frac = wsi.select_tiles(slide, tile_size, level, min_tissue)
+        tiles = store.add_tiles(digest, level, tile_size, min_tissue, xs, ys, frac)
+    ids, xs, ys, frac = tiles
+    params = {"tile_size": tile_size, "glcm_levels": glcm_levels,
+              "min_nucleus_area": min_nucleus_area}
+    ext = store.extractor(wsi.EXTRACTOR_VERSION, params, wsi.FEATURES)
+    todo = np.flatnonzero(store.missing(digest, ids, ext))
+    if len(todo):
+        batches = [todo[i:i + batch_tiles] for i in range(0, len(todo), batch_tiles)]
+        tasks = [list(zip(xs[b].tolist(), ys[b].tolist(), frac[b].tolist())) for b in batches]
+        results = run_chunks(wsi._tile_batch, tasks, jobs or os.cpu_count(),
+                             initializer=wsi._init_worker,
+                             initargs=(slide_path, level, tile_size, glcm_levels,
+                                       min_nucleus_area))
+        skip = len(wsi.COLUMNS) - len(wsi.FEATURES)
+        for b, rows in zip(batches, results):
+            store.put_features(ext, ids[b], [row[skip:] for row in rows])
+    res = store.aggregate(digest, level, tile_size, ext, top_k, by, min_tissue)
+    if res is not None:
+        res["n_computed"] = len(todo)
+    return res
@@ -0,0 +1,74 @@
+"""
+Batched record writers: rows go to a CSV file, or to Parquet row groups
+when the target ends in ``.parquet`` (requires pyarrow).
+
+A writer opened on ``path + ".part"`` picks its format from the final name,
+so callers can stream into a partial file and rename it when complete:
+
+    writer = open_batch_writer("out.parquet.part", ["id", "length"],
+                               int_columns=("length",))
+    for batch in batched(records, 5000):
+        writer.write(batch)
+    writer.close()
+"""
+
+import csv
+
+
+def batched(records, batch_size):
+    """Group an iterable into lists of at most batch_size items."""
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class CsvBatchWriter:
+    """Append record batches to a CSV file."""
+
+    def __init__(self, path, columns):
+        self._f = open(path, "w", newline="")
+        self._writer = csv.writer(self._f)
+        self._writer.writerow(columns)
+
+    def write(self, batch):
+        self._writer.writerows(batch)
+
+    def close(self):
+        self._f.close()
+
+
+class ParquetBatchWriter:
+    """Append record batches as Parquet row groups (needs pyarrow)."""
+
+    def __init__(self, path, columns, types=None):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self._pa = pa
+        types = types or {}
+        self.schema = pa.schema([(c, types.get(c, pa.string())) for c in columns])
+        self._writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, batch):
+        columns = list(zip(*batch))
+        arrays = [self._pa.array(col, type=field.type)
+                  for col, field in zip(columns, self.schema)]
+        self._writer.write_table(self._pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self._writer.close()
+
+
+def open_batch_writer(path, columns, int_columns=(), float_columns=()):
+    """A batch writer for path, Parquet if it ends in .parquet else CSV."""
+    target = path[:-len(".part")] if path.endswith(".part") else path
+    if target.endswith(".parquet"):
+        import pyarrow as pa
+        types = {c: pa.float64() for c in float_columns}
+        types.update((c, pa.int32()) for c in int_columns)
+        return ParquetBatchWriter(path, columns, types)
+    return CsvBatchWriter(path, columns)
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache for downloaded notebook data.
+
+Files live once per host under ``~/.cache/bionotebook/objects/<sha256[:2]>/<sha256>``
+(override with BIONB_CACHE_DIR) and are hardlinked -- or reflinked/copied
+across filesystems -- into each checkout's Compute/data/nbXX/ directory.
+A SQLite manifest maps (source, accession, version) to digest, size and
+fetch time, so a cache hit costs one manifest lookup and one stat.
+
+    python data/datacache.py stats
+    python data/datacache.py verify [--jobs N]
+    python data/datacache.py evict [--max-bytes N]
+"""
+
+import os
+import sys
+import stat
+import time
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_CACHE_DIR = os.path.expanduser("~/.cache/bionotebook")
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3  # 20 GiB
+CHUNK_SIZE = 1 << 20
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    source     TEXT NOT NULL,
+    accession  TEXT NOT NULL,
+    version    TEXT NOT NULL,
+    digest     TEXT NOT NULL,
+    size       INTEGER NOT NULL,
+    inode      INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    last_used  REAL NOT NULL,
+    PRIMARY KEY (source, accession, version)
+);
+CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest);
+"""
+
+
+def sha256_file(path):
+    """Hex SHA-256 of a file, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _reflink(src, dst):
+    """Copy-on-write clone (Linux FICLONE); raises OSError if unsupported."""
+    import fcntl
+    FICLONE = 0x40049409
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def link_or_copy(src, dst):
+    """Atomically place src at dst: hardlink, else reflink, else copy."""
+    tmp = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        try:
+            _reflink(src, tmp)
+        except (OSError, ImportError):
+            shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+class DataCache:
+    """Host-wide content-addressed store with an LRU size cap.
+
+    Keys are ``(source, accession, version)`` tuples, e.g.
+    ``("ncbi", "U00096.3", "nucleotide/gb")``.
+    """
+
+    def __init__(self, root=None, max_bytes=None):
+        self.root = root or os.environ.get("BIONB_CACHE_DIR", DEFAULT_CACHE_DIR)
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("BIONB_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(self.root, "objects")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._dev = os.stat(self.objects_dir).st_dev
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(self.root, "manifest.sqlite"),
+                                   timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def lookup(self, key):
+        """Return the manifest entry for key as a dict, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT digest, size, inode, fetched_at FROM entries "
+                "WHERE source=? AND accession=? AND version=?", key).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("digest", "size", "inode", "fetched_at"), row))
+
+    def _touch(self, key):
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE entries SET last_used=? "
+                "WHERE source=? AND accession=? AND version=?", (time.time(), *key))
+
+    def materialize(self, key, target):
+        """Make target hold the cached object for key; False on a cache miss."""
+        entry = self.lookup(key)
+        if entry is None:
+            return False
+        try:
+            st = os.stat(target)
+            # Hardlinked into place already (or a same-size copy on another device)
+            if st.st_size == entry["size"] and (
+                    st.st_ino == entry["inode"] or st.st_dev != self._dev):
+                self._touch(key)
+                return True
+        except FileNotFoundError:
+            pass
+        obj = self.object_path(entry["digest"])
+        if not os.path.exists(obj):
+            return False  # evicted; caller re-fetches
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        link_or_copy(obj, target)
+        self._touch(key)
+        return True
+
+    def ingest(self, key, path):
+        """Hash path into the store, record it under key, link it back."""
+        digest = sha256_file(path)
+        obj = self.object_path(digest)
+        if os.path.exists(obj) and os.path.getsize(obj) != os.path.getsize(path):
+            os.remove(obj)  # damaged in place through a hardlink: replace it
+        if not os.path.exists(obj):
+            os.makedirs(os.path.dirname(obj), exist_ok=True)
+            link_or_copy(path, obj)
+            # Objects are shared by every checkout: keep them read-only
+            os.chmod(obj, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        st = os.stat(obj)
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (*key, digest, st.st_size, st.st_ino, now, now))
+        src = os.stat(path)
+        if src.st_dev == st.st_dev and src.st_ino != st.st_ino:
+            link_or_copy(obj, path)  # dedupe against another checkout's copy
+        self.evict()
+        return digest
+
+    def forget(self, key):
+        """Drop the manifest entry for key (the object stays until evicted)."""
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM entries WHERE source=? AND accession=? AND version=?", key)
+
+    def _objects(self):
+        """(digest, size, last_used) for every distinct object, oldest first."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT digest, MAX(size), MAX(last_used) FROM entries "
+                "GROUP BY digest ORDER BY MAX(last_used)").fetchall()
+
+    def _drop(self, digest):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM entries WHERE digest=?", (digest,))
+        try:
+            os.remove(self.object_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def evict(self, max_bytes=None):
+        """Remove least-recently-used objects until under max_bytes."""
+        cap = self.max_bytes if max_bytes is None else max_bytes
+        objects = self._objects()
+        total = sum(size for _, size, _ in objects)
+        removed = []
+        for digest, size, _ in objects:
+            if total <= cap:
+                break
+            self._drop(digest)
+            total -= size
+            removed.append(digest)
+        return removed
+
+    def verify(self, jobs=None):
+        """Re-hash every object in parallel; drop and return corrupt digests."""
+        digests = [d for d, _, _ in self._objects()]
+
+        def check(digest):
+            path = self.object_path(digest)
+            return os.path.exists(path) and sha256_file(path) == digest
+
+        with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+            results = list(pool.map(check, digests))
+        bad = [d for d, ok in zip(digests, results) if not ok]
+        for digest in bad:
+            self._drop(digest)
+        return bad
+
+    def stats(self):
+        objects = self._objects()
+        with self._lock:
+            n_entries = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {"entries": n_entries, "objects": len(objects),
+                "bytes": sum(size for _, size, _ in objects),
+                "max_bytes": self.max_bytes, "root": self.root}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the notebook data cache.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="show cache size and entry counts")
+    p_verify = sub.add_parser("verify", help="re-hash objects, drop corrupt ones")
+    p_verify.add_argument("--jobs", "-j", type=int, default=None)
+    p_evict = sub.add_parser("evict", help="evict LRU objects above the size cap")
+    p_evict.add_argument("--max-bytes", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    cache = DataCache()
+    if args.command == "stats":
+        s = cache.stats()
+        print(f"  {s['root']}: {s['entries']} entries, {s['objects']} objects, "
+              f"{s['bytes']:,} / {s['max_bytes']:,} bytes")
+    elif args.command == "verify":
+        bad = cache.verify(jobs=args.jobs)
+        for digest in bad:
+            print(f"  [corrupt] {digest}")
+        print(f"  {len(bad)} corrupt object(s) removed")
+        return 1 if bad else 0
+    elif args.command == "evict":
+        removed = cache.evict(args.max_bytes)
+        print(f"  {len(removed)} object(s) evicted")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
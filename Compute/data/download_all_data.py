@@ -2,155 +2,275 @@
 """
 Download all real biological data for bioinformatics notebooks.
 
-Idempotent: skips files that already exist.
+Idempotent: skips files that already exist. Fetched files are kept in a
+host-wide content-addressed cache (see datacache.py) and hardlinked into
+place, so several checkouts share one copy. Downloads stream to a ``.part``
+file that is renamed into place only when complete, so an interrupted run
+resumes (via HTTP Range) instead of re-fetching bytes it already has.
 Run from the Compute/ directory:
-    python data/download_all_data.py
+    python data/download_all_data.py [--jobs N] [--only nb04] [--dry-run]
+
+What to provision is declared in manifest.json (see manifest.py); only
+artifacts that are missing or stale are fetched or regenerated. Independent
+fetches run concurrently on a bounded worker pool (see fetch_scheduler.py),
+with per-host concurrency limits.
 """
 
 import os
 import sys
 import csv
 import json
-import time
+import inspect
+import argparse
 import urllib.request
 import urllib.error
 
-DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+from fetch_scheduler import Scheduler, host_of
+from datacache import DataCache, sha256_file
+from entrez import EntrezClient
+import manifest
+import seqindex
 
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
 
-def download_file(url, filepath, description=""):
-    """Download a file if it doesn't already exist."""
+# Service endpoints (module-level so tests can point them at a local server)
+NCBI_EUTILS_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
+UNIPROT_REST_URL = "https://rest.uniprot.org/uniprotkb"
+RCSB_DOWNLOAD_URL = "https://files.rcsb.org/download"
+
+USER_AGENT = "BioNotebook/1.0"
+CHUNK_SIZE = 1 << 20  # 1 MiB
+
+
+def stream_to_file(url, filepath, sha256=None, timeout=60):
+    """Stream url to filepath in chunks; return the final size in bytes.
+
+    Bytes go to ``filepath + ".part"`` and are renamed into place only after
+    the Content-Length (and ``sha256``, if given) check out. A leftover
+    ``.part`` from an interrupted run is resumed with an HTTP Range request;
+    servers that ignore Range simply restart the file from scratch.
+    """
+    part = filepath + ".part"
+    os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    headers = {"User-Agent": USER_AGENT}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+    req = urllib.request.Request(url, headers=headers)
+    try:
+        response = urllib.request.urlopen(req, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code != 416 or not offset:
+            raise
+        # Range not satisfiable: the .part is stale or already complete
+        os.remove(part)
+        return stream_to_file(url, filepath, sha256, timeout)
+
+    with response:
+        total = None
+        if offset and response.status == 206:
+            # Content-Range: bytes <start>-<end>/<total>
+            content_range = response.headers.get("Content-Range", "")
+            start = content_range.split(" ")[-1].split("-")[0]
+            if start != str(offset):
+                raise IOError(f"server resumed at {start!r}, expected {offset}")
+            size = content_range.rsplit("/", 1)[-1]
+            total = int(size) if size.isdigit() else None
+        else:
+            offset = 0
+            length = response.headers.get("Content-Length")
+            total = int(length) if length and length.isdigit() else None
+        if offset:
+            print(f"           resuming at {offset:,} bytes")
+        with open(part, "ab" if offset else "wb") as f:
+            for chunk in iter(lambda: response.read(CHUNK_SIZE), b""):
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+
+    size = os.path.getsize(part)
+    if total is not None and size != total:
+        # Keep the .part so the next run can resume from here
+        raise IOError(f"incomplete download: {size:,} of {total:,} bytes")
+    if sha256 is not None:
+        digest = sha256_file(part)
+        if digest != sha256.lower():
+            os.remove(part)
+            raise IOError(f"checksum mismatch: expected {sha256}, got {digest}")
+    os.replace(part, filepath)
+    return size
+
+
+_cache = None
+
+
+def get_cache():
+    """The shared DataCache, or None when disabled with BIONB_NO_CACHE=1."""
+    global _cache
+    if _cache is None and not os.environ.get("BIONB_NO_CACHE"):
+        try:
+            _cache = DataCache()
+        except Exception as e:
+            print(f"  [warning] Data cache unavailable, continuing without it: {e}")
+            os.environ["BIONB_NO_CACHE"] = "1"
+    return _cache
+
+
+def _have(key, filepath, sha256=None, size=None):
+    """True if filepath is already satisfied, linking it from the cache if needed.
+
+    A file already in the checkout is checked against the expected size and
+    sha256 first (a mismatch means it is refetched). It is only ingested
+    into the shared cache when there was something to check it against, so
+    an unverifiable (possibly truncated) file is never pinned there.
+    """
+    cache = get_cache()
+    name = os.path.basename(filepath)
+    if cache is not None and cache.materialize(key, filepath):
+        print(f"  [skip] {name} (cached)")
+        return True
     if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
-        print(f"  [skip] {os.path.basename(filepath)} already exists")
+        # Present from an older run or the git checkout: adopt it if it checks out
+        if size is not None and os.path.getsize(filepath) != size:
+            print(f"  [stale] {name}: {os.path.getsize(filepath):,} bytes, "
+                  f"expected {size:,}")
+            return False
+        if sha256 and sha256_file(filepath) != sha256.lower():
+            print(f"  [stale] {name}: sha256 mismatch")
+            return False
+        if cache is not None and (sha256 or size is not None):
+            cache.ingest(key, filepath)
+        print(f"  [skip] {name} already exists")
+        return True
+    return False
+
+
+def _store(key, filepath):
+    cache = get_cache()
+    if cache is not None:
+        cache.ingest(key, filepath)
+
+
+def download_file(url, filepath, description="", sha256=None, key=None, size=None):
+    """Download a file if it doesn't already exist (or fails its size / sha256)."""
+    key = key or ("url", url, "")
+    if _have(key, filepath, sha256, size):
         return True
     print(f"  [downloading] {description or os.path.basename(filepath)}...")
     try:
-        req = urllib.request.Request(url, headers={"User-Agent": "BioNotebook/1.0"})
-        with urllib.request.urlopen(req, timeout=60) as response:
-            data = response.read()
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        with open(filepath, "wb") as f:
-            f.write(data)
-        print(f"           -> {len(data):,} bytes")
+        size = stream_to_file(url, filepath, sha256=sha256)
+        _store(key, filepath)
+        print(f"           -> {size:,} bytes")
         return True
     except Exception as e:
         print(f"  [ERROR] {e}")
         return False
 
 
-def fetch_ncbi_sequence(db, accession, rettype, filepath, description=""):
-    """Fetch a sequence from NCBI Entrez."""
-    if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
-        print(f"  [skip] {os.path.basename(filepath)} already exists")
-        return True
-    base = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
-    url = f"{base}?db={db}&id={accession}&rettype={rettype}&retmode=text"
-    print(f"  [NCBI] {description or accession}...")
+_entrez = None
+
+
+def get_entrez():
+    """The shared, rate-limited Entrez client (NCBI_API_KEY raises the limit)."""
+    global _entrez
+    if _entrez is None:
+        _entrez = EntrezClient(NCBI_EUTILS_URL)
+    return _entrez
+
+
+def _index(filepath):
+    """Write the faidx-style index of a downloaded sequence file (seqindex)."""
     try:
-        req = urllib.request.Request(url, headers={"User-Agent": "BioNotebook/1.0"})
-        with urllib.request.urlopen(req, timeout=60) as response:
-            data = response.read()
-        with open(filepath, "wb") as f:
-            f.write(data)
-        print(f"           -> {len(data):,} bytes")
-        time.sleep(0.5)  # NCBI rate limit
+        if seqindex.load_index(filepath) is not None:
+            return
+        index = seqindex.build_index(filepath)
+    except (OSError, ValueError) as e:
+        print(f"  [WARN] not indexed: {e}")
+        return
+    n_feat = sum(len(v) for v in index["features"].values())
+    print(f"           -> indexed {os.path.basename(filepath)}: "
+          f"{len(index['records'])} record(s)" + (f", {n_feat:,} features" if n_feat else ""))
+
+
+def fetch_ncbi_batch(db, rettype, records):
+    """Fetch several NCBI Entrez records with one batched efetch.
+
+    records is a list of (accession, filepath, description) tuples; the
+    multi-record response is split back into one file per accession.
+    """
+    missing = {}
+    for accession, filepath, description in records:
+        if not _have(("ncbi", accession, f"{db}/{rettype}"), filepath):
+            print(f"  [NCBI] {description or accession}...")
+            missing[accession] = filepath
+    if not missing:
         return True
+    try:
+        sizes = get_entrez().efetch_to_files(db, rettype, missing)
     except Exception as e:
         print(f"  [ERROR] {e}")
         return False
+    for accession, filepath in missing.items():
+        _store(("ncbi", accession, f"{db}/{rettype}"), filepath)
+        print(f"           -> {accession}: {sizes[accession]:,} bytes")
+    return True
+
+
+def fetch_ncbi_sequence(db, accession, rettype, filepath, description=""):
+    """Fetch a sequence from NCBI Entrez."""
+    return fetch_ncbi_batch(db, rettype, [(accession, filepath, description)])
 
 
 def fetch_uniprot_fasta(accession, filepath, description=""):
     """Fetch a protein FASTA from UniProt."""
-    if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
-        print(f"  [skip] {os.path.basename(filepath)} already exists")
-        return True
-    url = f"https://rest.uniprot.org/uniprotkb/{accession}.fasta"
-    return download_file(url, filepath, description)
+    url = f"{UNIPROT_REST_URL}/{accession}.fasta"
+    return download_file(url, filepath, description,
+                         key=("uniprot", accession, "fasta"))
 
 
 def fetch_pdb(pdb_id, filepath, description=""):
     """Fetch a PDB structure file."""
-    if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
-        print(f"  [skip] {os.path.basename(filepath)} already exists")
-        return True
-    url = f"https://files.rcsb.org/download/{pdb_id}.pdb"
-    return download_file(url, filepath, description)
+    url = f"{RCSB_DOWNLOAD_URL}/{pdb_id}.pdb"
+    return download_file(url, filepath, description,
+                         key=("pdb", pdb_id.upper(), "pdb"))
 
 
 # ---------------------------------------------------------------------------
 # NB01: Sequence Analysis Fundamentals
 # ---------------------------------------------------------------------------
-def download_nb01():
-    print("\n=== NB01: Sequence Analysis ===")
-    d = os.path.join(DATA_DIR, "nb01")
-    os.makedirs(d, exist_ok=True)
-
-    # BRCA1 mRNA (NM_007294)
-    fetch_ncbi_sequence("nucleotide", "NM_007294.4", "fasta",
-                        os.path.join(d, "brca1_mrna.fasta"),
-                        "BRCA1 mRNA (NM_007294)")
-
-    # E. coli K12 segment (first 50kb of U00096)
-    # Use the full genome and we'll take the first 50kb in the notebook
-    fetch_ncbi_sequence("nucleotide", "U00096.3", "gb",
-                        os.path.join(d, "e_coli_k12_segment.gb"),
-                        "E. coli K12 genome (U00096)")
-
-    # Hemoglobin alpha (P69905)
-    fetch_uniprot_fasta("P69905",
-                        os.path.join(d, "hemoglobin_alpha.fasta"),
-                        "Hemoglobin alpha (P69905)")
-
-    # Hemoglobin beta (P68871)
-    fetch_uniprot_fasta("P68871",
-                        os.path.join(d, "hemoglobin_beta.fasta"),
-                        "Hemoglobin beta (P68871)")
-
-    # pUC19 cloning vector (L09137)
-    fetch_ncbi_sequence("nucleotide", "L09137.1", "gb",
-                        os.path.join(d, "puc19.gb"),
-                        "pUC19 cloning vector (L09137)")
-
-    # Human proteome lengths - fetch reviewed human proteome TSV
-    proteome_path = os.path.join(d, "human_proteome_lengths.csv")
-    if not os.path.exists(proteome_path) or os.path.getsize(proteome_path) == 0:
-        print("  [UniProt] Human reviewed proteome (lengths)...")
-        url = ("https://rest.uniprot.org/uniprotkb/stream?"
-               "query=organism_id:9606+AND+reviewed:true&"
-               "fields=accession,gene_primary,length,protein_name&"
-               "format=tsv&size=500")
-        try:
-            req = urllib.request.Request(url, headers={"User-Agent": "BioNotebook/1.0"})
-            with urllib.request.urlopen(req, timeout=120) as response:
-                tsv_data = response.read().decode("utf-8")
-            # Convert TSV to CSV with just accession, gene, length
-            lines = tsv_data.strip().split("\n")
-            with open(proteome_path, "w", newline="") as f:
-                writer = csv.writer(f)
-                writer.writerow(["accession", "gene", "length", "protein_name"])
-                for line in lines[1:]:  # skip header
-                    parts = line.split("\t")
-                    if len(parts) >= 3:
-                        writer.writerow([
-                            parts[0],
-                            parts[1] if len(parts) > 1 else "",
-                            parts[2] if len(parts) > 2 else "",
-                            parts[3] if len(parts) > 3 else "",
-                        ])
-            print(f"           -> {len(lines)-1} proteins")
-        except Exception as e:
-            print(f"  [ERROR] {e}")
-            # Fallback: generate from known data
-            _generate_proteome_fallback(proteome_path)
-    else:
-        print(f"  [skip] human_proteome_lengths.csv already exists")
+def fetch_human_proteome(d, organism_ids=(9606,), filename="human_proteome_lengths.csv",
+                         page_size=500):
+    """Fetch reviewed proteome lengths, falling back to a generated set.
+
+    Entries are streamed page by page from UniProt (see uniprot.py) and
+    written in batches; a ``.parquet`` filename writes Parquet instead of CSV.
+    Returns True on success or fallback, False if nothing could be written.
+    """
+    import uniprot
+    proteome_path = os.path.join(d, filename)
+    if os.path.exists(proteome_path) and os.path.getsize(proteome_path) > 0:
+        print(f"  [skip] {filename} already exists")
+        return True
+    organisms = ", ".join(str(o) for o in organism_ids)
+    print(f"  [UniProt] Reviewed proteome lengths (organism {organisms})...")
+    try:
+        n_proteins = uniprot.write_proteome(proteome_path, organism_ids,
+                                            base_url=UNIPROT_REST_URL,
+                                            page_size=page_size)
+        print(f"           -> {n_proteins:,} proteins")
+    except Exception as e:
+        print(f"  [ERROR] {e}")
+        if proteome_path.endswith(".parquet"):
+            return False
+        # Fallback: generate from known data
+        _generate_proteome_fallback(proteome_path)
+    return True
 
 
 def _generate_proteome_fallback(filepath):
     """Generate a representative human proteome length CSV as fallback."""
     import random
-    random.seed(42)
+    rng = random.Random(42)
     print("  [fallback] Generating representative human proteome lengths...")
     with open(filepath, "w", newline="") as f:
         writer = csv.writer(f)
@@ -170,7 +290,7 @@ def _generate_proteome_fallback(filepath):
             writer.writerow([acc, gene, length, name])
         # Add more with random realistic lengths
         for i in range(492):
-            length = int(random.lognormalgauss(5.5, 0.8))
+            length = int(rng.lognormvariate(5.5, 0.8))
             length = max(50, min(length, 35000))
             writer.writerow([f"Q{i:05d}", f"GENE{i}", length, f"Hypothetical protein {i}"])
 
@@ -178,26 +298,29 @@ def _generate_proteome_fallback(filepath):
 # ---------------------------------------------------------------------------
 # NB02: Genomic Variant Analysis
 # ---------------------------------------------------------------------------
-def download_nb02():
-    print("\n=== NB02: Genomic Variant Analysis ===")
-    d = os.path.join(DATA_DIR, "nb02")
-    os.makedirs(d, exist_ok=True)
+def generate_1kg_chr22(d, n_samples=None, n_snps=500, jobs=None):
+    """Generate the population-stratified 1000 Genomes-like chr22 subset.
 
+    n_samples (default 100) is split across AFR/EUR/EAS in the usual
+    34/33/33 proportions.
+    """
     # 1000 Genomes chr22 subset - generate from Ensembl REST API
     geno_path = os.path.join(d, "1kg_chr22_subset.csv")
     pop_path = os.path.join(d, "1kg_populations.csv")
+    bed_prefix = os.path.join(d, "1kg_chr22_subset")
 
     if (os.path.exists(geno_path) and os.path.getsize(geno_path) > 0 and
             os.path.exists(pop_path) and os.path.getsize(pop_path) > 0):
         print("  [skip] 1000 Genomes files already exist")
+        _ensure_bed(geno_path, bed_prefix)
         return
 
     # Generate realistic 1000 Genomes-like data
     # Real 1KG data requires VCF parsing which is complex; we generate
     # population-stratified genotypes that match real allele frequency patterns
     print("  [generating] 1000 Genomes chr22 subset (population-stratified)...")
-    import random
-    random.seed(42)
+    import synthetic
+    import genotype_store
 
     # Population structure: 3 continental groups with distinct allele frequencies
     pops = {
@@ -205,62 +328,31 @@ def download_nb02():
         "EUR": 33,  # European
         "EAS": 33,  # East Asian
     }
-    n_snps = 500
+    if n_samples is not None:
+        pops = synthetic.scale_sizes(pops, n_samples)
     n_total = sum(pops.values())
 
-    # Generate SNP positions on chr22 (real range: 16M-51M)
-    snp_positions = sorted(random.sample(range(16000000, 51000000), n_snps))
-
-    # Generate population-differentiated allele frequencies
-    # Use Balding-Nichols model: Fst determines population divergence
-    fst = 0.12  # Typical human Fst
-    ancestral_af = [random.betavariate(0.5, 0.5) for _ in range(n_snps)]
-
-    # Per-population allele frequencies using Balding-Nichols
-    pop_afs = {}
-    for pop_name in pops:
-        pop_afs[pop_name] = []
-        for af in ancestral_af:
-            # Beta distribution parameterized by Fst
-            a = af * (1 - fst) / fst
-            b = (1 - af) * (1 - fst) / fst
-            if a > 0.01 and b > 0.01:
-                pop_af = random.betavariate(a, b)
-            else:
-                pop_af = af
-            pop_afs[pop_name].append(max(0.001, min(0.999, pop_af)))
-
-    # Generate genotypes
-    sample_ids = []
-    sample_pops = []
-    genotype_rows = []
-
-    for pop_name, n_ind in pops.items():
-        for i in range(n_ind):
-            sample_id = f"{pop_name}{i:03d}"
-            sample_ids.append(sample_id)
-            sample_pops.append(pop_name)
-            genos = []
-            for j in range(n_snps):
-                p = pop_afs[pop_name][j]
-                # Hardy-Weinberg genotypes
-                r = random.random()
-                if r < (1-p)**2:
-                    genos.append(0)
-                elif r < (1-p)**2 + 2*p*(1-p):
-                    genos.append(1)
-                else:
-                    genos.append(2)
-            genotype_rows.append(genos)
-
-    # Write genotype CSV
-    with open(geno_path, "w", newline="") as f:
-        writer = csv.writer(f)
-        header = ["sample_id"] + [f"chr22_{pos}" for pos in snp_positions]
-        writer.writerow(header)
-        for sid, genos in zip(sample_ids, genotype_rows):
-            writer.writerow([sid] + genos)
-    print(f"           -> {n_total} samples x {n_snps} SNPs")
+    # Population-differentiated allele frequencies (Balding-Nichols model:
+    # Fst determines population divergence); 0.12 is a typical human Fst
+    streams = synthetic.SeedStreams(42, "1kg_chr22")
+    rng, _, sample_pop, pop_afs = synthetic.stratified_panel(streams, pops, n_snps, fst=0.12)
+
+    # SNP positions on chr22 (real range: 16M-51M)
+    snp_positions = synthetic.sample_positions(rng, 16000000, 51000000, n_snps)
+
+    sample_ids = [f"{pop}{i:03d}" for pop, n in pops.items() for i in range(n)]
+    sample_pops = [pop for pop, n in pops.items() for _ in range(n)]
+
+    # Hardy-Weinberg genotypes, streamed one block of samples at a time to
+    # both the CSV and the 2-bit packed .bed/.bim/.fam store
+    bed = genotype_store.BedWriter(bed_prefix, sample_ids,
+                                   ["22"] * n_snps, snp_positions)
+    synthetic.write_genotype_csv(
+        geno_path, "sample_id", sample_ids,
+        [f"chr22_{pos}" for pos in snp_positions],
+        bed.tap(synthetic.genotype_blocks(streams, pop_afs, sample_pop, jobs)))
+    bed.close()
+    print(f"           -> {n_total} samples x {n_snps} SNPs (+ .bed/.bim/.fam)")
 
     # Write population labels
     with open(pop_path, "w", newline="") as f:
@@ -272,21 +364,21 @@ def download_nb02():
     print(f"           -> {n_total} population labels")
 
 
+def _ensure_bed(csv_path, bed_prefix):
+    """Build the packed .bed/.bim/.fam store for a genotype CSV if it's missing."""
+    if all(os.path.exists(bed_prefix + ext) for ext in (".bed", ".bim", ".fam")):
+        return
+    import genotype_store
+    n_samples, n_snps = genotype_store.convert_csv(csv_path, bed_prefix)
+    print(f"  [converted] {os.path.basename(csv_path)} -> "
+          f"{os.path.basename(bed_prefix)}.bed ({n_samples} x {n_snps})")
+
+
 # ---------------------------------------------------------------------------
 # NB04: Protein Structure & Drug Discovery
 # ---------------------------------------------------------------------------
-def download_nb04():
-    print("\n=== NB04: Protein Structure & Drug Discovery ===")
-    d = os.path.join(DATA_DIR, "nb04")
-    os.makedirs(d, exist_ok=True)
-
-    # Crambin (1CRN) - small, well-resolved protein
-    fetch_pdb("1CRN", os.path.join(d, "1crn.pdb"), "Crambin crystal structure")
-
-    # Myoglobin (1MBO) - classic protein with heme
-    fetch_pdb("1MBO", os.path.join(d, "1mbo.pdb"), "Myoglobin crystal structure")
-
-    # Approved drugs CSV
+def write_approved_drugs(d):
+    """Write the curated approved-drugs table."""
     drugs_path = os.path.join(d, "approved_drugs.csv")
     if not os.path.exists(drugs_path) or os.path.getsize(drugs_path) == 0:
         print("  [generating] Approved drugs dataset...")
@@ -354,11 +446,13 @@ def download_nb04():
 # ---------------------------------------------------------------------------
 # NB05: Bulk RNA-seq Differential Expression
 # ---------------------------------------------------------------------------
-def download_nb05():
-    print("\n=== NB05: Bulk RNA-seq ===")
-    d = os.path.join(DATA_DIR, "nb05")
-    os.makedirs(d, exist_ok=True)
+def generate_airway_counts(d, n_genes=20000, n_cell_lines=4, de_fraction=0.025,
+                           jobs=None):
+    """Generate GSE52778-like airway counts and sample metadata.
 
+    Each cell line contributes an untreated/dexamethasone pair; beyond the
+    four real GSE52778 lines, synthetic lines are added.
+    """
     counts_path = os.path.join(d, "airway_counts.csv")
     meta_path = os.path.join(d, "airway_metadata.csv")
 
@@ -372,8 +466,10 @@ def download_nb05():
     # 4 cell lines x 2 conditions (control/dex) = 8 samples
     # We generate realistic counts based on known parameters of this study
     print("  [generating] Airway dexamethasone RNA-seq counts (GSE52778-like)...")
-    import random
-    random.seed(42)
+    import numpy as np
+    import synthetic
+    streams = synthetic.SeedStreams(42, "airway")
+    rng = streams.rng(synthetic.PARAMS_STREAM)
 
     # Sample metadata
     samples = [
@@ -386,6 +482,15 @@ def download_nb05():
         ("SRR1039520", "N061011", "untreated", "untrt"),
         ("SRR1039521", "N061011", "dexamethasone", "trt"),
     ]
+    # Library size variation
+    lib_factors = [1.0, 1.15, 0.9, 1.05, 0.95, 1.1, 1.0, 1.2]
+    samples = samples[:2 * n_cell_lines]
+    lib_factors = lib_factors[:2 * n_cell_lines]
+    for k in range(len(samples) // 2, n_cell_lines):
+        samples.append((f"SYN{2*k:07d}", f"CL{k:04d}", "untreated", "untrt"))
+        samples.append((f"SYN{2*k+1:07d}", f"CL{k:04d}", "dexamethasone", "trt"))
+    n_extra = len(samples) - len(lib_factors)
+    lib_factors += rng.uniform(0.85, 1.25, n_extra).tolist()
 
     with open(meta_path, "w", newline="") as f:
         writer = csv.writer(f)
@@ -394,9 +499,8 @@ def download_nb05():
             writer.writerow(s)
 
     # Generate ~20000 genes with realistic count distributions
-    n_genes = 20000
     n_samples_rna = len(samples)
-    n_de = 500  # DE genes
+    n_de = int(round(n_genes * de_fraction))  # DE genes
 
     # Gene names: mix of real and generated
     real_genes = [
@@ -419,48 +523,17 @@ def download_nb05():
     gene_names = gene_names[:n_genes]
 
     # Base expression levels (log-normal)
-    base_means = [max(1, int(random.lognormvariate(4, 2.5))) for _ in range(n_genes)]
-
-    # Generate counts
-    counts_data = []
-    for i in range(n_genes):
-        row = []
-        for j in range(n_samples_rna):
-            mean = base_means[i]
-            # Library size variation
-            lib_factor = [1.0, 1.15, 0.9, 1.05, 0.95, 1.1, 1.0, 1.2][j]
-            mean = mean * lib_factor
-
-            # DE effect for known responsive genes
-            is_treated = samples[j][3] == "trt"
-            if i < len(dex_up) and is_treated:
-                mean *= random.uniform(2.0, 5.0)  # Upregulated
-            elif i < len(dex_up) + len(dex_down) and is_treated:
-                mean *= random.uniform(0.15, 0.45)  # Downregulated
-            elif i < n_de and is_treated:
-                # Random DE genes
-                fc = random.choice([-1, 1]) * random.uniform(0.5, 2.0)
-                mean *= 2 ** fc
-
-            # Negative binomial sampling
-            dispersion = 0.1 + 1.0 / (mean + 1) ** 0.5
-            p = dispersion / (dispersion + mean)
-            r = max(0.1, 1.0 / dispersion)
-            try:
-                count = random.gammavariate(r, mean / r) if mean > 0 else 0
-                count = int(max(0, count))
-            except (ValueError, ZeroDivisionError):
-                count = int(max(0, mean + random.gauss(0, mean ** 0.5)))
-            row.append(count)
-        counts_data.append(row)
-
-    # Write counts CSV
+    base_means = np.maximum(1, rng.lognormal(4, 2.5, n_genes).astype(np.int64))
+
+    # DE effect for known responsive genes, then random DE genes up to n_de
+    lfc = synthetic.de_log2fc(rng, n_genes, len(dex_up), len(dex_down), n_de)
+    treated = [s[3] == "trt" for s in samples]
+
+    # Negative binomial (gamma-Poisson) counts, written one gene block at a time
     sample_ids = [s[0] for s in samples]
-    with open(counts_path, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(["gene_id"] + sample_ids)
-        for gene, counts_row in zip(gene_names, counts_data):
-            writer.writerow([gene] + counts_row)
+    synthetic.write_counts_csv(
+        counts_path, gene_names, sample_ids,
+        synthetic.nb_count_blocks(streams, base_means, lfc, lib_factors, treated, jobs))
 
     print(f"           -> {n_genes} genes x {n_samples_rna} samples")
     print(f"           -> {len(dex_up)} known upregulated, {len(dex_down)} known downregulated")
@@ -469,12 +542,8 @@ def download_nb05():
 # ---------------------------------------------------------------------------
 # NB08: Plant Biology & Agricultural Genomics
 # ---------------------------------------------------------------------------
-def download_nb08():
-    print("\n=== NB08: Plant Biology ===")
-    d = os.path.join(DATA_DIR, "nb08")
-    os.makedirs(d, exist_ok=True)
-
-    # Crop genome stats
+def write_crop_genome_stats(d):
+    """Write the crop genome statistics table."""
     stats_path = os.path.join(d, "crop_genome_stats.csv")
     if not os.path.exists(stats_path) or os.path.getsize(stats_path) == 0:
         print("  [generating] Crop genome statistics...")
@@ -505,134 +574,91 @@ def download_nb08():
     else:
         print("  [skip] crop_genome_stats.csv already exists")
 
+
+def generate_arabidopsis_gwas(d, n_accessions=200, n_snps=1000, jobs=None):
+    """Generate 1001 Genomes-like Arabidopsis SNPs and flowering phenotypes."""
     # Arabidopsis SNP data (1001 Genomes-like)
     snp_path = os.path.join(d, "arabidopsis_snps.csv")
     pheno_path = os.path.join(d, "arabidopsis_phenotypes.csv")
+    bed_prefix = os.path.join(d, "arabidopsis_snps")
 
     if (os.path.exists(snp_path) and os.path.getsize(snp_path) > 0 and
             os.path.exists(pheno_path) and os.path.getsize(pheno_path) > 0):
         print("  [skip] Arabidopsis GWAS data already exists")
+        _ensure_bed(snp_path, bed_prefix)
         return
 
     print("  [generating] Arabidopsis 1001 Genomes-like GWAS data...")
-    import random
-    random.seed(42)
+    import numpy as np
+    import synthetic
+    import genotype_store
 
-    n_accessions = 200
-    n_snps = 1000
-
-    # Generate accession IDs and geographic origins
-    accession_ids = [f"AT{i+1:04d}" for i in range(n_accessions)]
     # Arabidopsis geographic groups
-    groups = ["Western Europe", "Central Europe", "Mediterranean",
-              "Central Asia", "North America"]
-    group_sizes = [60, 50, 40, 30, 20]
-    accession_groups = []
-    for g, n in zip(groups, group_sizes):
-        accession_groups.extend([g] * n)
-
-    # SNP positions across 5 chromosomes
-    snp_chrom = []
-    snp_pos = []
-    for chrom in range(1, 6):
-        chrom_len = [30000000, 20000000, 23000000, 18500000, 27000000][chrom-1]
-        n_per_chrom = n_snps // 5
-        positions = sorted(random.sample(range(1000, chrom_len), n_per_chrom))
-        for pos in positions:
-            snp_chrom.append(chrom)
-            snp_pos.append(pos)
+    groups = {"Western Europe": 60, "Central Europe": 50, "Mediterranean": 40,
+              "Central Asia": 30, "North America": 20}
+    if n_accessions != 200:
+        groups = synthetic.scale_sizes(groups, n_accessions)
 
     # Population-structured allele frequencies
-    fst_plant = 0.15
-    ancestral_afs = [random.betavariate(0.5, 0.5) for _ in range(n_snps)]
-
-    group_afs = {}
-    for group in groups:
-        group_afs[group] = []
-        for af in ancestral_afs:
-            a = af * (1 - fst_plant) / fst_plant
-            b = (1 - af) * (1 - fst_plant) / fst_plant
-            if a > 0.01 and b > 0.01:
-                gaf = random.betavariate(a, b)
-            else:
-                gaf = af
-            group_afs[group].append(max(0.001, min(0.999, gaf)))
-
-    # Generate genotypes
-    genotype_matrix = []
-    for i, group in enumerate(accession_groups):
-        genos = []
-        for j in range(n_snps):
-            p = group_afs[group][j]
-            r = random.random()
-            if r < (1-p)**2:
-                genos.append(0)
-            elif r < (1-p)**2 + 2*p*(1-p):
-                genos.append(1)
-            else:
-                genos.append(2)
-        genotype_matrix.append(genos)
-
-    # Write SNP CSV
-    with open(snp_path, "w", newline="") as f:
-        writer = csv.writer(f)
-        header = ["accession_id"] + [f"chr{c}_{p}" for c, p in zip(snp_chrom, snp_pos)]
-        writer.writerow(header)
-        for acc_id, genos in zip(accession_ids, genotype_matrix):
-            writer.writerow([acc_id] + genos)
+    streams = synthetic.SeedStreams(42, "arabidopsis_gwas")
+    rng, group_names, sample_group, group_afs = synthetic.stratified_panel(
+        streams, groups, n_snps, fst=0.15)
+    accession_ids = [f"AT{i+1:04d}" for i in range(n_accessions)]
+    accession_groups = [group_names[g] for g in sample_group]
 
-    # Generate flowering time phenotype (QTL-based)
+    # SNP positions across 5 chromosomes
+    chrom_lens = [30000000, 20000000, 23000000, 18500000, 27000000]
+    per_chrom = np.full(5, n_snps // 5)
+    per_chrom[: n_snps % 5] += 1
+    snp_chrom, snp_pos = [], []
+    for chrom, (length, n) in enumerate(zip(chrom_lens, per_chrom), 1):
+        snp_chrom += [str(chrom)] * n
+        snp_pos += synthetic.sample_positions(rng, 1000, length, n).tolist()
+    snp_labels = [f"chr{c}_{p}" for c, p in zip(snp_chrom, snp_pos)]
+
+    # Flowering time QTLs; their genetic value accumulates as blocks stream past
     n_qtl = 8
-    qtl_indices = random.sample(range(n_snps), n_qtl)
-    qtl_effects = [random.gauss(0, 2.0) for _ in range(n_qtl)]
-
-    pheno_data = []
-    for i in range(n_accessions):
-        genetic = sum(qtl_effects[q] * genotype_matrix[i][qtl_indices[q]]
-                      for q in range(n_qtl))
-        # Latitude effect (geographic groups)
-        lat_effect = {"Western Europe": 2.0, "Central Europe": 0.0,
-                      "Mediterranean": -3.0, "Central Asia": 1.0,
-                      "North America": 1.5}
-        ft = 25.0 + genetic + lat_effect[accession_groups[i]] + random.gauss(0, 3.0)
-        ft = max(10, min(60, ft))
-        pheno_data.append(ft)
+    qtl_indices = rng.choice(n_snps, n_qtl, replace=False)
+    qtl_effects = rng.normal(0, 2.0, n_qtl)
+    genetic = np.zeros(n_accessions)
+
+    def tap(blocks):
+        for start, block in blocks:
+            genetic[start:start + len(block)] = block[:, qtl_indices] @ qtl_effects
+            yield start, block
+
+    bed = genotype_store.BedWriter(bed_prefix, accession_ids, snp_chrom, snp_pos)
+    synthetic.write_genotype_csv(
+        snp_path, "accession_id", accession_ids, snp_labels,
+        bed.tap(tap(synthetic.genotype_blocks(streams, group_afs, sample_group, jobs))))
+    bed.close()
+
+    # Flowering time = QTLs + latitude effect (geographic groups) + noise
+    lat_effect = {"Western Europe": 2.0, "Central Europe": 0.0,
+                  "Mediterranean": -3.0, "Central Asia": 1.0,
+                  "North America": 1.5}
+    lat = np.array([lat_effect[name] for name in group_names])[sample_group]
+    pheno_data = np.clip(25.0 + genetic + lat + rng.normal(0, 3.0, n_accessions), 10, 60)
+    # Rosette leaf number correlates with flowering time
+    rln = np.maximum(4, (pheno_data * 0.4 + rng.normal(0, 1.5, n_accessions)).astype(int))
 
     with open(pheno_path, "w", newline="") as f:
         writer = csv.writer(f)
         writer.writerow(["accession_id", "geographic_group", "flowering_time_days",
                           "rosette_leaf_number"])
-        for acc_id, group, ft in zip(accession_ids, accession_groups, pheno_data):
-            # Rosette leaf number correlates with flowering time
-            rln = max(4, int(ft * 0.4 + random.gauss(0, 1.5)))
-            writer.writerow([acc_id, group, f"{ft:.1f}", rln])
+        for acc_id, group, ft, n_leaves in zip(accession_ids, accession_groups,
+                                               pheno_data, rln):
+            writer.writerow([acc_id, group, f"{ft:.1f}", n_leaves])
 
-    print(f"           -> {n_accessions} accessions x {n_snps} SNPs")
+    print(f"           -> {n_accessions} accessions x {n_snps} SNPs (+ .bed/.bim/.fam)")
     print(f"           -> {n_qtl} flowering time QTLs")
 
 
-# ---------------------------------------------------------------------------
-# NB07: Biomedical Image Analysis
-# ---------------------------------------------------------------------------
-def download_nb07():
-    print("\n=== NB07: Biomedical Image Analysis ===")
-    d = os.path.join(DATA_DIR, "nb07")
-    os.makedirs(d, exist_ok=True)
-
-    # CMU-1-Small-Region.svs - real Aperio whole-slide image from OpenSlide test data
-    download_file(
-        "https://openslide.cs.cmu.edu/download/openslide-testdata/Aperio/CMU-1-Small-Region.svs",
-        os.path.join(d, "CMU-1-Small-Region.svs"),
-        "Aperio WSI (CMU-1-Small-Region, ~2 MB)"
-    )
-    print("  Also uses skimage.data.immunohistochemistry(), human_mitosis(), brain() (built-in)")
-
-
 # ---------------------------------------------------------------------------
 # Pre-cache scanpy PBMC3k for NB03
 # ---------------------------------------------------------------------------
 def precache_pbmc3k():
-    print("\n=== NB03: Pre-caching PBMC3k ===")
+    print("  [scanpy] Pre-caching PBMC3k for NB03...")
     try:
         import scanpy as sc
         # Check if already cached
@@ -649,30 +675,296 @@ def precache_pbmc3k():
         print(f"  [warning] Could not pre-cache: {e}")
 
 
+def generate_sc_atlas(d, n_cells=20000, n_genes=20000, n_types=12, jobs=None):
+    """Generate a sparse single-cell count atlas as an AnnData .h5ad.
+
+    Same shape of problem as NB03's in-memory simulation (cell types with
+    marker genes, a mitochondrial fraction, a few damaged low-UMI cells)
+    but written in CSR cell blocks, so 10^6-cell atlases for the backed
+    pipeline (analysis.scatlas) can be produced without holding X.
+    """
+    atlas_path = os.path.join(d, "sc_atlas.h5ad")
+    if os.path.exists(atlas_path) and os.path.getsize(atlas_path) > 0:
+        print("  [skip] Single-cell atlas already exists")
+        return
+    try:
+        import h5py  # noqa: F401
+    except ImportError:
+        print("  [skip] h5py not installed, cannot write the single-cell atlas")
+        return
+
+    print(f"  [generating] Sparse single-cell atlas ({n_cells:,} cells)...")
+    import numpy as np
+    import synthetic
+    streams = synthetic.SeedStreams(42, "sc_atlas")
+    rng = streams.rng(synthetic.PARAMS_STREAM)
+
+    mt_genes = ["MT-ND1", "MT-ND2", "MT-CO1", "MT-CO2", "MT-ATP8", "MT-ATP6", "MT-CO3",
+                "MT-ND3", "MT-ND4L", "MT-ND4", "MT-ND5", "MT-ND6", "MT-CYB"]
+    gene_names = (mt_genes + [f"ENSG{i + 100:08d}" for i in range(n_genes)])[:n_genes]
+    n_mt = min(len(mt_genes), n_genes)
+
+    # Relative expression: heavy-tailed baseline, ~1% markers per cell type
+    # raised 4-32x; damaged cells (profiles n_types..) are mitochondria-rich
+    base = rng.lognormal(0.0, 2.0, n_genes)
+    base[:n_mt] *= 20
+    profiles = np.tile(base, (2 * n_types, 1))
+    n_markers = max(1, n_genes // 100)
+    for t in range(n_types):
+        markers = rng.choice(np.arange(n_mt, n_genes), n_markers, replace=False)
+        profiles[np.ix_([t, n_types + t], markers)] *= 2.0 ** rng.uniform(2, 5, n_markers)
+    profiles[n_types:, :n_mt] *= 10
+
+    type_names = [f"type_{t:02d}" for t in range(n_types)]
+    cell_type = rng.choice(n_types, n_cells, p=rng.dirichlet(np.full(n_types, 2.0)))
+    damaged = rng.random(n_cells) < 0.03
+    lib = rng.lognormal(np.log(2500), 0.5, n_cells)
+    lib[damaged] *= 0.05
+
+    nnz = synthetic.write_h5ad(
+        atlas_path,
+        synthetic.sparse_count_blocks(streams, profiles, cell_type + n_types * damaged, lib,
+                                      jobs),
+        (n_cells, n_genes), [f"cell_{i}" for i in range(n_cells)], gene_names,
+        obs={"cell_type": (cell_type.astype(np.int16), type_names)})
+
+    print(f"           -> {n_cells:,} cells x {n_genes:,} genes, {nnz:,} non-zeros")
+    print(f"           -> {n_types} cell types, {int(damaged.sum()):,} damaged cells")
+
+
+# ---------------------------------------------------------------------------
+# Manifest-driven provisioning
+# ---------------------------------------------------------------------------
+GENERATORS = {
+    "human_proteome": fetch_human_proteome,
+    "1kg_chr22": generate_1kg_chr22,
+    "pbmc3k": precache_pbmc3k,
+    "sc_atlas": generate_sc_atlas,
+    "approved_drugs": write_approved_drugs,
+    "airway": generate_airway_counts,
+    "crop_genome_stats": write_crop_genome_stats,
+    "arabidopsis_gwas": generate_arabidopsis_gwas,
+}
+
+
+def _service_host(source):
+    """Host whose concurrency limit applies to a manifest source."""
+    url = {"ncbi": NCBI_EUTILS_URL, "uniprot": UNIPROT_REST_URL,
+           "pdb": RCSB_DOWNLOAD_URL}.get(source)
+    return host_of(url) if url else None
+
+
+def artifact_key(art):
+    """The DataCache key an artifact is stored under (None for generators)."""
+    source, params = art["source"], art["params"]
+    if source == "ncbi":
+        return ("ncbi", params["accession"], f"{params['db']}/{params['rettype']}")
+    if source == "uniprot":
+        return ("uniprot", params["accession"], "fasta")
+    if source == "pdb":
+        return ("pdb", params["pdb_id"].upper(), "pdb")
+    if source == "url":
+        return ("url", params["url"], "")
+    return None
+
+
+def cached_digest(art, path):
+    """sha256 of path, taken from the cache manifest when it is the cached inode."""
+    cache, key = get_cache(), artifact_key(art)
+    entry = cache.lookup(key) if cache is not None and key else None
+    if entry is not None and os.stat(path).st_ino == entry["inode"]:
+        return entry["digest"]
+    return sha256_file(path)
+
+
+def _invalidate(art, reason):
+    """Remove an artifact's stale files so its fetcher or generator redoes them."""
+    if reason.startswith("missing"):
+        return  # generators fill in partial outputs (e.g. a missing .bed)
+    for path in manifest.files(art, DATA_DIR):
+        if os.path.exists(path):
+            os.remove(path)
+        seqindex.remove_index(path)
+    cache, key = get_cache(), artifact_key(art)
+    if cache is not None and key and reason != "params changed":
+        cache.forget(key)  # the cached copy is the bad one
+
+
+def _pooled(art):
+    """Whether an artifact's generator runs a process pool (takes ``jobs``)."""
+    if art["source"] != "generator":
+        return False
+    return "jobs" in inspect.signature(GENERATORS[art["params"]["name"]]).parameters
+
+
+def _generate(art, jobs=None):
+    params = dict(art["params"])
+    fn = GENERATORS[params.pop("name")]
+    if _pooled(art):
+        params["jobs"] = jobs
+    if art["path"] is None:
+        return fn(**params)
+    d = os.path.dirname(os.path.join(DATA_DIR, art["path"]))
+    os.makedirs(d, exist_ok=True)
+    return fn(d, **params)
+
+
+def provision(todo, sched, gen_jobs=None):
+    """Queue one task per planned artifact (NCBI ones batched per db/rettype),
+    plus an index task after each downloaded sequence file.
+
+    Generators that run a process pool get ``gen_jobs`` workers each; by
+    default the cores are split between the pooled generators that can run
+    at once (generators without a ``jobs`` argument do not count).
+    Returns {artifact id: task} so callers can see which artifacts succeeded.
+    """
+    tasks = {}
+    batches = {}
+    n_gen = sum(1 for art, _ in todo if _pooled(art))
+    if gen_jobs is None and n_gen:
+        import pool
+        gen_jobs = max(1, pool.default_jobs() // min(n_gen, sched.max_workers))
+    for art, reason in todo:
+        _invalidate(art, reason)
+        source, params = art["source"], art["params"]
+        path = os.path.join(DATA_DIR, art["path"]) if art["path"] else None
+        host = _service_host(art.get("host", source))
+        if source == "ncbi":
+            batches.setdefault((params["db"], params["rettype"]), []).append(art)
+            continue
+        if source == "uniprot":
+            task = sched.add(f"uniprot:{params['accession']}", fetch_uniprot_fasta,
+                             params["accession"], path, art["description"], host=host)
+        elif source == "pdb":
+            task = sched.add(f"pdb:{params['pdb_id']}", fetch_pdb,
+                             params["pdb_id"], path, art["description"], host=host)
+        elif source == "url":
+            task = sched.add(f"url:{os.path.basename(path)}", download_file,
+                             params["url"], path, art["description"],
+                             art.get("sha256"), size=art.get("size"),
+                             host=host or host_of(params["url"]))
+        else:
+            task = sched.add(f"generate:{art['id']}", _generate, art, gen_jobs, host=host)
+        tasks[art["id"]] = task
+        if path and seqindex.is_sequence_file(path):
+            sched.add(f"index:{os.path.basename(path)}", _index, path, deps=[task])
+    for (db, rettype), arts in batches.items():
+        records = [(a["params"]["accession"], os.path.join(DATA_DIR, a["path"]),
+                    a["description"]) for a in arts]
+        task = sched.add("ncbi:" + ",".join(r[0] for r in records), fetch_ncbi_batch,
+                         db, rettype, records, host=_service_host("ncbi"))
+        for a in arts:
+            tasks[a["id"]] = task
+            path = os.path.join(DATA_DIR, a["path"])
+            if seqindex.is_sequence_file(path):
+                sched.add(f"index:{os.path.basename(path)}", _index, path, deps=[task])
+    return tasks
+
+
 # ---------------------------------------------------------------------------
 # Main
 # ---------------------------------------------------------------------------
-def main():
+# Command-line shortcuts for generator sizes: option -> (artifact id, param)
+SIZE_OPTIONS = {
+    "nb02_samples": ("1kg-chr22", "n_samples"),
+    "nb02_snps": ("1kg-chr22", "n_snps"),
+    "nb03_cells": ("sc-atlas", "n_cells"),
+    "nb03_genes": ("sc-atlas", "n_genes"),
+    "nb05_genes": ("airway", "n_genes"),
+    "nb05_cell_lines": ("airway", "n_cell_lines"),
+    "nb05_de_fraction": ("airway", "de_fraction"),
+    "nb08_samples": ("arabidopsis-gwas", "n_accessions"),
+    "nb08_snps": ("arabidopsis-gwas", "n_snps"),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--jobs", "-j", type=int, default=8,
+                        help="maximum concurrent tasks (default: 8)")
+    parser.add_argument("--gen-jobs", type=int,
+                        help="worker processes per synthetic generator (default: "
+                             "BIONB_GEN_JOBS or all cores, shared by concurrent generators)")
+    parser.add_argument("--only", action="append", metavar="NB|ID",
+                        help="provision only these notebooks (nb04) or artifact ids; "
+                             "repeatable or comma-separated")
+    parser.add_argument("--dry-run", "-n", action="store_true",
+                        help="print what would be fetched or generated, then exit")
+    parser.add_argument("--manifest", default=manifest.MANIFEST_PATH,
+                        help="dataset manifest (default: data/manifest.json)")
+    parser.add_argument("--nb02-samples", type=int,
+                        help="1000 Genomes-like samples to simulate (default: 100)")
+    parser.add_argument("--nb02-snps", type=int,
+                        help="chr22 SNPs to simulate (default: 500)")
+    parser.add_argument("--nb03-cells", type=int,
+                        help="sc-atlas cells to simulate, with --only sc-atlas (default: 20000)")
+    parser.add_argument("--nb03-genes", type=int,
+                        help="sc-atlas genes to simulate, with --only sc-atlas (default: 20000)")
+    parser.add_argument("--nb05-genes", type=int,
+                        help="airway genes to simulate (default: 20000)")
+    parser.add_argument("--nb05-cell-lines", type=int,
+                        help="airway cell lines, each an untreated/dex pair (default: 4)")
+    parser.add_argument("--nb05-de-fraction", type=float,
+                        help="fraction of genes changed by dexamethasone (default: 0.025)")
+    parser.add_argument("--nb08-samples", type=int,
+                        help="Arabidopsis accessions to simulate (default: 200)")
+    parser.add_argument("--nb08-snps", type=int,
+                        help="Arabidopsis SNPs to simulate (default: 1000)")
+    args = parser.parse_args(argv)
+
+    artifacts = manifest.load(args.manifest)
+    by_id = {a["id"]: a for a in artifacts}
+    for option, (art_id, param) in SIZE_OPTIONS.items():
+        value = getattr(args, option)
+        if value is not None and art_id in by_id:
+            by_id[art_id]["params"][param] = value
+    notes = manifest.notes(args.manifest)
+    only = [w.strip().lower() for value in args.only or [] for w in value.split(",")]
+    try:
+        artifacts = manifest.select(artifacts, only, known=notes)
+    except ValueError as e:
+        parser.error(str(e))
+
     print("=" * 60)
     print("Bioinformatics Notebook Data Downloader")
     print("=" * 60)
 
-    download_nb01()
-    download_nb02()
-    precache_pbmc3k()
-    download_nb04()
-    download_nb05()
-    # NB06: lifelines.datasets built-in (no download needed)
-    print("\n=== NB06: Clinical Informatics ===")
-    print("  [skip] Uses lifelines.datasets.load_gbsg2() (built-in)")
-    # NB07: Biomedical Image Analysis (WSI file + skimage built-ins)
-    download_nb07()
-    download_nb08()
+    state = manifest.load_state(DATA_DIR)
+    todo = manifest.plan(artifacts, DATA_DIR, state, digest_of=cached_digest)
+    planned = {art["id"]: reason for art, reason in todo}
+    for nb in sorted({nb for a in artifacts for nb in a["notebooks"]} |
+                     (set(notes) if not only else set(notes) & set(only))):
+        print(f"\n=== {nb.upper()} ===")
+        for art in artifacts:
+            if nb in art["notebooks"]:
+                reason = planned.get(art["id"])
+                status = f"[{reason}]" if reason else "[up to date]"
+                print(f"  {art['id']:<22} {status}")
+        if nb in notes:
+            print(f"  {notes[nb]}")
+
+    if args.dry_run:
+        print(f"\n{len(todo)} of {len(artifacts)} artifacts would be provisioned")
+        return 0
+
+    sched = Scheduler(max_workers=args.jobs)
+    tasks = provision(todo, sched, args.gen_jobs)
+    print(f"\n=== Running {len(sched.tasks)} tasks ({args.jobs} workers) ===")
+    ok = sched.run()
+    sched.print_summary()
+
+    # Record the params each artifact now on disk was built with
+    for art in artifacts:
+        task = tasks.get(art["id"])
+        if art["path"] and (task is None or task.status == "ok"):
+            state[art["id"]] = {"params": art["params"]}
+    manifest.save_state(DATA_DIR, state)
 
     print("\n" + "=" * 60)
-    print("Data download complete!")
+    print("Data download complete!" if ok else "Data download finished with errors")
     print("=" * 60)
+    return 0 if ok else 1
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,241 @@
+"""
+Batched NCBI Entrez efetch client.
+
+Many accessions are fetched with one comma-joined ``id=`` request, and the
+multi-record FASTA/GenBank response is split back into per-accession files
+as it streams in. Requests share keep-alive HTTP connections, pass through a
+token-bucket rate limiter (3 req/s, or 10 req/s with an API key from
+NCBI_API_KEY), and retry 429/5xx responses with exponential backoff.
+
+    client = EntrezClient()
+    client.efetch_to_files("nucleotide", "gb", {"U00096.3": "e_coli.gb",
+                                                "L09137.1": "puc19.gb"})
+"""
+
+import os
+import time
+import queue
+import random
+import threading
+import http.client
+import urllib.parse
+
+EUTILS_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
+USER_AGENT = "BioNotebook/1.0"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Thread-safe token bucket: at most `rate` acquisitions per second on average."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity,
+                                   self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections to a single host, reused LIFO."""
+
+    def __init__(self, url, size=4, timeout=60):
+        parts = urllib.parse.urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+
+    def get(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            cls = (http.client.HTTPSConnection if self.scheme == "https"
+                   else http.client.HTTPConnection)
+            return cls(self.host, self.port, timeout=self.timeout)
+
+    def put(self, conn):
+        if self._idle.qsize() < self.size:
+            self._idle.put(conn)
+        else:
+            conn.close()
+
+
+def _record_accession(header_lines, rettype):
+    """Accession.version of a FASTA or GenBank record from its first lines."""
+    if rettype.startswith("fasta"):
+        return header_lines[0][1:].split()[0].split("|")[-1] or None
+    for line in header_lines:
+        if line.startswith("VERSION"):
+            return line.split()[1]
+    for line in header_lines:
+        if line.startswith("ACCESSION"):
+            return line.split()[1]
+    return None
+
+
+class EntrezClient:
+    """Rate-limited, connection-pooling Entrez client."""
+
+    def __init__(self, base_url=EUTILS_URL, api_key=None, rate=None,
+                 max_retries=5, backoff=1.0, pool_size=4, timeout=60):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key or os.environ.get("NCBI_API_KEY")
+        if rate is None:
+            rate = 10 if self.api_key else 3
+        self.bucket = TokenBucket(rate)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.pool = ConnectionPool(self.base_url, size=pool_size, timeout=timeout)
+        self._path = urllib.parse.urlsplit(self.base_url).path
+
+    def _post(self, endpoint, params, consume):
+        """POST params to an E-utility and pass the open response to consume().
+
+        The response is fully read before its connection goes back to the
+        pool. Retries on connection errors and 429/5xx with backoff.
+        """
+        if self.api_key:
+            params = dict(params, api_key=self.api_key)
+        body = urllib.parse.urlencode(params)
+        headers = {"User-Agent": USER_AGENT,
+                   "Content-Type": "application/x-www-form-urlencoded"}
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            conn = self.pool.get()
+            try:
+                conn.request("POST", f"{self._path}/{endpoint}", body, headers)
+                response = conn.getresponse()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                if attempt == self.max_retries:
+                    raise
+                self._sleep(attempt)
+                continue
+            if response.status in RETRY_STATUSES and attempt < self.max_retries:
+                response.read()
+                self.pool.put(conn)
+                self._sleep(attempt, response.getheader("Retry-After"))
+                continue
+            if response.status != 200:
+                response.read()
+                self.pool.put(conn)
+                raise IOError(f"{endpoint}: HTTP {response.status} {response.reason}")
+            try:
+                result = consume(response)
+                response.read()  # drain so the connection can be reused
+            except (OSError, http.client.HTTPException):
+                # Dropped mid-stream: records already completed stay on disk
+                conn.close()
+                if attempt == self.max_retries:
+                    raise
+                self._sleep(attempt)
+                continue
+            except BaseException:
+                conn.close()
+                raise
+            self.pool.put(conn)
+            return result
+
+    def _sleep(self, attempt, retry_after=None):
+        if retry_after and retry_after.isdigit():
+            delay = float(retry_after)
+        else:
+            delay = self.backoff * 2 ** attempt * (1 + random.random() * 0.1)
+        time.sleep(delay)
+
+    def efetch_to_files(self, db, rettype, targets, batch_size=200):
+        """Fetch {accession: filepath} in batches; return {accession: bytes}.
+
+        Each record is streamed to ``<filepath>.part`` and renamed when its
+        terminator arrives, so memory stays flat even for whole genomes.
+        Raises IOError listing any accessions missing from the responses.
+        """
+        accessions = list(targets)
+        # Accept records with or without a version suffix on the request side
+        wanted = {}
+        for acc in accessions:
+            wanted[acc] = acc
+            wanted.setdefault(acc.split(".")[0], acc)
+        written = {}
+        for i in range(0, len(accessions), batch_size):
+            batch = accessions[i:i + batch_size]
+            params = {"db": db, "id": ",".join(batch),
+                      "rettype": rettype, "retmode": "text"}
+            self._post("efetch.fcgi", params,
+                       lambda r: self._split_records(r, rettype, wanted, targets, written))
+        missing = [acc for acc in accessions if acc not in written]
+        if missing:
+            raise IOError(f"efetch returned no record for {', '.join(missing)}")
+        return written
+
+    def _split_records(self, response, rettype, wanted, targets, written):
+        fasta = rettype.startswith("fasta")
+        state = {"out": None, "acc": None}
+        header, skipping = [], False
+
+        def match(lines):
+            found = _record_accession(lines, rettype) or ""
+            return wanted.get(found) or wanted.get(found.split(".")[0])
+
+        def start(acc, lines):
+            os.makedirs(os.path.dirname(targets[acc]) or ".", exist_ok=True)
+            state["out"], state["acc"] = open(targets[acc] + ".part", "w"), acc
+            state["out"].writelines(lines)
+
+        def finish(complete=True):
+            out, acc = state["out"], state["acc"]
+            if out is not None:
+                out.close()
+                if complete:
+                    os.replace(targets[acc] + ".part", targets[acc])
+                    written[acc] = os.path.getsize(targets[acc])
+            state["out"] = state["acc"] = None
+
+        try:
+            for raw in iter(response.readline, b""):
+                line = raw.decode("utf-8", "replace")
+                if fasta:
+                    if line.startswith(">"):
+                        finish()
+                        acc = match([line])
+                        if acc is not None:
+                            start(acc, [line])
+                    elif state["out"] is not None:
+                        state["out"].write(line)
+                    continue
+                # GenBank: hold the header until VERSION names the record
+                if state["out"] is not None:
+                    state["out"].write(line)
+                elif not skipping:
+                    header.append(line)
+                    if line.startswith("VERSION") or line.startswith("//"):
+                        acc = match(header)
+                        if acc is not None:
+                            start(acc, header)
+                        skipping = acc is None
+                        header = []
+                if line.startswith("//"):
+                    finish()
+                    header, skipping = [], False
+        except BaseException:
+            if state["out"] is not None:
+                state["out"].close()
+            raise
+        # A GenBank record without its closing '//' was cut short
+        finish(complete=fasta)
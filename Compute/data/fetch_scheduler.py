@@ -0,0 +1,182 @@
+"""
+Dependency-aware task scheduler for the notebook data downloader.
+
+Tasks run on a bounded thread pool. Each task may name the host it talks to;
+the scheduler never has more than ``host_limits[host]`` tasks in flight for
+that host, so independent notebooks can provision in parallel without
+hammering NCBI, UniProt or RCSB. Tasks whose dependencies failed are skipped.
+
+Usage:
+    sched = Scheduler(max_workers=8)
+    a = sched.add("ncbi:NM_007294.4", fetch, ..., host="eutils.ncbi.nlm.nih.gov")
+    sched.add("index:brca1", build_index, ..., deps=[a])
+    sched.run()
+    sched.print_summary()
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import urlparse
+
+# Conservative per-host concurrency. NCBI request *rate* is enforced
+# separately by the Entrez client's token bucket (3 req/s, 10 with a key).
+DEFAULT_HOST_LIMITS = {
+    "eutils.ncbi.nlm.nih.gov": 3,
+    "rest.uniprot.org": 4,
+    "files.rcsb.org": 4,
+}
+DEFAULT_HOST_LIMIT = 4
+
+
+def host_of(url):
+    """Return the network location (host[:port]) of a URL."""
+    return urlparse(url).netloc
+
+
+class Task:
+    """A unit of work: a callable plus its dependencies and target host."""
+
+    def __init__(self, name, fn, args=(), kwargs=None, deps=(), host=None):
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.deps = list(deps)
+        self.host = host
+        self.status = "pending"  # pending | running | ok | failed | skipped
+        self.result = None
+        self.error = None
+        self.elapsed = 0.0
+
+    def __repr__(self):
+        return f"Task({self.name!r}, status={self.status!r})"
+
+
+class Scheduler:
+    """Run a DAG of tasks on a thread pool with per-host concurrency limits.
+
+    A task counts as failed if it raises or returns ``False`` (the convention
+    used by the fetchers in download_all_data.py).
+    """
+
+    def __init__(self, max_workers=8, host_limits=None,
+                 default_host_limit=DEFAULT_HOST_LIMIT, verbose=True):
+        self.max_workers = max(1, int(max_workers))
+        self.host_limits = dict(DEFAULT_HOST_LIMITS)
+        if host_limits:
+            self.host_limits.update(host_limits)
+        self.default_host_limit = default_host_limit
+        self.verbose = verbose
+        self.tasks = []
+        self.wall_time = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, name, fn, *args, deps=(), host=None, **kwargs):
+        """Register a task and return it (usable as a dependency)."""
+        task = Task(name, fn, args, kwargs, deps, host)
+        with self._lock:
+            self.tasks.append(task)
+        return task
+
+    def _limit(self, host):
+        return self.host_limits.get(host, self.default_host_limit)
+
+    def _execute(self, task):
+        start = time.perf_counter()
+        try:
+            result = task.fn(*task.args, **task.kwargs)
+            task.result = result
+            task.status = "failed" if result is False else "ok"
+        except Exception as e:
+            task.error = e
+            task.status = "failed"
+        task.elapsed = time.perf_counter() - start
+        return task
+
+    def _report(self, task, n_done, n_total):
+        if not self.verbose:
+            return
+        detail = f"  ({task.error})" if task.error else ""
+        with self._lock:
+            print(f"  [{n_done}/{n_total}] {task.status:<7} {task.name}"
+                  f"  {task.elapsed:.2f}s{detail}")
+
+    def run(self):
+        """Run every registered task; return True if none failed or were skipped."""
+        start = time.perf_counter()
+        pending = [t for t in self.tasks if t.status == "pending"]
+        n_total = len(pending)
+        n_done = 0
+        in_flight = {}  # future -> task
+        host_busy = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or in_flight:
+                # Propagate failures to dependents, then launch whatever is ready
+                for task in list(pending):
+                    if any(d.status in ("failed", "skipped") for d in task.deps):
+                        task.status = "skipped"
+                        pending.remove(task)
+                        n_done += 1
+                        self._report(task, n_done, n_total)
+                for task in list(pending):
+                    if len(in_flight) >= self.max_workers:
+                        break
+                    if any(d.status != "ok" for d in task.deps):
+                        continue
+                    if host_busy.get(task.host, 0) >= self._limit(task.host):
+                        continue
+                    host_busy[task.host] = host_busy.get(task.host, 0) + 1
+                    task.status = "running"
+                    pending.remove(task)
+                    in_flight[pool.submit(self._execute, task)] = task
+
+                if not in_flight:
+                    if pending:
+                        # Only reachable with a dependency on an unregistered task
+                        for task in pending:
+                            task.status = "skipped"
+                            n_done += 1
+                            self._report(task, n_done, n_total)
+                        pending = []
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    task = in_flight.pop(fut)
+                    host_busy[task.host] -= 1
+                    n_done += 1
+                    self._report(task, n_done, n_total)
+
+        self.wall_time = time.perf_counter() - start
+        return all(t.status == "ok" for t in self.tasks)
+
+    def summary(self):
+        """Aggregate counts and timings for the last run."""
+        counts = {}
+        for t in self.tasks:
+            counts[t.status] = counts.get(t.status, 0) + 1
+        serial = sum(t.elapsed for t in self.tasks)
+        slowest = max(self.tasks, key=lambda t: t.elapsed, default=None)
+        return {
+            "counts": counts,
+            "wall_time": self.wall_time,
+            "serial_time": serial,
+            "slowest": (slowest.name, slowest.elapsed) if slowest else None,
+            "failed": [t.name for t in self.tasks if t.status == "failed"],
+            "skipped": [t.name for t in self.tasks if t.status == "skipped"],
+        }
+
+    def print_summary(self):
+        s = self.summary()
+        counts = ", ".join(f"{v} {k}" for k, v in sorted(s["counts"].items()))
+        print(f"\n  Tasks: {counts}")
+        print(f"  Wall time: {s['wall_time']:.2f}s "
+              f"(sum of task times {s['serial_time']:.2f}s)")
+        if s["slowest"]:
+            print(f"  Slowest task: {s['slowest'][0]} ({s['slowest'][1]:.2f}s)")
+        for name in s["failed"]:
+            print(f"  [FAILED] {name}")
+        for name in s["skipped"]:
+            print(f"  [SKIPPED] {name}")
@@ -0,0 +1,215 @@
+"""
+Compact 2-bit genotype store in PLINK 1 binary format (.bed/.bim/.fam).
+
+Genotypes are alternate-allele counts (0/1/2, -1 for missing) packed four to
+a byte in SNP-major order, so a SNP range is one contiguous slice of the
+memory-mapped file. The .bim sidecar holds (chrom, id, cM, pos, A1, A2)
+with A1 the counted (alternate) allele; the .fam sidecar holds sample IDs.
+The files open directly in PLINK, and from Python with:
+
+    from data.genotype_store import BedReader
+    bed = BedReader("data/nb02/1kg_chr22_subset")
+    g = bed.read(snps=slice(0, 1000))          # int8, samples x SNPs
+    g = bed.read(samples=[0, 5, 9], snps=bed.region("22", 20_000_000, 30_000_000))
+"""
+
+import os
+
+import numpy as np
+
+BED_MAGIC = bytes([0x6C, 0x1B, 0x01])  # PLINK magic + SNP-major mode
+
+# Alt-allele count -> 2-bit PLINK code (A1 = alt: 00 hom A1, 10 het,
+# 11 hom A2, 01 missing); index 3 holds the code for -1 (missing).
+_ENCODE = np.array([0b11, 0b10, 0b00, 0b01], dtype=np.uint8)
+_DECODE = np.array([2, -1, 1, 0], dtype=np.int8)
+# Byte -> the four genotypes it packs, lowest bits first
+_BYTE_LUT = _DECODE[(np.arange(256)[:, None] >> np.array([0, 2, 4, 6])) & 3]
+# The same four int8 values viewed as one uint32, so decoding is one gather
+_BYTE_LUT32 = _BYTE_LUT.view(np.uint32).ravel()
+
+
+def parse_snp_label(label):
+    """Split a ``chr<chrom>_<pos>`` column header into (chrom, pos)."""
+    chrom, pos = label.rsplit("_", 1)
+    return chrom[3:] if chrom.startswith("chr") else chrom, int(pos)
+
+
+def pack_block(block):
+    """Pack an int8 (samples, snps) block into (snps, ceil(samples/4)) bytes."""
+    codes = _ENCODE[np.asarray(block).T & 3]  # -1 & 3 == 3 -> missing
+    n_snps, n = codes.shape
+    if n % 4:
+        codes = np.pad(codes, ((0, 0), (0, 4 - n % 4)), constant_values=0b00)
+    codes = codes.reshape(n_snps, -1, 4)
+    return (codes[..., 0] | codes[..., 1] << 2 |
+            codes[..., 2] << 4 | codes[..., 3] << 6).astype(np.uint8)
+
+
+class BedWriter:
+    """Write a .bed/.bim/.fam triple from blocks of samples.
+
+    Blocks must arrive at sample offsets that are multiples of four (the
+    synthetic generators guarantee this). Files are written under ``.part``
+    names and renamed by ``close()``.
+    """
+
+    def __init__(self, prefix, sample_ids, chroms, positions, snp_ids=None):
+        self.prefix = prefix
+        self.sample_ids = list(sample_ids)
+        self.chroms = list(chroms)
+        self.positions = list(positions)
+        self.snp_ids = (list(snp_ids) if snp_ids is not None else
+                        [f"chr{c}_{p}" for c, p in zip(self.chroms, self.positions)])
+        self.n_samples = len(self.sample_ids)
+        self.n_snps = len(self.positions)
+        self.bytes_per_snp = (self.n_samples + 3) // 4
+        path = prefix + ".bed.part"
+        with open(path, "wb") as f:
+            f.write(BED_MAGIC)
+            f.truncate(len(BED_MAGIC) + self.n_snps * self.bytes_per_snp)
+        self._mm = np.memmap(path, dtype=np.uint8, mode="r+", offset=len(BED_MAGIC),
+                             shape=(self.n_snps, self.bytes_per_snp))
+
+    def write_block(self, start, block):
+        if start % 4:
+            raise ValueError(f"block start {start} is not a multiple of 4")
+        packed = pack_block(block)
+        self._mm[:, start // 4:start // 4 + packed.shape[1]] = packed
+
+    def tap(self, blocks):
+        """Pass ``(start, block)`` pairs through, writing each one on the way."""
+        for start, block in blocks:
+            self.write_block(start, block)
+            yield start, block
+
+    def close(self):
+        self._mm.flush()
+        del self._mm
+        with open(self.prefix + ".bim.part", "w") as f:
+            # Alleles are placeholders for simulated data; A1 is the counted allele
+            for chrom, snp_id, pos in zip(self.chroms, self.snp_ids, self.positions):
+                f.write(f"{chrom}\t{snp_id}\t0\t{pos}\tA\tG\n")
+        with open(self.prefix + ".fam.part", "w") as f:
+            for sid in self.sample_ids:
+                f.write(f"{sid}\t{sid}\t0\t0\t0\t-9\n")
+        for ext in (".bim", ".fam", ".bed"):
+            os.replace(self.prefix + ext + ".part", self.prefix + ext)
+
+
+def convert_csv(csv_path, prefix, block_samples=4096):
+    """Convert a wide genotype CSV (id, chr<c>_<pos>, ...) to .bed/.bim/.fam."""
+    with open(csv_path) as f:
+        labels = f.readline().rstrip("\r\n").split(",")[1:]
+        rows = [line.split(",", 1) for line in f if line.strip()]
+    chroms, positions = zip(*(parse_snp_label(lab) for lab in labels))
+    writer = BedWriter(prefix, [r[0] for r in rows], chroms, positions, labels)
+    for start in range(0, len(rows), block_samples):
+        chunk = rows[start:start + block_samples]
+        block = np.array([np.array(r[1].split(","), dtype=np.int8) for r in chunk])
+        writer.write_block(start, block)
+    writer.close()
+    return len(rows), len(labels)
+
+
+class _Genotypes:
+    """Shared read interface; subclasses provide read_rows() and the
+    chroms / positions / snp_ids / sample_ids / n_snps / n_samples fields."""
+
+    @property
+    def shape(self):
+        return self.n_samples, self.n_snps
+
+    def region(self, chrom, start, end):
+        """Slice of SNPs on chrom with start <= pos < end (SNPs sorted by position)."""
+        idx = np.flatnonzero(self.chroms == str(chrom))
+        if not len(idx):
+            return slice(0, 0)
+        lo, hi = np.searchsorted(self.positions[idx], [start, end])
+        return slice(int(idx[0] + lo), int(idx[0] + hi))
+
+    def read(self, snps=None, samples=None):
+        """Decode an int8 (samples, snps) matrix; -1 marks missing calls.
+
+        ``snps`` and ``samples`` may be slices or index arrays. Only the bytes
+        of the selected SNPs (and, with ``samples``, the selected columns of
+        those) are touched.
+        """
+        return np.ascontiguousarray(self.read_rows(snps, samples).T)
+
+    def iter_blocks(self, block_snps=10000, samples=None):
+        """Yield ``(start, block)`` over consecutive SNP ranges."""
+        for start in range(0, self.n_snps, block_snps):
+            yield start, self.read(slice(start, start + block_snps), samples)
+
+
+class BedReader(_Genotypes):
+    """Memory-mapped random access to a .bed/.bim/.fam genotype triple."""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        bim = np.loadtxt(prefix + ".bim", dtype=str, ndmin=2)
+        self.chroms = bim[:, 0]
+        self.snp_ids = bim[:, 1]
+        self.positions = bim[:, 3].astype(np.int64)
+        with open(prefix + ".fam") as f:
+            self.sample_ids = [line.split()[1] for line in f if line.strip()]
+        self.n_samples = len(self.sample_ids)
+        self.n_snps = len(self.positions)
+        self.bytes_per_snp = (self.n_samples + 3) // 4
+        with open(prefix + ".bed", "rb") as f:
+            if f.read(3) != BED_MAGIC:
+                raise ValueError(f"{prefix}.bed is not a SNP-major PLINK .bed file")
+        self._mm = np.memmap(prefix + ".bed", dtype=np.uint8, mode="r", offset=3,
+                             shape=(self.n_snps, self.bytes_per_snp))
+
+    def read_rows(self, snps=None, samples=None):
+        """Like read(), but SNP-major: an int8 (snps, samples) matrix.
+
+        This is the on-disk order, so no transpose is needed; kernels that
+        work SNP by SNP should prefer it.
+        """
+        rows = self._mm[snps if snps is not None else slice(None)]
+        if rows.ndim == 1:
+            rows = rows[None, :]
+        if samples is None:
+            return _BYTE_LUT32[rows].view(np.int8).reshape(len(rows), -1)[:, :self.n_samples]
+        samples = np.arange(self.n_samples)[samples]
+        shifts = (2 * (samples % 4)).astype(np.uint8)
+        return _DECODE[(rows[:, samples // 4] >> shifts) & 3]
+
+
+class GenotypeArray(_Genotypes):
+    """In-memory genotypes with the BedReader interface.
+
+    ``genotypes`` is a (samples, snps) 0/1/2 matrix (-1 missing) and
+    ``snp_labels`` the ``chr<chrom>_<pos>`` column headers the generators
+    write, which supply chromosome and position.
+    """
+
+    def __init__(self, genotypes, snp_labels, sample_ids=None):
+        self._g = np.ascontiguousarray(np.asarray(genotypes, dtype=np.int8).T)
+        self.snp_ids = np.asarray(snp_labels)
+        chroms, positions = zip(*(parse_snp_label(lab) for lab in snp_labels))
+        self.chroms = np.asarray(chroms)
+        self.positions = np.asarray(positions, dtype=np.int64)
+        self.n_snps, self.n_samples = self._g.shape
+        self.sample_ids = (list(sample_ids) if sample_ids is not None else
+                           [str(i) for i in range(self.n_samples)])
+
+    @classmethod
+    def from_csv(cls, csv_path):
+        """Load a wide genotype CSV (id, chr<c>_<pos>, ...)."""
+        with open(csv_path) as f:
+            labels = f.readline().rstrip("\r\n").split(",")[1:]
+            rows = [line.rstrip("\r\n").split(",", 1) for line in f if line.strip()]
+        g = np.array([np.array(r[1].split(","), dtype=np.int8) for r in rows])
+        return cls(g, labels, [r[0] for r in rows])
+
+    def read_rows(self, snps=None, samples=None):
+        """SNP-major int8 (snps, samples) view or copy of the selection."""
+        rows = self._g[snps if snps is not None else slice(None)]
+        if rows.ndim == 1:
+            rows = rows[None, :]
+        return rows if samples is None else rows[:, samples]
+
@@ -0,0 +1,145 @@
+"""
+Declarative dataset manifest and provisioning planner.
+
+Every file the notebooks need is described once in manifest.json: where it
+comes from (``ncbi``, ``uniprot``, ``pdb``, ``url`` or a named ``generator``),
+the parameters for that source, the target path (relative to data/), any
+extra files the same step writes, an optional expected size / sha256 and the
+notebooks that use it. Artifacts marked ``"optional": true`` (large datasets
+few runs need) are only provisioned when asked for by id. The planner
+compares the manifest with what is on disk and returns only the artifacts
+that are missing or stale.
+
+The parameters each artifact was last built with are recorded in
+``.manifest-state.json`` next to the data, so editing an artifact's params
+(e.g. a generator's ``n_snps``) marks it stale on the next run.
+
+    artifacts = manifest.load()
+    for art, reason in manifest.plan(manifest.select(artifacts, ["nb04"]), DATA_DIR):
+        print(art["id"], reason)
+"""
+
+import os
+import json
+
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "manifest.json")
+STATE_FILE = ".manifest-state.json"
+
+SOURCES = {
+    "ncbi": ("db", "accession", "rettype"),
+    "uniprot": ("accession",),
+    "pdb": ("pdb_id",),
+    "url": ("url",),
+    "generator": ("name",),
+}
+
+
+def load(path=MANIFEST_PATH):
+    """Read and validate the manifest; return its list of artifact dicts."""
+    with open(path) as f:
+        doc = json.load(f)
+    artifacts = doc.get("artifacts", [])
+    seen = set()
+    for art in artifacts:
+        art_id = art.get("id")
+        if not art_id or art_id in seen:
+            raise ValueError(f"{path}: missing or duplicate artifact id {art_id!r}")
+        seen.add(art_id)
+        source = art.get("source")
+        if source not in SOURCES:
+            raise ValueError(f"{art_id}: unknown source {source!r}")
+        params = art.setdefault("params", {})
+        missing = [k for k in SOURCES[source] if k not in params]
+        if missing:
+            raise ValueError(f"{art_id}: {source} source needs {', '.join(missing)}")
+        if art.get("path") is None and source != "generator":
+            raise ValueError(f"{art_id}: only generators may omit 'path'")
+        art.setdefault("outputs", [])
+        art.setdefault("notebooks", [])
+        art.setdefault("description", art_id)
+        art.setdefault("optional", False)
+    return artifacts
+
+
+def notes(path=MANIFEST_PATH):
+    """Per-notebook notes (built-in datasets that need no download)."""
+    with open(path) as f:
+        return json.load(f).get("notes", {})
+
+
+def select(artifacts, only=None, known=()):
+    """Artifacts tagged with any of ``only`` (notebook tags or artifact ids).
+
+    Optional artifacts are included only when ``only`` names their id.
+    Names in ``known`` (e.g. notebooks with notes but no artifacts) are
+    accepted without matching anything.
+    """
+    wanted = {w.strip().lower() for w in only or () if w.strip()}
+    unknown = wanted - set(known) - {a["id"] for a in artifacts} - {
+        nb for a in artifacts for nb in a["notebooks"]}
+    if unknown:
+        raise ValueError(f"no artifact or notebook named {', '.join(sorted(unknown))}")
+    return [a for a in artifacts if a["id"] in wanted or not a["optional"] and (
+        not wanted or wanted.intersection(a["notebooks"]))]
+
+
+def files(art, data_dir):
+    """Absolute paths of every file an artifact produces (primary first)."""
+    paths = [art["path"]] if art.get("path") else []
+    return [os.path.join(data_dir, p) for p in paths + art["outputs"]]
+
+
+def load_state(data_dir):
+    try:
+        with open(os.path.join(data_dir, STATE_FILE)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_state(data_dir, state):
+    path = os.path.join(data_dir, STATE_FILE)
+    with open(path + ".part", "w") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+        f.write("\n")
+    os.replace(path + ".part", path)
+
+
+def staleness(art, data_dir, state, digest_of):
+    """Why an artifact must be (re)built, or None if it is up to date."""
+    paths = files(art, data_dir)
+    if not paths:
+        return "not tracked on disk"
+    for p in paths:
+        if not os.path.exists(p) or os.path.getsize(p) == 0:
+            return f"missing {os.path.relpath(p, data_dir)}"
+    if "size" in art and os.path.getsize(paths[0]) != art["size"]:
+        return f"size {os.path.getsize(paths[0]):,} != {art['size']:,}"
+    if "sha256" in art and digest_of(art, paths[0]) != art["sha256"].lower():
+        return "sha256 mismatch"
+    # Files from before state tracking (e.g. the git checkout) are adopted
+    recorded = state.get(art["id"])
+    if recorded is not None and recorded.get("params") != art["params"]:
+        return "params changed"
+    return None
+
+
+def plan(artifacts, data_dir, state=None, digest_of=None):
+    """Return ``[(artifact, reason), ...]`` for artifacts needing work.
+
+    ``digest_of(artifact, path)`` supplies a file's sha256; by default the
+    file is hashed, but callers with a content cache can answer from it.
+    """
+    if state is None:
+        state = load_state(data_dir)
+    if digest_of is None:
+        from datacache import sha256_file
+
+        def digest_of(art, path):
+            return sha256_file(path)
+    todo = []
+    for art in artifacts:
+        reason = staleness(art, data_dir, state, digest_of)
+        if reason is not None:
+            todo.append((art, reason))
+    return todo
@@ -0,0 +1,50 @@
+"""
+Ordered process pool for chunked, CPU-bound work.
+
+Generators and analysis modules split their work into fixed-size chunks and
+hand them to ``run_chunks``, which yields the results in task order with a
+bounded number of chunks in flight:
+
+    from data.pool import run_chunks
+    for block in run_chunks(fn, tasks, jobs=8, initializer=init, initargs=(path,)):
+        ...
+"""
+
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+def default_jobs():
+    """Worker processes: BIONB_GEN_JOBS or every core."""
+    return int(os.environ.get("BIONB_GEN_JOBS", 0)) or os.cpu_count() or 1
+
+
+def run_chunks(fn, tasks, jobs=None, initializer=None, initargs=()):
+    """Yield fn(task) for each task, in order, using a process pool.
+
+    ``initializer(*initargs)`` ships large read-only inputs to each worker
+    once. At most two tasks per worker are in flight, so finished results
+    never pile up ahead of a slow consumer. With one job (or one task)
+    everything runs in-process.
+    """
+    tasks = list(tasks)
+    jobs = min(jobs or default_jobs(), len(tasks))
+    if jobs <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for task in tasks:
+            yield fn(task)
+        return
+    # Callers may run inside threads (the downloader's scheduler): don't fork
+    methods = multiprocessing.get_all_start_methods()
+    ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    with ProcessPoolExecutor(jobs, mp_context=ctx, initializer=initializer,
+                             initargs=initargs) as pool:
+        pending = []
+        for task in tasks:
+            pending.append(pool.submit(fn, task))
+            if len(pending) >= 2 * jobs:
+                yield pending.pop(0).result()
+        for fut in pending:
+            yield fut.result()
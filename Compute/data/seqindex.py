@@ -0,0 +1,396 @@
+"""
+faidx-style random access to downloaded FASTA and GenBank files.
+
+``ensure_index(path)`` runs at download time (download_all_data.py) and
+writes, next to the file,
+
+    <file>.fai   for FASTA: the samtools faidx table (name, length, byte
+                 offset of the first base, bases per line, bytes per line)
+    <file>.gbi   for GenBank (JSON): the same line geometry of each
+                 record's ORIGIN block (number prefix width and 10-base
+                 groups included) plus a feature-table index: type,
+                 0-based half-open extent, strand, spliced parts, a few
+                 key qualifiers and the byte span of each feature's text
+
+``IndexedSequences`` memory-maps the file, so a subsequence costs one
+offset computation and one slice of the mapping, and features are found by
+binary search on their starts, however large the record:
+
+    from data.seqindex import IndexedSequences
+    with IndexedSequences("data/nb01/e_coli_k12_segment.gb") as seqs:
+        first_50kb = seqs.fetch("U00096.3", 0, 50_000)
+        lac = seqs.features(type="CDS", gene="lacZ")[0]
+        lacz = seqs.feature_sequence(lac)
+
+GenBank sequence comes back upper-case (as Bio.SeqIO returns it); FASTA
+sequence as stored.
+"""
+
+import os
+import re
+import json
+import mmap
+import bisect
+
+import numpy as np
+
+FASTA_SUFFIXES = (".fa", ".fasta", ".fna", ".ffn", ".faa", ".frn")
+GENBANK_SUFFIXES = (".gb", ".gbk", ".genbank", ".gbff")
+# Qualifiers copied into the feature index (the rest via feature_text)
+QUALIFIERS = ("gene", "locus_tag", "product", "protein_id")
+INDEX_VERSION = 1
+# Features per block of the reader's max-end table
+FEATURE_BLOCK = 64
+
+_COMPLEMENT = bytes.maketrans(b"ACGTRYKMBVDHNacgtrykmbvdhn", b"TGCAYRMKVBHDNtgcayrmkvbhdn")
+_LOCATION_TOKEN = re.compile(r"complement\(|(?:join|order|bond)\(|\(|\)|"
+                             r"(?:([A-Za-z0-9_.]+):)?<?(\d+)(?:(\.\.|\^)>?(\d+))?")
+
+
+def is_sequence_file(path):
+    return path.lower().endswith(FASTA_SUFFIXES + GENBANK_SUFFIXES)
+
+
+def _is_genbank(path):
+    return path.lower().endswith(GENBANK_SUFFIXES)
+
+
+def index_path(path):
+    return path + (".gbi" if _is_genbank(path) else ".fai")
+
+
+# ---------------------------------------------------------------------------
+# FASTA
+# ---------------------------------------------------------------------------
+def _line_table(buf):
+    """(starts, lengths without line terminators) of every line of a buffer."""
+    ends = np.flatnonzero(buf == ord("\n"))
+    if len(buf) and buf[-1] != ord("\n"):
+        ends = np.r_[ends, len(buf)]
+    starts = np.r_[0, ends[:-1] + 1]
+    lengths = ends - starts
+    cr = (lengths > 0) & (buf[np.maximum(ends - 1, 0)] == ord("\r"))
+    return starts, lengths - cr, ends - starts + 1
+
+
+def _fasta_index(buf):
+    starts, lengths, widths = _line_table(buf)
+    headers = np.flatnonzero(buf[starts[lengths > 0]] == ord(">"))
+    headers = np.flatnonzero(lengths > 0)[headers]
+    records = []
+    for i, h in enumerate(headers):
+        stop = headers[i + 1] if i + 1 < len(headers) else len(starts)
+        name = bytes(buf[starts[h] + 1:starts[h] + lengths[h]]).decode().split()[0]
+        seq = np.arange(h + 1, stop)
+        while len(seq) and lengths[seq[-1]] == 0:
+            seq = seq[:-1]
+        if not len(seq):
+            records.append({"name": name, "length": 0, "offset": int(starts[h] + widths[h]),
+                            "linebases": 0, "linewidth": 0})
+            continue
+        linebases, linewidth = int(lengths[seq[0]]), int(widths[seq[0]])
+        if (np.any(lengths[seq[:-1]] != linebases) or np.any(widths[seq[:-1]] != linewidth)
+                or lengths[seq[-1]] > linebases):
+            raise ValueError(f"{name}: FASTA lines have different lengths; cannot index")
+        records.append({"name": name, "length": int(lengths[seq].sum()),
+                        "offset": int(starts[seq[0]]), "linebases": linebases,
+                        "linewidth": linewidth})
+    return {"format": "fasta", "records": records, "features": {}}
+
+
+def _write_fai(path, index):
+    with open(path + ".part", "w") as f:
+        for r in index["records"]:
+            f.write(f"{r['name']}\t{r['length']}\t{r['offset']}\t{r['linebases']}\t"
+                    f"{r['linewidth']}\n")
+    os.replace(path + ".part", path)
+
+
+def _read_fai(path):
+    records = []
+    with open(path) as f:
+        for line in f:
+            name, length, offset, linebases, linewidth = line.rstrip("\n").split("\t")[:5]
+            records.append({"name": name, "length": int(length), "offset": int(offset),
+                            "linebases": int(linebases), "linewidth": int(linewidth)})
+    return {"format": "fasta", "records": records, "features": {}}
+
+
+# ---------------------------------------------------------------------------
+# GenBank
+# ---------------------------------------------------------------------------
+def parse_location(text):
+    """(start, end, strand, parts) of a GenBank location, 0-based half-open.
+
+    ``parts`` are [start, end, strand] in biological order (an outer
+    complement reverses them) and strand is 0 for mixed-strand joins;
+    ``a^b`` sites are empty intervals and parts on other accessions
+    (``X12345.1:1..10``) are dropped.
+    """
+    stack, parts = [], []
+    for m in _LOCATION_TOKEN.finditer(text.replace(" ", "")):
+        token = m.group(0)
+        if token.endswith("("):
+            stack.append(token == "complement(")
+        elif token == ")":
+            if stack:
+                stack.pop()
+        elif m.group(2) and not m.group(1):
+            a = int(m.group(2))
+            if m.group(3) == "..":
+                s, e = a - 1, int(m.group(4))
+            elif m.group(3) == "^":
+                s = e = a
+            else:
+                s, e = a - 1, a
+            parts.append([s, e, -1 if sum(stack) % 2 else 1])
+    if not parts:
+        return None
+    strands = {p[2] for p in parts}
+    strand = strands.pop() if len(strands) == 1 else 0
+    if strand == -1 and text.replace(" ", "").startswith("complement("):
+        parts = parts[::-1]
+    return min(p[0] for p in parts), max(p[1] for p in parts), strand, parts
+
+
+def _features(buf, lo, hi):
+    """Feature table entries of the bytes [lo, hi) after a FEATURES line."""
+    text = bytes(buf[lo:hi]).decode("latin-1")
+    feats, current, offset = [], None, lo
+    for line in text.splitlines(keepends=True):
+        if len(line) > 5 and line[5] != " ":
+            current = {"type": line[5:21].strip(), "location": line[21:].strip(),
+                       "qualifiers": {}, "offset": offset, "qualifier": None}
+            feats.append(current)
+        elif current is not None and line[21:22] == "/":
+            name, eq, value = line[22:].rstrip("\r\n").partition("=")
+            current["qualifier"] = name
+            current["qualifiers"].setdefault(name, value if eq else "")
+        elif current is not None:
+            more = line[21:].strip()
+            if current["qualifier"] is None:
+                current["location"] += more
+            elif current["qualifier"] in QUALIFIERS:
+                q = current["qualifier"]
+                current["qualifiers"][q] += " " + more
+        offset += len(line)
+        if current is not None:
+            current["end_offset"] = offset
+    out = []
+    for f in feats:
+        loc = parse_location(f["location"])
+        if loc is None:
+            continue
+        quals = {k: v.strip('"') for k, v in f["qualifiers"].items() if k in QUALIFIERS}
+        out.append([f["type"], loc[0], loc[1], loc[2], loc[3], quals, f["offset"],
+                    f["end_offset"] - f["offset"]])
+    out.sort(key=lambda r: (r[1], r[2]))
+    return out
+
+
+def _origin_geometry(buf, start):
+    """Line geometry of the ORIGIN line starting at byte ``start``."""
+    end = start
+    while end < len(buf) and buf[end] != ord("\n"):
+        end += 1
+    line = bytes(buf[start:end]).rstrip(b"\r")
+    first = next((i for i, ch in enumerate(line) if chr(ch).isalpha()), None)
+    if first is None:
+        return None
+    groups = line[first:].split(b" ")
+    return {"prefix": first, "group": len(groups[0]), "linebases": sum(map(len, groups)),
+            "linewidth": end - start + 1}
+
+
+def _genbank_index(buf):
+    data = bytes(buf)
+    records, features = [], {}
+    pos = 0
+    while True:
+        locus = data.find(b"LOCUS", pos)
+        if locus < 0:
+            break
+        stop = data.find(b"\n//", locus)
+        stop = len(data) if stop < 0 else stop
+        head_end = data.find(b"\nORIGIN", locus, stop)
+        header = data[locus:head_end if head_end >= 0 else stop].decode("latin-1")
+        fields = {}
+        for line in header.splitlines():
+            key = line[:12].strip()
+            if key and key not in fields:
+                fields[key] = line[12:].strip()
+        tokens = fields.get("LOCUS", "").split()
+        locus_name = tokens[0] if tokens else ""
+        length = int(tokens[1]) if len(tokens) > 1 and tokens[1].isdigit() else 0
+        name = fields.get("VERSION", locus_name).split()[0] if fields.get("VERSION") \
+            else locus_name
+        aliases = sorted({locus_name, *fields.get("ACCESSION", "").split()[:1]} - {name, ""})
+        rec = {"name": name, "aliases": aliases, "length": length,
+               "description": fields.get("DEFINITION", ""), "offset": 0, "linebases": 0,
+               "linewidth": 0, "prefix": 0, "group": 0}
+        if head_end >= 0:
+            rec["offset"] = data.find(b"\n", head_end + 1) + 1
+            geometry = _origin_geometry(buf, rec["offset"])
+            if geometry:
+                rec.update(geometry)
+                last = rec["offset"] + (-(-length // rec["linebases"]) - 1) * rec["linewidth"]
+                if length and data.rfind(b"\n", 0, stop) + 1 != last:
+                    raise ValueError(f"{name}: ORIGIN lines have different lengths; "
+                                     "cannot index")
+        feat_start = data.find(b"\nFEATURES", locus, head_end if head_end >= 0 else stop)
+        if feat_start >= 0:
+            lo = data.find(b"\n", feat_start + 1) + 1
+            features[name] = _features(buf, lo, head_end + 1 if head_end >= 0 else stop)
+        records.append(rec)
+        pos = stop + 3
+    return {"format": "genbank", "records": records, "features": features}
+
+
+# ---------------------------------------------------------------------------
+# Index files
+# ---------------------------------------------------------------------------
+def build_index(path):
+    """Index a FASTA or GenBank file, write the index beside it and return it."""
+    with open(path, "rb") as f:
+        buf = np.frombuffer(f.read(), dtype=np.uint8)
+    index = _genbank_index(buf) if _is_genbank(path) else _fasta_index(buf)
+    out = index_path(path)
+    if index["format"] == "fasta":
+        _write_fai(out, index)
+    else:
+        st = os.stat(path)
+        index.update(version=INDEX_VERSION, size=st.st_size, mtime_ns=st.st_mtime_ns)
+        with open(out + ".part", "w") as f:
+            json.dump(index, f, separators=(",", ":"))
+        os.replace(out + ".part", out)
+    return index
+
+
+def load_index(path):
+    """The index of path if it is present and not older than the file, else None."""
+    out = index_path(path)
+    if not os.path.exists(out):
+        return None
+    st = os.stat(path)
+    if os.stat(out).st_mtime_ns < st.st_mtime_ns:
+        return None
+    if not _is_genbank(path):
+        return _read_fai(out)
+    with open(out) as f:
+        index = json.load(f)
+    if (index.get("version") != INDEX_VERSION or index.get("size") != st.st_size or
+            index.get("mtime_ns") != st.st_mtime_ns):
+        return None
+    return index
+
+
+def ensure_index(path):
+    """Load the index of path, (re)building it when missing or stale."""
+    index = load_index(path)
+    return build_index(path) if index is None else index
+
+
+def remove_index(path):
+    out = index_path(path)
+    if os.path.exists(out):
+        os.remove(out)
+
+
+# ---------------------------------------------------------------------------
+# Reader
+# ---------------------------------------------------------------------------
+class IndexedSequences:
+    """Memory-mapped random access to the records of an indexed file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.index = ensure_index(path)
+        self.genbank = self.index["format"] == "genbank"
+        self.records = {r["name"]: r for r in self.index["records"]}
+        self._aliases = {a: r["name"] for r in self.index["records"]
+                         for a in r.get("aliases", ())}
+        # Per record: feature starts (rows are sorted by start) and the
+        # largest end in each FEATURE_BLOCK rows, so a query skips blocks
+        # that end before it even when a long feature (source) comes first
+        self._features = {}
+        for name, rows in self.index["features"].items():
+            block_ends = [max(r[2] for r in rows[i:i + FEATURE_BLOCK])
+                          for i in range(0, len(rows), FEATURE_BLOCK)]
+            self._features[name] = ([r[1] for r in rows], block_ends, rows)
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def names(self):
+        return list(self.records)
+
+    def _record(self, name):
+        if name is None:
+            return self.index["records"][0]
+        return self.records[self._aliases.get(name, name)]
+
+    def length(self, name=None):
+        return self._record(name)["length"]
+
+    def _byte(self, r, pos):
+        line, col = divmod(pos, r["linebases"])
+        group = r.get("group") or r["linebases"]
+        return r["offset"] + line * r["linewidth"] + r.get("prefix", 0) + col + col // group
+
+    def fetch(self, name=None, start=0, end=None, strand=1):
+        """Bases [start, end) (0-based) of a record; strand -1 reverse-complements."""
+        r = self._record(name)
+        end = r["length"] if end is None else min(end, r["length"])
+        start = max(start, 0)
+        if end <= start:
+            return ""
+        raw = self._mm[self._byte(r, start):self._byte(r, end - 1) + 1]
+        if self.genbank:
+            seq = raw.translate(None, b"0123456789 \t\r\n").upper()
+        else:
+            seq = raw.translate(None, b"\r\n")
+        if strand == -1:
+            seq = seq.translate(_COMPLEMENT)[::-1]
+        return seq.decode("ascii")
+
+    def features(self, name=None, type=None, start=0, end=None, **qualifiers):
+        """Features of a record overlapping [start, end), optionally filtered by
+        type and exact qualifier values (gene="lacZ"); as dicts."""
+        r = self._record(name)
+        starts, block_ends, rows = self._features.get(r["name"], ([], [], []))
+        end = r["length"] if end is None else end
+        stop = bisect.bisect_left(starts, end)
+        candidates = (row for b, top in enumerate(block_ends[:-(-stop // FEATURE_BLOCK)])
+                      if top >= start
+                      for row in rows[b * FEATURE_BLOCK:min((b + 1) * FEATURE_BLOCK, stop)])
+        out = []
+        for row in candidates:
+            if row[2] <= start and not (row[1] == row[2] == start):
+                continue
+            if type is not None and row[0] != type:
+                continue
+            if any(row[5].get(k) != v for k, v in qualifiers.items()):
+                continue
+            out.append({"record": r["name"], "type": row[0], "start": row[1], "end": row[2],
+                        "strand": row[3], "parts": row[4], "qualifiers": row[5],
+                        "offset": row[6], "size": row[7]})
+        return out
+
+    def feature_sequence(self, feature):
+        """Spliced sequence of a feature, on its own strand."""
+        return "".join(self.fetch(feature["record"], s, e, strand)
+                       for s, e, strand in feature["parts"])
+
+    def feature_text(self, feature):
+        """The feature's full entry in the feature table (all qualifiers)."""
+        return self._mm[feature["offset"]:feature["offset"] + feature["size"]].decode("latin-1")
@@ -0,0 +1,377 @@
+"""
+Vectorized synthetic data generators for the notebook datasets.
+
+Genotypes are drawn as int8 blocks of samples x SNPs and streamed to disk
+one block at a time, so memory is bounded by the block size rather than the
+cohort size. Population structure follows the Balding-Nichols model;
+genotypes are in Hardy-Weinberg proportions within each population.
+
+Randomness comes from ``SeedStreams``: every (dataset, chunk) pair has its
+own ``numpy.random.SeedSequence`` child, and chunks have a fixed size, so
+blocks can be generated on a process pool in any order and the output is
+bit-identical whatever the worker count.
+"""
+
+import os
+import zlib
+
+import numpy as np
+
+try:  # imported by the downloader as a sibling, or as data.synthetic
+    from pool import run_chunks
+except ImportError:
+    from data.pool import run_chunks
+
+# Samples per genotype chunk, genes per count chunk and cells per sparse
+# count chunk. These fix the chunk -> seed mapping, so changing them changes
+# the generated data.
+CHUNK_SAMPLES = 256
+CHUNK_GENES = 2048
+CHUNK_CELLS = 2048
+# SNP columns drawn per uniform buffer inside a genotype chunk
+TILE_SNPS = 1 << 16
+
+# Stream keys under a dataset's root sequence
+PARAMS_STREAM = 0
+CHUNK_STREAM = 1
+
+
+class SeedStreams:
+    """Independent random streams for one dataset.
+
+    ``rng(PARAMS_STREAM)`` drives dataset-level draws (allele frequencies,
+    positions, effects); ``sequence(CHUNK_STREAM, i)`` seeds chunk i. The
+    children are the ones ``SeedSequence.spawn`` would hand out, addressed
+    by key so workers can rebuild any of them without the others.
+    """
+
+    def __init__(self, seed, dataset):
+        self.seed = seed
+        self.dataset = dataset
+        self.root = np.random.SeedSequence(
+            seed, spawn_key=(zlib.crc32(dataset.encode()),))
+
+    def sequence(self, *key):
+        return np.random.SeedSequence(self.root.entropy,
+                                      spawn_key=self.root.spawn_key + key)
+
+    def rng(self, *key):
+        return np.random.default_rng(self.sequence(*key))
+
+
+def sample_positions(rng, low, high, n):
+    """n distinct sorted integer positions in [low, high)."""
+    if n > high - low:
+        raise ValueError(f"cannot draw {n} distinct positions from [{low}, {high})")
+    pos = np.unique(rng.integers(low, high, size=n))
+    while len(pos) < n:
+        extra = rng.integers(low, high, size=n - len(pos))
+        pos = np.unique(np.concatenate([pos, extra]))
+    return pos
+
+
+def balding_nichols(rng, n_snps, n_pops, fst):
+    """Ancestral and per-population alternate allele frequencies.
+
+    Returns ``(ancestral, pop_afs)`` with ``pop_afs`` shaped (n_pops, n_snps).
+    Population frequencies are Beta(p(1-F)/F, (1-p)(1-F)/F) around the
+    ancestral frequency p, clipped to [0.001, 0.999].
+    """
+    ancestral = rng.beta(0.5, 0.5, size=n_snps)
+    a = ancestral * (1 - fst) / fst
+    b = (1 - ancestral) * (1 - fst) / fst
+    # Near-fixed ancestral alleles make Beta degenerate: keep them as-is
+    ok = (a > 0.01) & (b > 0.01)
+    pop_afs = np.tile(ancestral, (n_pops, 1))
+    pop_afs[:, ok] = rng.beta(a[ok], b[ok], size=(n_pops, ok.sum()))
+    return ancestral, np.clip(pop_afs, 0.001, 0.999)
+
+
+def hwe_thresholds(afs):
+    """Cumulative HWE genotype probabilities (P[0], P[0]+P[1]) for AF arrays."""
+    q = 1.0 - afs
+    hom_ref = q * q
+    return hom_ref, hom_ref + 2.0 * afs * q
+
+
+def hwe_genotypes(rng, afs, n):
+    """Draw n samples of 0/1/2 alternate-allele counts in HWE at frequencies afs."""
+    hom_ref, het = hwe_thresholds(np.asarray(afs, dtype=np.float32))
+    u = rng.random((n, len(hom_ref)), dtype=np.float32)
+    return (u >= hom_ref).astype(np.int8) + (u >= het)
+
+
+_worker_thresholds = None
+
+
+def _set_thresholds(pop_afs):
+    global _worker_thresholds
+    _worker_thresholds = hwe_thresholds(pop_afs.astype(np.float32))
+
+
+def _genotype_chunk(task):
+    """Draw one chunk of samples (runs in a worker process)."""
+    seq, pops = task
+    hom_ref, het = _worker_thresholds
+    rng = np.random.default_rng(seq)
+    n_snps = hom_ref.shape[1]
+    block = np.empty((len(pops), n_snps), dtype=np.int8)
+    u = None
+    # Runs of consecutive samples from the same population
+    bounds = np.flatnonzero(np.diff(pops)) + 1
+    runs = list(zip(np.r_[0, bounds], np.r_[bounds, len(pops)]))
+    for s0 in range(0, n_snps, TILE_SNPS):
+        s1 = min(s0 + TILE_SNPS, n_snps)
+        if u is None or u.shape[1] != s1 - s0:
+            u = np.empty((len(pops), s1 - s0), dtype=np.float32)
+        rng.random(dtype=np.float32, out=u)
+        for lo, hi in runs:
+            pop = pops[lo]
+            out = block[lo:hi, s0:s1]
+            np.greater_equal(u[lo:hi], hom_ref[pop, s0:s1], out=out, casting="unsafe")
+            out += u[lo:hi] >= het[pop, s0:s1]
+    return block
+
+
+def genotype_blocks(streams, pop_afs, sample_pop, jobs=None):
+    """Yield ``(start, block)`` int8 genotype blocks over samples.
+
+    ``sample_pop`` gives each sample's row index into ``pop_afs``. Blocks are
+    CHUNK_SAMPLES samples (a multiple of four, keeping them byte-aligned in
+    2-bit packed stores), each drawn from its own seed stream, so the result
+    does not depend on ``jobs``.
+    """
+    sample_pop = np.asarray(sample_pop)
+    starts = range(0, len(sample_pop), CHUNK_SAMPLES)
+    tasks = ((streams.sequence(CHUNK_STREAM, i), sample_pop[start:start + CHUNK_SAMPLES])
+             for i, start in enumerate(starts))
+    blocks = run_chunks(_genotype_chunk, tasks, jobs,
+                        initializer=_set_thresholds, initargs=(pop_afs,))
+    yield from zip(starts, blocks)
+
+
+def write_genotype_csv(path, id_column, sample_ids, snp_labels, blocks):
+    """Write genotype blocks as a wide CSV (one row per sample).
+
+    The file is written to ``path + ".part"`` and renamed when complete.
+    """
+    n_snps = len(snp_labels)
+    n_rows = 0
+    with open(path + ".part", "wb") as f:
+        f.write((",".join([id_column, *snp_labels]) + "\n").encode())
+        buf = None  # reusable "g,g,...,g\n" row template as raw bytes
+        for start, block in blocks:
+            if buf is None or len(buf) < len(block):
+                buf = np.full((len(block), 2 * n_snps), ord(","), dtype=np.uint8)
+                buf[:, -1] = ord("\n")
+            buf[:len(block), 0::2] = block + ord("0")
+            for i in range(len(block)):
+                f.write(sample_ids[start + i].encode() + b"," + buf[i].tobytes())
+            n_rows += len(block)
+    os.replace(path + ".part", path)
+    return n_rows
+
+
+def stratified_panel(streams, pop_sizes, n_snps, fst):
+    """Set up a population-stratified panel.
+
+    Returns ``(rng, pop_names, sample_pop, pop_afs)``, with rng the dataset's
+    parameter stream; draw genotypes with
+    ``genotype_blocks(streams, pop_afs, sample_pop)``.
+    """
+    rng = streams.rng(PARAMS_STREAM)
+    pop_names = list(pop_sizes)
+    sample_pop = np.repeat(np.arange(len(pop_names)), list(pop_sizes.values()))
+    _, pop_afs = balding_nichols(rng, n_snps, len(pop_names), fst)
+    return rng, pop_names, sample_pop, pop_afs
+
+
+def scale_sizes(sizes, total):
+    """Rescale group sizes to sum to total, keeping their proportions."""
+    weights = np.array(list(sizes.values()), dtype=float)
+    counts = np.floor(weights / weights.sum() * total).astype(int)
+    counts[: total - counts.sum()] += 1
+    return dict(zip(sizes, counts.tolist()))
+
+
+# ---------------------------------------------------------------------------
+# RNA-seq counts
+# ---------------------------------------------------------------------------
+def nb_dispersion(mean):
+    """Mean-dependent negative-binomial dispersion (high for low counts)."""
+    return 0.1 + 1.0 / np.sqrt(mean + 1.0)
+
+
+def de_log2fc(rng, n_genes, n_up, n_down, n_de):
+    """Per-gene log2 fold change under treatment.
+
+    The first n_up genes rise 2-5x, the next n_down fall to 0.15-0.45x, and
+    the remaining genes up to n_de shift by 0.5-2 log2 units either way.
+    """
+    lfc = np.zeros(n_genes)
+    lfc[:n_up] = np.log2(rng.uniform(2.0, 5.0, n_up))
+    lfc[n_up:n_up + n_down] = np.log2(rng.uniform(0.15, 0.45, n_down))
+    n_rand = max(0, min(n_de, n_genes) - n_up - n_down)
+    lfc[n_up + n_down:n_up + n_down + n_rand] = (
+        rng.choice([-1, 1], n_rand) * rng.uniform(0.5, 2.0, n_rand))
+    return lfc
+
+
+def _count_chunk(task):
+    """Draw one chunk of genes (runs in a worker process)."""
+    seq, base_means, lfc, lib, treated = task
+    rng = np.random.default_rng(seq)
+    effect = np.where(treated, 2.0 ** lfc[:, None], 1.0)
+    mu = base_means[:, None] * lib * effect
+    shape = np.maximum(0.1, 1.0 / nb_dispersion(mu))
+    return rng.poisson(rng.gamma(shape, mu / shape))
+
+
+def nb_count_blocks(streams, base_means, lfc, lib_factors, treated, jobs=None):
+    """Yield ``(start, counts)`` int64 blocks of genes x samples.
+
+    Counts are gamma-Poisson (negative binomial) draws around
+    base_mean * library factor * 2**lfc (treated samples only). Each
+    CHUNK_GENES block has its own seed stream, so the result does not
+    depend on ``jobs``.
+    """
+    lib = np.asarray(lib_factors, dtype=float)
+    treated = np.asarray(treated, dtype=bool)
+    starts = range(0, len(base_means), CHUNK_GENES)
+    tasks = ((streams.sequence(CHUNK_STREAM, i), base_means[start:start + CHUNK_GENES],
+              lfc[start:start + CHUNK_GENES], lib, treated)
+             for i, start in enumerate(starts))
+    yield from zip(starts, run_chunks(_count_chunk, tasks, jobs))
+
+
+def write_counts_csv(path, gene_names, sample_ids, blocks):
+    """Write gene x sample count blocks as CSV (via ``.part`` + rename)."""
+    n_rows = 0
+    with open(path + ".part", "w", newline="") as f:
+        f.write(",".join(["gene_id", *sample_ids]) + "\n")
+        for start, block in blocks:
+            f.writelines(f"{gene_names[start + i]},{','.join(map(str, row))}\n"
+                         for i, row in enumerate(block.tolist()))
+            n_rows += len(block)
+    os.replace(path + ".part", path)
+    return n_rows
+
+
+# ---------------------------------------------------------------------------
+# Single-cell counts
+# ---------------------------------------------------------------------------
+_worker_cdfs = None
+
+
+def _set_profiles(profiles):
+    global _worker_cdfs
+    cdfs = np.cumsum(profiles / profiles.sum(axis=1, keepdims=True), axis=1)
+    cdfs[:, -1] = 1.0
+    _worker_cdfs = cdfs
+
+
+def _sparse_count_chunk(task):
+    """Draw one chunk of cells as CSR parts (runs in a worker process)."""
+    seq, profile, lib = task
+    rng = np.random.default_rng(seq)
+    n_cells, n_genes = len(profile), _worker_cdfs.shape[1]
+    umis = rng.poisson(lib)
+    keys = []
+    for p in np.unique(profile):
+        cells = np.flatnonzero(profile == p)
+        genes = np.searchsorted(_worker_cdfs[p], rng.random(umis[cells].sum()), side="right")
+        keys.append(np.repeat(cells.astype(np.int64), umis[cells]) * n_genes + genes)
+    keys, counts = np.unique(np.concatenate(keys), return_counts=True)
+    rows = keys // n_genes
+    indptr = np.zeros(n_cells + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_cells), out=indptr[1:])
+    return counts.astype(np.float32), (keys - rows * n_genes).astype(np.int32), indptr
+
+
+def sparse_count_blocks(streams, profiles, cell_profile, library_sizes, jobs=None):
+    """Yield ``(start, (data, indices, indptr))`` CSR blocks of cells x genes.
+
+    Each cell draws Poisson(library size) UMIs from its row of ``profiles``
+    (relative expression per gene), so a block holds only the genes its
+    cells actually express. Each CHUNK_CELLS block has its own seed stream,
+    so the result does not depend on ``jobs``.
+    """
+    cell_profile = np.asarray(cell_profile)
+    lib = np.asarray(library_sizes, dtype=float)
+    starts = range(0, len(cell_profile), CHUNK_CELLS)
+    tasks = ((streams.sequence(CHUNK_STREAM, i), cell_profile[start:start + CHUNK_CELLS],
+              lib[start:start + CHUNK_CELLS])
+             for i, start in enumerate(starts))
+    blocks = run_chunks(_sparse_count_chunk, tasks, jobs,
+                        initializer=_set_profiles, initargs=(np.asarray(profiles, float),))
+    yield from zip(starts, blocks)
+
+
+def _h5ad_attrs(node, encoding, version):
+    node.attrs["encoding-type"] = encoding
+    node.attrs["encoding-version"] = version
+
+
+def _h5ad_strings(group, name, values):
+    import h5py
+    ds = group.create_dataset(name, data=np.asarray(values, dtype=object),
+                              dtype=h5py.string_dtype())
+    _h5ad_attrs(ds, "string-array", "0.2.0")
+
+
+def _h5ad_dataframe(group, name, index, columns):
+    """An AnnData dataframe: str index plus categorical / array columns."""
+    df = group.create_group(name)
+    _h5ad_attrs(df, "dataframe", "0.2.0")
+    df.attrs["_index"] = "_index"
+    # h5py has no empty string array; anndata writes an empty float one
+    df.attrs["column-order"] = list(columns) if columns else np.zeros(0)
+    _h5ad_strings(df, "_index", index)
+    for col, values in columns.items():
+        if isinstance(values, tuple):  # (codes, categories)
+            codes, categories = values
+            cat = df.create_group(col)
+            _h5ad_attrs(cat, "categorical", "0.2.0")
+            cat.attrs["ordered"] = False
+            cat.create_dataset("codes", data=codes)
+            _h5ad_strings(cat, "categories", categories)
+        else:
+            ds = df.create_dataset(col, data=values)
+            _h5ad_attrs(ds, "array", "0.2.0")
+
+
+def write_h5ad(path, blocks, shape, obs_names, var_names, obs=None, var=None):
+    """Write CSR cell blocks as an AnnData .h5ad (via ``.part`` + rename).
+
+    ``blocks`` yields ``(start, (data, indices, indptr))`` row blocks, as from
+    sparse_count_blocks, and X is appended to resizable HDF5 datasets, so
+    memory is bounded by one block. ``obs`` / ``var`` map column names to
+    arrays or ``(codes, categories)`` pairs (categoricals). Needs h5py.
+    """
+    import h5py
+    n_obs, n_vars = shape
+    nnz = 0
+    with h5py.File(path + ".part", "w") as f:
+        _h5ad_attrs(f, "anndata", "0.1.0")
+        x = f.create_group("X")
+        _h5ad_attrs(x, "csr_matrix", "0.1.0")
+        x.attrs["shape"] = np.array(shape, dtype=np.int64)
+        data = x.create_dataset("data", (0,), np.float32, maxshape=(None,), chunks=(1 << 18,))
+        # One index dtype for both arrays, as scipy expects; int32 if nnz must fit
+        index_dtype = np.int32 if n_obs * n_vars < 2 ** 31 else np.int64
+        indices = x.create_dataset("indices", (0,), index_dtype, maxshape=(None,),
+                                   chunks=(1 << 18,))
+        indptr = x.create_dataset("indptr", (n_obs + 1,), index_dtype)
+        for start, (d, i, p) in blocks:
+            data.resize((nnz + len(d),))
+            indices.resize((nnz + len(d),))
+            data[nnz:] = d
+            indices[nnz:] = i
+            indptr[start:start + len(p)] = p + nnz
+            nnz += len(d)
+        _h5ad_dataframe(f, "obs", obs_names, obs or {})
+        _h5ad_dataframe(f, "var", var_names, var or {})
+        for name in ("obsm", "obsp", "varm", "varp", "layers", "uns"):
+            _h5ad_attrs(f.create_group(name), "dict", "0.1.0")
+    os.replace(path + ".part", path)
+    return nnz
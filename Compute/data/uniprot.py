@@ -0,0 +1,151 @@
+"""
+Streaming UniProtKB search client with cursor pagination.
+
+Results are requested as TSV pages from the ``search`` endpoint; each page
+is parsed line by line off the socket and the ``Link: <...>; rel="next"``
+header supplies the cursor URL of the following page, so the full reviewed
+proteome (20k+ entries) is read one page at a time. A page that fails is
+retried from its cursor instead of restarting at the first page. Records
+are written in fixed-size batches to CSV, or to Parquet when the target
+ends in ``.parquet`` (requires pyarrow).
+
+    n = write_proteome("data/nb01/human_proteome_lengths.csv", [9606])
+"""
+
+import io
+import os
+import re
+import time
+import http.client
+import urllib.request
+import urllib.error
+import urllib.parse
+
+try:  # imported by the downloader as a sibling, or as data.uniprot
+    from batchio import batched, open_batch_writer
+except ImportError:
+    from data.batchio import batched, open_batch_writer
+
+UNIPROT_REST_URL = "https://rest.uniprot.org/uniprotkb"
+USER_AGENT = "BioNotebook/1.0"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# UniProt return fields -> output column names
+PROTEOME_FIELDS = {
+    "accession": "accession",
+    "gene_primary": "gene",
+    "length": "length",
+    "protein_name": "protein_name",
+}
+
+_NEXT_LINK = re.compile(r'<([^>]+)>\s*;\s*rel="?next"?')
+
+
+def next_link(link_header):
+    """The rel="next" URL from a Link header, or None on the last page."""
+    match = _NEXT_LINK.search(link_header or "")
+    return match.group(1) if match else None
+
+
+def _open(url, timeout, max_retries=5, backoff=1.0):
+    """urlopen with exponential backoff on connection errors and 429/5xx."""
+    req = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+    for attempt in range(max_retries + 1):
+        try:
+            return urllib.request.urlopen(req, timeout=timeout)
+        except urllib.error.HTTPError as e:
+            if e.code not in RETRY_STATUSES or attempt == max_retries:
+                raise
+            retry_after = e.headers.get("Retry-After", "")
+            delay = float(retry_after) if retry_after.isdigit() else backoff * 2 ** attempt
+        except urllib.error.URLError:
+            if attempt == max_retries:
+                raise
+            delay = backoff * 2 ** attempt
+        time.sleep(delay)
+
+
+def _read_page(url, n_fields, timeout):
+    """(rows, next cursor URL) of one search page."""
+    rows = []
+    with _open(url, timeout) as response:
+        next_url = next_link(response.headers.get("Link"))
+        lines = io.TextIOWrapper(response, encoding="utf-8", newline="")
+        next(lines, None)  # every page repeats the header row
+        for line in lines:
+            line = line.rstrip("\r\n")
+            if line:
+                values = line.split("\t")
+                values += [""] * (n_fields - len(values))
+                rows.append(values[:n_fields])
+    return rows, next_url
+
+
+def iter_records(query, fields, base_url=UNIPROT_REST_URL, page_size=500, timeout=120,
+                 max_retries=5, backoff=1.0):
+    """Yield one list of TSV field values per entry matching query.
+
+    Pages are fetched one at a time by following the cursor in each
+    response's Link header; only the current page is held in memory. A
+    page whose transfer breaks off is fetched again from the same cursor
+    (with exponential backoff), so a failure late in the proteome does not
+    restart it from the first page.
+    """
+    url = f"{base_url}/search?" + urllib.parse.urlencode({
+        "query": query, "fields": ",".join(fields),
+        "format": "tsv", "size": page_size})
+    while url:
+        for attempt in range(max_retries + 1):
+            try:
+                rows, next_url = _read_page(url, len(fields), timeout)
+                break
+            except (http.client.HTTPException, ConnectionError, TimeoutError):
+                # The transfer broke off mid-page (_open already retries
+                # failures to connect and error statuses)
+                if attempt == max_retries:
+                    raise
+                time.sleep(backoff * 2 ** attempt)
+        yield from rows
+        url = next_url
+
+
+def write_proteome(path, organism_ids, reviewed=True, base_url=UNIPROT_REST_URL,
+                   page_size=500, batch_size=5000):
+    """Stream the (reviewed) proteome of each organism into path.
+
+    With several organisms an ``organism_id`` column is added. The file is
+    written under ``path + ".part"`` and renamed when complete; returns the
+    number of entries written.
+    """
+    organism_ids = [int(o) for o in organism_ids]
+    columns = list(PROTEOME_FIELDS.values())
+    if len(organism_ids) > 1:
+        columns.append("organism_id")
+
+    def records():
+        for organism in organism_ids:
+            query = f"organism_id:{organism}"
+            if reviewed:
+                query += " AND reviewed:true"
+            for values in iter_records(query, list(PROTEOME_FIELDS), base_url, page_size):
+                # Lengths are integers; Parquet stores them as int32
+                values[2] = int(values[2]) if values[2].isdigit() else None
+                if len(columns) > len(values):
+                    values.append(organism)
+                yield values
+
+    part = path + ".part"
+    writer = open_batch_writer(part, columns,
+                               int_columns=("length", "organism_id"))
+    n = 0
+    try:
+        for batch in batched(records(), batch_size):
+            writer.write(batch)
+            n += len(batch)
+    except BaseException:
+        writer.close()
+        os.remove(part)
+        raise
+    writer.close()
+    os.replace(part, path)
+    return n